@@ -4,46 +4,136 @@ import json
 import sys
 import shutil
 import subprocess
-import winsound
 import zipfile
+import tarfile
 import hashlib
+import mmap
+import errno
+import argparse
+import tempfile
+import multiprocessing
+import atexit
+import copy
+import weakref
+import heapq
+import csv
+import fnmatch
+import itertools
+import sqlite3
 import threading
-import requests
 import webbrowser 
 from datetime import datetime, timedelta
 from pathlib import Path
-from concurrent.futures import ThreadPoolExecutor
+from types import MappingProxyType
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+# --- БЛОК 0: ИМПОРТЫ ---
+# Обязателен только watchdog (ядро сортировки). Зависимости интерфейсов (rich, Flask,
+# pystray, PIL, plyer, mutagen, requests) загружаются при первом использовании подсистемы,
+# поэтому пакетный режим стартует быстро и работает без них.
+def _missing_dependency(error, packages):
+    print("❌ КРИТИЧЕСКАЯ ОШИБКА ИМПОРТА:")
+    print(f"Не найден модуль: {error}. Пожалуйста, вручную установите зависимости:")
+    print(f"pip install {packages}")
+    sys.exit(1)
 
-# --- БЛОК 0: СТРОГИЕ ИМПОРТЫ ---
 try:
     from watchdog.observers import Observer
     from watchdog.events import FileSystemEventHandler
-    from rich.console import Console
-    from rich.table import Table
-    from rich.panel import Panel
-    from rich.layout import Layout
-    from rich.live import Live
-    from rich.text import Text
-    from rich.align import Align
-    from rich.prompt import Prompt
-    from rich import box
-    from plyer import notification
-    # PIL должен быть импортирован до pystray для корректной работы иконки
-    from PIL import Image
-    from pystray import Icon as TrayIcon, Menu as TrayMenu, MenuItem as TrayMenuItem
-    from mutagen.mp3 import MP3
-    from mutagen.id3 import ID3NoHeaderError
-    from flask import Flask, render_template_string, redirect, url_for, request, flash 
 except ImportError as e:
-    print("❌ КРИТИЧЕСКАЯ ОШИБКА ИМПОРТА:")
-    print(f"Не найден модуль: {e}. Пожалуйста, вручную установите все зависимости:")
-    print("pip install watchdog rich plyer pystray Pillow Flask mutagen")
-    sys.exit(1)
+    _missing_dependency(e, "watchdog")
+
+# Звуковые уведомления есть только в Windows
+try: import winsound
+except ImportError: winsound = None
+
+def load_tui_modules():
+    global Console, Table, Panel, Layout, Live, Text, Align, Prompt, box
+    try:
+        from rich.console import Console
+        from rich.table import Table
+        from rich.panel import Panel
+        from rich.layout import Layout
+        from rich.live import Live
+        from rich.text import Text
+        from rich.align import Align
+        from rich.prompt import Prompt
+        from rich import box
+    except ImportError as e:
+        _missing_dependency(e, "rich")
+
+def load_web_modules():
+    global Flask, render_template_string, redirect, url_for, request, flash
+    try:
+        from flask import Flask, render_template_string, redirect, url_for, request, flash
+    except ImportError as e:
+        _missing_dependency(e, "Flask")
+
+def load_tray_modules():
+    global Image, TrayIcon, TrayMenu, TrayMenuItem
+    try:
+        # PIL должен быть импортирован до pystray для корректной работы иконки
+        from PIL import Image
+        from pystray import Icon as TrayIcon, Menu as TrayMenu, MenuItem as TrayMenuItem
+    except ImportError as e:
+        _missing_dependency(e, "pystray Pillow")
+
+def notify_popup(title, message, timeout):
+    # Системные Pop-up необязательны: без plyer просто не показываем
+    try: from plyer import notification
+    except ImportError: return
+    try: notification.notify(title=title, message=message, app_name=APP_NAME, timeout=timeout)
+    except Exception: pass
 
 
 # --- ГЛОБАЛЬНЫЕ КОНСТАНТЫ ---
 CONFIG_FILE = "settings_rus.json"
 LOG_FILE = "history.log"
+INDEX_FILE = "x4_index.db"
+STATS_FILE = "stats_rus.json"
+# Как часто проверять mtime файла настроек на внешние изменения (сек.)
+CONFIG_POLL_INTERVAL = 2.0
+# Как часто опрашивать размер/mtime файлов, ожидающих завершения записи (сек.)
+STABILIZE_POLL_INTERVAL = 0.5
+# Приоритеты очереди обработки: события watchdog раньше массового сканирования
+PRIORITY_LIVE = 0
+PRIORITY_BULK = 1
+# Сверх лимита очереди оставляем место для живых событий, чтобы скан их не вытеснял
+QUEUE_LIVE_RESERVE = 100
+# Статистика сбрасывается на диск каждые N событий или раз в N секунд
+STATS_FLUSH_EVERY = 100
+STATS_FLUSH_INTERVAL = 5.0
+# Верхняя граница числа записей истории первого обнаружения файлов
+FIRST_SEEN_MAX_ENTRIES = 200000
+# Даты первого обнаружения пишутся в базу пачками (поток фиксации журнала или по заполнении)
+FIRST_SEEN_BATCH = 500
+# Журнал операций: x4_journal.<pid>-<время запуска>.journal в каталоге скрипта
+JOURNAL_PREFIX = "x4_journal"
+JOURNAL_SUFFIX = ".journal"
+# Поток фиксации при простое просыпается раз в N секунд; журнал без открытых операций
+# обрезается, когда вырастает больше JOURNAL_COMPACT_BYTES
+JOURNAL_COMMIT_INTERVAL = 1.0
+JOURNAL_COMPACT_BYTES = 1024 * 1024
+DUPLICATES_REPORT_FILE = "duplicates_report.json"
+# Поля записи плана сортировки (JSON/CSV)
+PLAN_FIELDS = ["action", "source", "target", "category", "original", "reason", "size", "mtime_ns"]
+# Архивы, которые распаковываются средствами стандартной библиотеки (.tar.gz и т.п. — по последнему суффиксу)
+ARCHIVE_EXTENSIONS = (".zip", ".tar", ".tgz", ".tbz2", ".txz", ".gz", ".bz2", ".xz")
+TAR_EXTENSIONS = (".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tbz2", ".tar.xz", ".txz")
+# Проверка степени сжатия включается после стольких распакованных байт (мелкие файлы сжимаются сильно)
+UNPACK_RATIO_MIN_BYTES = 16 * 1024 * 1024
+# Члены zip распаковываются параллельно, если архив не меньше этого размера
+UNPACK_PARALLEL_MIN_BYTES = 32 * 1024 * 1024
+# Размер блока для частичного хэша (начало + конец файла)
+PARTIAL_HASH_BLOCK = 64 * 1024
+# Буфер чтения для хэширования и порог, с которого файл хэшируется через mmap
+HASH_BUFFER_SIZE = 1024 * 1024
+MMAP_THRESHOLD = 64 * 1024 * 1024
+# Порция копирования средствами ядра (copy_file_range/sendfile) при переносе между дисками
+KERNEL_COPY_CHUNK = 64 * 1024 * 1024
+# Политика fsync при переносе: none — без fsync, file — копия между дисками, full — еще и папка назначения
+FSYNC_POLICIES = ("none", "file", "full")
+HASH_ALGORITHMS = [a for a in ["blake2b", "sha256", "sha1", "sha512", "md5", "sha3_256"] if a in hashlib.algorithms_available]
 APP_NAME = "X4 SORTER"
 VERSION = "ULTRA STABLE v10.1" 
 DUPLICATE_FOLDER = "98_Дубликаты"
@@ -73,21 +163,48 @@ DEFAULT_CONFIG = {
     "first_run_date": datetime.now().strftime("%Y-%m-%d %H:%M:%S"), 
     "source_folder": str(Path.home() / "Downloads"), 
     "base_destination": str(Path(__file__).resolve().parent), 
-    "stats": {
-        "total_files": 0, 
-        "last_run": "", 
-        "file_type_counts": {},
-        "file_first_seen": {} 
-    },
     "features": {
         "sort_by_date": True, 
         "sound_enabled": True,
         "notifications": True,
         "auto_unpack": False,
+        # Ограничения распаковки (защита от zip-бомб): всего MB, степень сжатия, число файлов
+        "unpack_max_total_mb": 4096,
+        "unpack_max_ratio": 200,
+        "unpack_max_members": 20000,
+        # Потоков распаковки членов большого zip; отправлять распакованные файлы на сортировку
+        "unpack_workers": 4,
+        "unpack_resort": False,
         "deep_clean": True,
         "deduplication": True,
+        # tiered: размер -> частичный хэш -> SHA256; full: всегда полный SHA256
+        "dedup_mode": "tiered",
+        # folder: дубликаты ищутся в целевой папке; global: во всей папке назначения (кроме Карантина)
+        "dedup_scope": "folder",
+        # Алгоритм хэширования для дедупликации (hashlib): blake2b, sha256, sha1, ...
+        "hash_algorithm": "sha256",
+        # Перечитывать и сверять копию при переносе между дисками
+        "verify_copy": False,
+        # fsync при переносе: none / file (копии между дисками) / full (плюс запись папки)
+        "fsync_policy": "file",
+        # Сколько секунд размер и mtime нового файла должны не меняться перед обработкой
+        "stable_window_sec": 2.0,
+        # Число потоков обработки файлов и предел очереди (при заполнении постановка ждет)
+        "worker_threads": 5,
+        "queue_max": 1000,
+        # Рекурсивное наблюдение за подпапками источника (до recursive_max_depth уровней)
+        "recursive_watch": False,
+        "recursive_max_depth": 5,
+        # Сохранять относительный путь подпапки внутри категории назначения
+        "preserve_subfolders": False,
+        # Журнал операций: намерение переноса фиксируется до перемещения, сбой восстанавливается при запуске
+        "operation_journal": True,
+        # Фоновая индексация хэшей уже существующих файлов в папке назначения
+        "index_warmup": True,
         "quarantine_mode": True, 
         "retention_days": 30,
+        # Сколько дней хранить историю первого обнаружения файлов (0 = без срока)
+        "first_seen_retention_days": 365,
         "sort_by_metadata": True
     },
     "telegram": {
@@ -101,8 +218,12 @@ DEFAULT_CONFIG = {
         "notify_quarantine": True, 
         "notify_success": True 
     },
+    # Дополнительные источники: [{"source_folder": ..., "base_destination": ..., "features": {переопределения}}]
+    "extra_sources": [],
     "quarantine_blacklist": [".exe", ".bat", ".vbs", ".js", ".apk", ".msi"],
-    "ignore_list": [".tmp", ".crdownload", ".part", ".ini", "desktop.ini", CONFIG_FILE, LOG_FILE]
+    "ignore_list": [".tmp", ".crdownload", ".part", ".ini", "desktop.ini", CONFIG_FILE, LOG_FILE],
+    # Шаблоны имен подпапок (fnmatch), которые не обходятся в рекурсивном режиме
+    "recursive_ignore": [".git", ".svn", "node_modules", "__pycache__", ".venv", "venv", "$RECYCLE.BIN", "System Volume Information"]
 }
 
 # --- ЦВЕТОВЫЕ ТЕМЫ ---
@@ -113,27 +234,120 @@ THEMES = {
     "Royal": {"primary": "#ffcc00", "secondary": "#ccaa00", "dark": "#282810", "medium": "#383815", "text": "black", "border": "gold1", "accent": "#ffdd55"}
 }
 
-# Инициализация консоли Rich
-console = Console()
-
 # --- МЕНЕДЖЕР НАСТРОЕК ---
+def _freeze(value):
+    # Неизменяемая копия настроек: dict -> MappingProxyType, list -> tuple
+    if isinstance(value, dict): return MappingProxyType({k: _freeze(v) for k, v in value.items()})
+    if isinstance(value, list): return tuple(_freeze(v) for v in value)
+    return value
+
 class ConfigManager:
-    """Управляет загрузкой, сохранением и целостностью файла настроек."""
+    """Управляет загрузкой, сохранением и целостностью файла настроек.
+
+    Хранит неизменяемый снимок настроек (snapshot), который перечитывается с диска
+    только при изменении mtime/размера файла или после записи новых значений;
+    подписчики получают новый снимок при каждом изменении.
+    Запись идет под локом через временный файл и os.replace, а self.data
+    заменяется целиком (copy-on-write), поэтому читатели не блокируются и
+    никогда не видят наполовину записанный файл.
+    """
     def __init__(self):
+        self.path = Path(__file__).resolve().parent / CONFIG_FILE
+        self._lock = threading.RLock()
+        self._file_sig = None
+        self._snapshot = None
+        self._subscribers = []
+        self._watch_thread = None
+        # До enable_persistence() настройки живут только в памяти: импорт модуля
+        # и команды без интерфейса не создают и не переписывают settings_rus.json
+        self.persistent = False
+        self._unsaved = False
+        self._broken = False
         self.data = self.load()
         self.update_theme()
 
-    def load(self):
-        path = Path(__file__).resolve().parent / CONFIG_FILE
-        if not path.exists(): return self.save(DEFAULT_CONFIG)
+    def enable_persistence(self):
+        """Разрешает запись настроек на диск и сохраняет отложенные изменения (дефолты, миграции)."""
+        with self._lock:
+            self.persistent = True
+            if self._broken:
+                self._broken = False
+                self._backup_broken()
+            if self._unsaved: self.save()
+
+    def _signature(self):
         try:
-            with open(path, 'r', encoding='utf-8') as f: data = json.load(f)
-            # Всегда проверяем целостность после загрузки
-            return self.check_integrity(data) 
-        except Exception as e: 
-            # Если файл битый, сбрасываем на дефолтные
-            print(f"⚠️ Предупреждение: Ошибка чтения настроек ({e}). Использование настроек по умолчанию.")
-            return self.save(DEFAULT_CONFIG)
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def load(self):
+        with self._lock:
+            sig = self._signature()
+            if sig is None:
+                # Файл пропал на время атомарной записи редактором (или удален) — работаем
+                # с текущим снимком, дефолтные настройки пишутся только при первом запуске
+                if self._snapshot is not None:
+                    self._file_sig = None
+                    return self.data
+                return self.save(copy.deepcopy(DEFAULT_CONFIG))
+            # Файл не менялся с последнего чтения/записи — диск не трогаем
+            if sig == self._file_sig and self._snapshot is not None: return self.data
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f: data = json.load(f)
+                self._file_sig = sig
+                # Всегда проверяем целостность после загрузки
+                self.data = self.check_integrity(data)
+                self._publish()
+                return self.data
+            except Exception as e: 
+                if self._snapshot is not None:
+                    # Рабочие настройки уже в памяти — не затираем их дефолтными
+                    self._file_sig = sig
+                    print(f"⚠️ Предупреждение: Ошибка чтения настроек ({e}). Продолжаем с текущими настройками.")
+                    return self.data
+                # Если файл битый при запуске, сохраняем его копию и сбрасываем на дефолтные
+                if self.persistent: self._backup_broken()
+                else: self._broken = True
+                print(f"⚠️ Предупреждение: Ошибка чтения настроек ({e}). Использование настроек по умолчанию.")
+                return self.save(copy.deepcopy(DEFAULT_CONFIG))
+
+    def _backup_broken(self):
+        backup = self.path.with_name(f"{self.path.name}.broken_{datetime.now().strftime('%Y%m%d_%H%M%S')}")
+        try: shutil.copy2(self.path, backup)
+        except OSError: pass
+
+    def snapshot(self):
+        """Текущий неизменяемый снимок настроек (без обращения к диску)."""
+        return self._snapshot
+
+    def subscribe(self, callback):
+        """Подписка на изменения настроек: callback(snapshot). Методы объектов хранятся по слабой ссылке."""
+        ref = weakref.WeakMethod(callback) if hasattr(callback, '__self__') else (lambda: callback)
+        self._subscribers.append(ref)
+        if not self._watch_thread:
+            self._watch_thread = threading.Thread(target=self._worker_watch, daemon=True)
+            self._watch_thread.start()
+
+    def _publish(self):
+        self._snapshot = _freeze(self.data)
+        self.update_theme()
+        alive = []
+        for ref in self._subscribers:
+            callback = ref()
+            if callback is None: continue
+            alive.append(ref)
+            try: callback(self._snapshot)
+            except Exception as e: print(f"⚠️ Ошибка обработчика изменения настроек: {e}")
+        self._subscribers = alive
+
+    def _worker_watch(self):
+        # Один stat файла раз в CONFIG_POLL_INTERVAL вместо чтения JSON на каждый файл
+        while True:
+            time.sleep(CONFIG_POLL_INTERVAL)
+            try: self.load()
+            except Exception: pass
 
     def check_integrity(self, data):
         changed = False
@@ -143,7 +357,7 @@ class ConfigManager:
             # Проверяем на наличие новых ключей из DEFAULT
             for k, v in default.items():
                 if k not in current:
-                    current[k] = v
+                    current[k] = copy.deepcopy(v)
                     changed = True
                 elif isinstance(v, dict) and isinstance(current.get(k), dict):
                     # Рекурсивный вызов для вложенных словарей
@@ -164,45 +378,68 @@ class ConfigManager:
         return data
 
     def save(self, data=None):
-        if data: self.data = data
-        path = Path(__file__).resolve().parent / CONFIG_FILE
-        try:
-             # Гарантируем корректное сохранение путей (Path в str)
-             temp_data = self.data.copy()
-             temp_data['source_folder'] = str(Path(temp_data['source_folder']).resolve())
-             temp_data['base_destination'] = str(Path(temp_data['base_destination']).resolve())
-             
-             with open(path, 'w', encoding='utf-8') as f:
-                json.dump(temp_data, f, indent=4, ensure_ascii=False)
-        except Exception as e:
-            print(f"⚠️ Предупреждение: Не удалось сохранить настройки в {path}. {e}")
-        return self.data
+        with self._lock:
+            if data: self.data = data
+            if not self.persistent:
+                self._unsaved = True
+                self._publish()
+                return self.data
+            self._unsaved = False
+            path = self.path
+            tmp_path = None
+            try:
+                 # Гарантируем корректное сохранение путей (Path в str)
+                 temp_data = self.data.copy()
+                 temp_data['source_folder'] = str(Path(temp_data['source_folder']).resolve())
+                 temp_data['base_destination'] = str(Path(temp_data['base_destination']).resolve())
+                 
+                 # Пишем во временный файл рядом и атомарно подменяем им настройки
+                 fd, tmp_path = tempfile.mkstemp(prefix=f"{CONFIG_FILE}.", suffix=".tmp", dir=str(path.parent))
+                 with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    json.dump(temp_data, f, indent=4, ensure_ascii=False)
+                    f.flush()
+                    os.fsync(f.fileno())
+                 for attempt in range(3):
+                     try:
+                         os.replace(tmp_path, path)
+                         break
+                     except PermissionError:
+                         # Windows: файл может быть кратковременно открыт читателем
+                         if attempt == 2: raise
+                         time.sleep(0.05)
+                 self._file_sig = self._signature()
+            except Exception as e:
+                if tmp_path:
+                    try: os.remove(tmp_path)
+                    except OSError: pass
+                print(f"⚠️ Предупреждение: Не удалось сохранить настройки в {path}. {e}")
+            self._publish()
+            return self.data
 
     def update_val(self, category, key, value):
-        if category:
-            if category not in self.data: self.data[category] = {} # Безопасность
-            self.data[category][key] = value
-        else:
-            self.data[key] = value
-        self.save()
-        self.update_theme()
+        self.update_vals([(category, key, value)])
 
-    def increment_stats(self, category_name=None, filename=None):
-        self.data["stats"]["total_files"] += 1
-        self.data["stats"]["last_run"] = datetime.now().strftime("%Y-%m-%d %H:%M")
-        
-        if category_name:
-            if category_name not in self.data["stats"]["file_type_counts"]:
-                 self.data["stats"]["file_type_counts"][category_name] = 0
-            self.data["stats"]["file_type_counts"][category_name] += 1
-
-        if filename and filename not in self.data["stats"]["file_first_seen"]:
-            self.data["stats"]["file_first_seen"][filename] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-        self.save()
+    def update_vals(self, changes):
+        """Применяет список изменений (category, key, value) одной записью и одним уведомлением подписчиков."""
+        # Copy-on-write: читатели продолжают видеть прежний словарь до подмены ссылки
+        with self._lock:
+            data = copy.deepcopy(self.data)
+            for category, key, value in changes:
+                if category:
+                    if category not in data: data[category] = {} # Безопасность
+                    data[category][key] = value
+                else:
+                    data[key] = value
+            self.save(data)
 
-    def get_file_first_seen(self, filename):
-        return self.data["stats"]["file_first_seen"].get(filename, "N/A")
+    def pop_legacy_stats(self):
+        # Статистика раньше хранилась прямо в settings_rus.json
+        with self._lock:
+            if "stats" not in self.data: return None
+            data = copy.deepcopy(self.data)
+            stats = data.pop("stats")
+            self.save(data)
+            return stats
 
     def update_theme(self):
         t_name = self.data.get("theme", "Hacker")
@@ -210,19 +447,1249 @@ class ConfigManager:
 
 cfg = ConfigManager()
 
+# --- ХРАНИЛИЩА SQLite ---
+class SqliteStore:
+    """База SQLite с ленивым подключением, общим для всех потоков и защищенным локом."""
+    def __init__(self, db_path):
+        self.db_path = Path(db_path)
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _create_schema(self, conn):
+        pass
+
+    def _db(self):
+        # Подключение создается лениво: модуль может импортироваться без работы с базой
+        if self._conn is None:
+            conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._create_schema(conn)
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def _execute(self, sql, params=(), fetch=False):
+        with self._lock:
+            conn = self._db()
+            cur = conn.execute(sql, params)
+            rows = cur.fetchall() if fetch else None
+            conn.commit()
+            return rows
+
+    def _executemany(self, sql, seq):
+        with self._lock:
+            conn = self._db()
+            conn.executemany(sql, seq)
+            conn.commit()
+
+class FirstSeenStore(SqliteStore):
+    """Дата первого обнаружения имени файла: поиск по первичному ключу, вытеснение старых записей.
+
+    Новые записи копятся в памяти и вставляются одной транзакцией (flush).
+    """
+    def __init__(self, db_path):
+        super().__init__(db_path)
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+
+    def _create_schema(self, conn):
+        conn.execute("""CREATE TABLE IF NOT EXISTS first_seen (
+            name TEXT PRIMARY KEY, seen_at TEXT NOT NULL, seen_ts REAL NOT NULL)""")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_first_seen_ts ON first_seen(seen_ts)")
+
+    def add(self, filename):
+        now = datetime.now()
+        with self._pending_lock:
+            self._pending.setdefault(filename, (now.strftime("%Y-%m-%d %H:%M:%S"), now.timestamp()))
+            flush_now = len(self._pending) >= FIRST_SEEN_BATCH
+        if flush_now: self.flush()
+
+    def get(self, filename):
+        with self._pending_lock:
+            pending = self._pending.get(filename)
+        rows = self._execute("SELECT seen_at FROM first_seen WHERE name = ?", (filename,), fetch=True)
+        # Запись в базе старше ожидающей вставки (INSERT OR IGNORE ее не заменит)
+        if rows: return rows[0][0]
+        return pending[0] if pending else "N/A"
+
+    def flush(self):
+        # Под _pending_lock до конца вставки, чтобы get не потерял запись между памятью и базой
+        with self._pending_lock:
+            if not self._pending: return
+            rows = [(name, seen_at, seen_ts) for name, (seen_at, seen_ts) in self._pending.items()]
+            self._executemany("INSERT OR IGNORE INTO first_seen (name, seen_at, seen_ts) VALUES (?, ?, ?)", rows)
+            self._pending = {}
+
+    def import_legacy(self, first_seen):
+        # Перенос словаря {имя: "ГГГГ-ММ-ДД ЧЧ:ММ:СС"} из старого формата статистики
+        rows = []
+        for name, seen_at in first_seen.items():
+            try:
+                seen_ts = datetime.strptime(seen_at, "%Y-%m-%d %H:%M:%S").timestamp()
+            except (TypeError, ValueError):
+                seen_ts = time.time()
+            rows.append((name, str(seen_at), seen_ts))
+        self._executemany("INSERT OR IGNORE INTO first_seen (name, seen_at, seen_ts) VALUES (?, ?, ?)", rows)
+
+    def evict(self, retention_days, max_entries):
+        """Удаляет записи старше retention_days (0 = без срока) и самые старые сверх max_entries."""
+        removed = 0
+        with self._lock:
+            conn = self._db()
+            if retention_days > 0:
+                cutoff = (datetime.now() - timedelta(days=retention_days)).timestamp()
+                removed += conn.execute("DELETE FROM first_seen WHERE seen_ts < ?", (cutoff,)).rowcount
+            if max_entries > 0:
+                removed += conn.execute(
+                    "DELETE FROM first_seen WHERE name IN (SELECT name FROM first_seen ORDER BY seen_ts DESC LIMIT -1 OFFSET ?)",
+                    (max_entries,)).rowcount
+            conn.commit()
+        return removed
+
+first_seen_store = FirstSeenStore(Path(__file__).resolve().parent / INDEX_FILE)
+
+# --- СТАТИСТИКА ---
+class StatsStore:
+    """Счетчики статистики в памяти с пакетной атомарной записью в отдельный компактный файл."""
+    def __init__(self, path):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._data = None
+        self._pending = 0
+        self._flush_thread = None
+
+    def _ensure_loaded(self):
+        # Вызывается под self._lock
+        if self._data is not None: return
+        data = {"total_files": 0, "last_run": "", "file_type_counts": {}}
+        migrated = None
+        if self.path.exists():
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f: data.update(json.load(f))
+            except Exception as e:
+                print(f"⚠️ Предупреждение: Ошибка чтения статистики ({e}). Счетчики начаты заново.")
+        else:
+            migrated = cfg.pop_legacy_stats()
+            if migrated: data.update(migrated)
+        # Даты первого обнаружения теперь хранятся в SQLite (FirstSeenStore)
+        legacy_first_seen = data.pop("file_first_seen", None)
+        if legacy_first_seen: first_seen_store.import_legacy(legacy_first_seen)
+        self._data = data
+        if migrated or legacy_first_seen is not None: self._pending = 1
+        if not self._flush_thread:
+            self._flush_thread = threading.Thread(target=self._worker_flush, daemon=True)
+            self._flush_thread.start()
+
+    def record_file(self, filename):
+        """Файл поступил в обработку: общий счетчик и дата первого обнаружения."""
+        with self._lock:
+            self._ensure_loaded()
+            self._data["total_files"] += 1
+            self._data["last_run"] = datetime.now().strftime("%Y-%m-%d %H:%M")
+            self._pending += 1
+            flush_now = self._pending >= STATS_FLUSH_EVERY
+        if filename: first_seen_store.add(filename)
+        if flush_now: self.flush()
+
+    def record_category(self, category_name):
+        with self._lock:
+            self._ensure_loaded()
+            counts = self._data["file_type_counts"]
+            counts[category_name] = counts.get(category_name, 0) + 1
+            self._pending += 1
+            flush_now = self._pending >= STATS_FLUSH_EVERY
+        if flush_now: self.flush()
+
+    def get_file_first_seen(self, filename):
+        return first_seen_store.get(filename)
+
+    def snapshot(self):
+        with self._lock:
+            self._ensure_loaded()
+            return {
+                "total_files": self._data["total_files"],
+                "last_run": self._data["last_run"],
+                "file_type_counts": dict(self._data["file_type_counts"]),
+            }
+
+    def flush(self):
+        with self._write_lock:
+            with self._lock:
+                if not self._pending or self._data is None: return
+                payload = json.dumps(self._data, ensure_ascii=False, separators=(',', ':'))
+                self._pending = 0
+            tmp_path = self.path.with_name(self.path.name + ".tmp")
+            try:
+                with open(tmp_path, 'w', encoding='utf-8') as f: f.write(payload)
+                os.replace(tmp_path, self.path)
+            except Exception as e:
+                print(f"⚠️ Предупреждение: Не удалось сохранить статистику в {self.path}. {e}")
+
+    def _worker_flush(self):
+        while True:
+            time.sleep(STATS_FLUSH_INTERVAL)
+            self.flush()
+            # Даты первого обнаружения копятся в FirstSeenStore и вставляются одной транзакцией
+            try: first_seen_store.flush()
+            except Exception as e: print(f"⚠️ Предупреждение: Не удалось сохранить даты обнаружения. {e}")
+
+stats_store = StatsStore(Path(__file__).resolve().parent / STATS_FILE)
+atexit.register(stats_store.flush)
+atexit.register(first_seen_store.flush)
+
+# --- ЖУРНАЛ ОПЕРАЦИЙ ---
+def _try_lock_file(f):
+    """Неблокирующая эксклюзивная блокировка открытого файла; False — файл держит другой процесс."""
+    try:
+        if os.name == 'nt':
+            import msvcrt
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except OSError:
+        return False
+
+# Итоги восстановления незавершенного переноса (для history.log)
+JOURNAL_OUTCOMES = {
+    "not_started": "Перенос не начинался, файл остался в источнике",
+    "rolled_back": "Недописанная копия удалена, файл остался в источнике",
+    "completed": "Перенос был завершен",
+    "replayed": "Хэш копии совпал с записанным: исходный файл удален, перенос завершен",
+    "lost": "Файл не найден ни в источнике, ни в папке назначения",
+}
+
+class OperationJournal:
+    """Журнал операций (write-ahead) с групповой фиксацией.
+
+    Перед копированием между дисками воркер записывает намерение (откуда → куда) и ждет,
+    пока поток фиксации сбросит накопившуюся пачку: один write+fsync на все воркеры сразу.
+    Хэш готовой копии, итоги переносов и строки history.log уходят той же пачкой без ожидания.
+    При запуске журналы завершившихся процессов разбираются (recover): источник удаляется,
+    только если копия совпадает с записанным хэшем, иначе недописанная копия откатывается.
+    """
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        self.path = self.directory / f"{JOURNAL_PREFIX}.{os.getpid()}-{int(time.time() * 1000)}{JOURNAL_SUFFIX}"
+        self.log_path = self.directory / LOG_FILE
+        self._cond = threading.Condition()
+        self._records = []
+        self._log_lines = []
+        self._callbacks = []
+        self._queued = 0
+        self._committed = 0
+        self._next_op = 0
+        self._open_ops = 0
+        self._file = None
+        self._thread = None
+        self.batches = 0
+        self.records = 0
+        self.max_batch = 0
+
+    def _ensure_started(self):
+        # Вызывается под self._cond
+        if self._thread: return
+        self._file = open(self.path, 'ab')
+        _try_lock_file(self._file)
+        self._thread = threading.Thread(target=self._worker_commit, daemon=True)
+        self._thread.start()
+
+    def _put(self, record=None, log_line=None, callback=None):
+        # Вызывается под self._cond; возвращает номер записи для ожидания фиксации
+        self._ensure_started()
+        if record is not None: self._records.append(json.dumps(record, ensure_ascii=False))
+        if log_line is not None: self._log_lines.append(log_line)
+        if callback and callback not in self._callbacks: self._callbacks.append(callback)
+        self._queued += 1
+        self._cond.notify_all()
+        return self._queued
+
+    def _wait(self, seq):
+        with self._cond:
+            while self._committed < seq and self._thread.is_alive():
+                self._cond.wait(JOURNAL_COMMIT_INTERVAL)
+
+    def begin(self, src, dst):
+        """Намерение перенести src в dst; возвращает номер операции после фиксации на диске."""
+        with self._cond:
+            self._next_op += 1
+            op = self._next_op
+            self._open_ops += 1
+            seq = self._put({"op": op, "state": "intent", "src": os.fspath(src), "dst": os.fspath(dst)})
+        self._wait(seq)
+        return op
+
+    def copied(self, op, digest, algorithm):
+        """Копия записана, digest — хэш ее содержимого; без ожидания фиксации."""
+        with self._cond:
+            self._put({"op": op, "state": "copied", "hash": digest, "algorithm": algorithm})
+
+    def finish(self, op, ok=True):
+        with self._cond:
+            self._open_ops -= 1
+            self._put({"op": op, "state": "done" if ok else "abort"})
+
+    def log(self, line, callback=None):
+        """Строка для history.log; callback вызывается после ее записи (обновление интерфейса)."""
+        with self._cond:
+            self._put(log_line=line, callback=callback)
+
+    def flush(self):
+        with self._cond:
+            if not self._thread: return
+            seq = self._queued
+            self._cond.notify_all()
+        self._wait(seq)
+
+    def close(self):
+        # Чистое завершение: все записано, открытых операций нет — журнал больше не нужен
+        self.flush()
+        with self._cond:
+            if not self._file or self._open_ops: return
+            try:
+                self._file.close()
+                os.remove(self.path)
+            except OSError:
+                pass
+
+    def _worker_commit(self):
+        while True:
+            with self._cond:
+                while not self._records and not self._log_lines:
+                    if not self._cond.wait(JOURNAL_COMMIT_INTERVAL): break
+                records, self._records = self._records, []
+                lines, self._log_lines = self._log_lines, []
+                callbacks, self._callbacks = self._callbacks, []
+                seq = self._queued
+                idle = self._open_ops == 0
+            if self._file.closed: return
+            try:
+                if records:
+                    self._file.write(("\n".join(records) + "\n").encode("utf-8"))
+                    self._file.flush()
+                    if cfg.data.get('features', {}).get('fsync_policy', 'file') != 'none':
+                        os.fsync(self._file.fileno())
+                    # Все операции завершены и их итоги уже в файле — старые записи не нужны
+                    if idle and self._file.tell() > JOURNAL_COMPACT_BYTES: self._file.truncate(0)
+            except Exception as e:
+                print(f"⚠️ Предупреждение: Не удалось записать журнал операций {self.path}. {e}")
+            if lines:
+                try:
+                    with open(self.log_path, "a", encoding="utf-8") as f: f.writelines(lines)
+                except Exception as e:
+                    print(f"ОШИБКА ЛОГА: {len(lines)} строк не записано. {e}")
+            with self._cond:
+                self._committed = seq
+                if records or lines:
+                    self.batches += 1
+                    self.records += len(records) + len(lines)
+                    self.max_batch = max(self.max_batch, len(records) + len(lines))
+                self._cond.notify_all()
+            for callback in callbacks:
+                try: callback()
+                except: pass
+
+    @staticmethod
+    def _resolve(src, dst, digest=None, algorithm=None):
+        src_exists, dst_exists = os.path.lexists(src), os.path.lexists(dst)
+        if not dst_exists: return "not_started" if src_exists else "lost"
+        if not src_exists: return "completed"
+        # Есть и источник, и копия: перенос между дисками прервался до удаления источника.
+        # Размер и время совпадают и у недописанной копии без fsync — сверяется только хэш
+        if digest and algorithm in HASH_ALGORITHMS and calculate_hash(dst, algorithm) == digest:
+            os.remove(src)
+            return "replayed"
+        os.remove(dst)
+        return "rolled_back"
+
+    def recover(self):
+        """Разбирает журналы завершившихся процессов; возвращает [(src, dst, итог)] незавершенных переносов."""
+        results = []
+        for path in sorted(self.directory.glob(f"{JOURNAL_PREFIX}.*{JOURNAL_SUFFIX}")):
+            if path == self.path: continue
+            try:
+                f = open(path, 'r+b')
+            except OSError:
+                continue
+            with f:
+                # Журнал работающего процесса заблокирован им самим
+                if not _try_lock_file(f): continue
+                f.seek(0)
+                pending = {}
+                for raw in f:
+                    try:
+                        record = json.loads(raw)
+                    except ValueError:
+                        continue  # Оборванная при сбое последняя строка
+                    state = record.get("state")
+                    if state == "intent": pending[record["op"]] = record
+                    elif state == "copied" and record.get("op") in pending:
+                        pending[record["op"]].update(hash=record.get("hash"), algorithm=record.get("algorithm"))
+                    else: pending.pop(record.get("op"), None)
+                for record in pending.values():
+                    try:
+                        outcome = self._resolve(record["src"], record["dst"], record.get("hash"), record.get("algorithm"))
+                    except OSError as e:
+                        outcome = f"error: {e}"
+                    results.append((record["src"], record["dst"], outcome))
+            try: os.remove(path)
+            except OSError: pass
+        return results
+
+    def stats(self):
+        with self._cond:
+            return {"batches": self.batches, "records": self.records, "max_batch": self.max_batch,
+                    "open_ops": self._open_ops}
+
+operation_journal = OperationJournal(Path(__file__).resolve().parent)
+atexit.register(operation_journal.close)
+
 # --- УТИЛИТЫ ---
-def calculate_hash(path, algorithm='sha256'):
-    hasher = hashlib.new(algorithm)
+# Служебные файлы в каталоге скрипта. Исключаются по полному пути, а не через ignore_list:
+# в старых настройках списка может не быть, а каталог скрипта — запасной источник
+APP_DIR = os.path.normcase(os.path.realpath(os.path.dirname(os.path.abspath(__file__))))
+INTERNAL_FILES = {os.path.normcase(name) for name in (
+    CONFIG_FILE, LOG_FILE, INDEX_FILE, f"{INDEX_FILE}-wal", f"{INDEX_FILE}-shm", f"{INDEX_FILE}-journal",
+    STATS_FILE, f"{STATS_FILE}.tmp", DUPLICATES_REPORT_FILE)}
+
+def is_internal_file(path):
+    """Служебный файл программы (настройки, база индекса, статистика, журналы операций)."""
+    name = os.path.normcase(os.path.basename(path))
+    internal = (name in INTERNAL_FILES
+                or (name.startswith(os.path.normcase(CONFIG_FILE) + ".") and name.endswith(".tmp"))
+                or (name.startswith(JOURNAL_PREFIX + ".") and name.endswith(JOURNAL_SUFFIX)))
+    # Каталог сравнивается только для подходящих имен: realpath — лишние системные вызовы
+    return internal and os.path.normcase(os.path.realpath(os.path.dirname(os.path.abspath(path)))) == APP_DIR
+
+_hash_buffers = threading.local()
+
+def get_hash_algorithm():
+    algorithm = cfg.data.get('features', {}).get('hash_algorithm', 'sha256')
+    return algorithm if algorithm in HASH_ALGORITHMS else 'sha256'
+
+def _get_hash_buffer():
+    # Один переиспользуемый буфер на поток вместо нового bytes-объекта на каждый блок
+    buf = getattr(_hash_buffers, 'buf', None)
+    if buf is None:
+        buf = _hash_buffers.buf = bytearray(HASH_BUFFER_SIZE)
+    return buf
+
+def calculate_hash(path, algorithm=None):
+    hasher = hashlib.new(algorithm or get_hash_algorithm())
+    try:
+        with open(path, 'rb', buffering=0) as file:
+            if os.fstat(file.fileno()).st_size >= MMAP_THRESHOLD:
+                with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    hasher.update(mm)
+            else:
+                buf = _get_hash_buffer()
+                view = memoryview(buf)
+                while True:
+                    n = file.readinto(buf)
+                    if not n: break
+                    hasher.update(view[:n])
+        return hasher.hexdigest()
+    except:
+        return None
+
+def calculate_partial_hash(path, size, algorithm=None, block=None):
+    # Хэш размера, первых и последних block байт; для маленьких файлов совпадает с полным хэшем
+    block = block or PARTIAL_HASH_BLOCK
+    if size <= 2 * block: return calculate_hash(path, algorithm)
+    hasher = hashlib.new(algorithm or get_hash_algorithm())
     try:
         with open(path, 'rb') as file:
-            while True:
-                chunk = file.read(8192)
-                if not chunk: break
-                hasher.update(chunk)
+            hasher.update(str(size).encode())
+            hasher.update(file.read(block))
+            file.seek(-block, os.SEEK_END)
+            hasher.update(file.read(block))
         return hasher.hexdigest()
     except:
         return None
 
+def _write_all(fout, data):
+    # FileIO.write (buffering=0) может записать меньше, чем передано — дописываем остаток
+    while data:
+        data = data[fout.write(data):]
+
+def copy_with_hash(src, dst, algorithm=None, verify=False, fsync=False):
+    """Копирует src в dst за один проход, считая хэш содержимого по пути.
+
+    При verify копия перечитывается и сверяется с хэшем источника.
+    Недописанная копия удаляется при любой ошибке.
+    """
+    algorithm = algorithm or get_hash_algorithm()
+    hasher = hashlib.new(algorithm)
+    buf = _get_hash_buffer()
+    view = memoryview(buf)
+    # Открывается до try: существующий dst (FileExistsError) чужой, удаляется только своя копия
+    fout = open(dst, 'xb', buffering=0)
+    try:
+        with fout, open(src, 'rb', buffering=0) as fin:
+            while True:
+                n = fin.readinto(buf)
+                if not n: break
+                hasher.update(view[:n])
+                _write_all(fout, view[:n])
+            if fsync: os.fsync(fout.fileno())
+        shutil.copystat(src, dst)
+        digest = hasher.hexdigest()
+        if verify and calculate_hash(dst, algorithm) != digest:
+            raise OSError(f"Контрольная сумма копии не совпала: {dst}")
+        return digest
+    except BaseException:
+        try: os.remove(dst)
+        except OSError: pass
+        raise
+
+def _copy_file_range(fin, fout):
+    while os.copy_file_range(fin.fileno(), fout.fileno(), KERNEL_COPY_CHUNK): pass
+
+def _copy_sendfile(fin, fout):
+    offset = 0
+    while True:
+        sent = os.sendfile(fout.fileno(), fin.fileno(), offset, KERNEL_COPY_CHUNK)
+        if not sent: break
+        offset += sent
+
+def _copy_readinto(fin, fout):
+    buf = _get_hash_buffer()
+    view = memoryview(buf)
+    while True:
+        n = fin.readinto(buf)
+        if not n: break
+        _write_all(fout, view[:n])
+
+# Стратегии копирования содержимого; auto перебирает их по порядку, пока ядро не примет вызов
+COPY_STRATEGIES = {"copy_file_range": _copy_file_range, "sendfile": _copy_sendfile, "readinto": _copy_readinto}
+_KERNEL_COPY_ERRORS = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP, errno.EBADF, errno.EPERM}
+
+def copy_file_data(fin, fout, strategy="auto"):
+    """Копирует содержимое открытых (buffering=0) файлов: ядро (copy_file_range, sendfile), иначе через буфер.
+
+    Размер копии сверяется с источником: короткая копия — OSError (в auto — переход к следующему способу).
+    """
+    size = os.fstat(fin.fileno()).st_size
+    for name in (COPY_STRATEGIES if strategy == "auto" else [strategy]):
+        last = strategy != "auto" or name == "readinto"
+        try:
+            COPY_STRATEGIES[name](fin, fout)
+        except AttributeError:
+            if strategy != "auto": raise
+            continue  # Функции нет на этой платформе (Windows, macOS)
+        except OSError as e:
+            # Вызов не поддерживается для этой пары файловых систем — начинаем заново следующим способом
+            if last or e.errno not in _KERNEL_COPY_ERRORS: raise
+        else:
+            # copy_file_range/sendfile на части ФС (FUSE, сетевые, procfs) возвращают 0 без ошибки —
+            # копия оказалась бы короче, а источник после нее удаляется
+            if os.fstat(fout.fileno()).st_size == size: return
+            if last: raise OSError(errno.EIO, f"Размер копии не совпал с источником ({name})")
+        fin.seek(0); fout.seek(0); fout.truncate()
+
+def copy_file_fast(src, dst, fsync=False, strategy="auto"):
+    """Копия без хэширования с сохранением времени и прав; недописанная копия удаляется."""
+    # Как в copy_with_hash: существующий dst не удаляется
+    fout = open(dst, 'xb', buffering=0)
+    try:
+        with fout, open(src, 'rb', buffering=0) as fin:
+            copy_file_data(fin, fout, strategy)
+            if fsync: os.fsync(fout.fileno())
+        shutil.copystat(src, dst)
+    except BaseException:
+        try: os.remove(dst)
+        except OSError: pass
+        raise
+
+def _fsync_dir(path):
+    # Фиксация записи каталога (переименование/новый файл); в Windows каталоги не fsync'ятся
+    if os.name == 'nt': return
+    fd = os.open(path, os.O_RDONLY)
+    try: os.fsync(fd)
+    finally: os.close(fd)
+
+def move_file(src, dst, verify=False, need_hash=True, fsync_policy="file", before_copy=None, after_copy=None):
+    """Перемещает файл и возвращает хэш содержимого, если он был посчитан при копировании (иначе None).
+
+    Один диск — атомарное переименование без чтения данных. Между дисками — копирование
+    средствами ядра, а при need_hash/verify — копирование с хэшированием за один проход.
+    before_copy() и after_copy(digest) вызываются только при копировании: до создания копии
+    и после ее записи, перед удалением исходного файла (журнал операций).
+    """
+    src, dst = os.fspath(src), os.fspath(dst)
+    dst_dir = os.path.dirname(dst)
+    try:
+        same_device = os.stat(src).st_dev == os.stat(dst_dir).st_dev
+    except OSError:
+        same_device = False
+    if same_device:
+        try:
+            os.rename(src, dst)
+            if fsync_policy == "full": _fsync_dir(dst_dir)
+            return None
+        except OSError as e:
+            if e.errno != errno.EXDEV: raise
+    fsync = fsync_policy in ("file", "full")
+    if before_copy: before_copy()
+    if need_hash or verify:
+        digest = copy_with_hash(src, dst, verify=verify, fsync=fsync)
+    else:
+        digest = None
+        copy_file_fast(src, dst, fsync=fsync)
+    if fsync_policy == "full": _fsync_dir(dst_dir)
+    if after_copy: after_copy(digest)
+    os.remove(src)
+    return digest
+
+class KnownDirs:
+    """Кэш папок, про которые известно, что они существуют: повторный mkdir не выполняется.
+
+    Path.mkdir(parents=True, exist_ok=True) для существующей папки — это mkdir, завершающийся
+    ошибкой, и stat; на сетевых дисках оба вызова дорогие. Очистка пустых папок сбрасывает
+    удаленные папки из кэша, перенос в папку, пропавшую извне, — повторно ее создает.
+    """
+    MAX_ENTRIES = 100000
+    SYSCALLS_PER_HIT = 2
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._known = set()
+        self.hits = 0
+        self.created = 0
+
+    @staticmethod
+    def _key(path):
+        return os.path.normcase(os.fspath(path))
+
+    def ensure(self, path):
+        key = self._key(path)
+        with self._lock:
+            if key in self._known:
+                self.hits += 1
+                return
+        Path(path).mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            self.created += 1
+            if len(self._known) >= self.MAX_ENTRIES: self._known.clear()
+            self._known.add(key)
+
+    def invalidate(self, path):
+        # Папка и все вложенные в нее
+        key = self._key(path)
+        prefix = key.rstrip(os.sep) + os.sep
+        with self._lock:
+            self._known = {k for k in self._known if k != key and not k.startswith(prefix)}
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._known), "hits": self.hits, "mkdir_calls": self.created,
+                    "saved_syscalls": self.hits * self.SYSCALLS_PER_HIT}
+
+known_dirs = KnownDirs()
+
+class NameAllocator:
+    """Выдача свободных имен вида `имя_(n).ext` в папках назначения, карантина и дубликатов.
+
+    Для каждой пары (папка, имя) запоминается следующий свободный номер, поэтому очередной
+    файл получает имя за одну проверку exists(), сколько бы копий ни лежало в папке.
+    Первый номер находится галопом и бинарным поиском — O(log n) проверок один раз.
+    Выданные, но еще не занятые файлами имена резервируются и не достаются другим потокам.
+    """
+    MAX_ENTRIES = 100000
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._next = {}
+        self._issued = {}
+        self.allocated = 0
+        self.probes = 0
+
+    @staticmethod
+    def _candidate(folder, stem, suffix, number):
+        return os.path.join(folder, f"{stem}_({number}){suffix}" if number else f"{stem}{suffix}")
+
+    def _taken(self, path):
+        self.probes += 1
+        return os.path.normcase(path) in self._issued or os.path.lexists(path)
+
+    def _first_free(self, folder, stem, suffix):
+        if not self._taken(self._candidate(folder, stem, suffix, 0)): return 0
+        low, high = 0, 1
+        while self._taken(self._candidate(folder, stem, suffix, high)):
+            low, high = high, high * 2
+        # low занят, high свободен; пропуски в нумерации (удаленные копии) не мешают — номер лишь растет
+        while high - low > 1:
+            middle = (low + high) // 2
+            if self._taken(self._candidate(folder, stem, suffix, middle)): low = middle
+            else: high = middle
+        return high
+
+    def allocate(self, folder, name):
+        folder = os.fspath(folder)
+        stem, suffix = os.path.splitext(name)
+        key = (os.path.normcase(folder), os.path.normcase(name))
+        with self._lock:
+            number = self._next.pop(key, None)
+            if number is None:
+                number = self._first_free(folder, stem, suffix)
+            else:
+                # Обычно одна проверка; цикл — только если имя заняли в обход программы
+                while self._taken(self._candidate(folder, stem, suffix, number)): number += 1
+            candidate = self._candidate(folder, stem, suffix, number)
+            self._next[key] = number + 1
+            self._issued[os.path.normcase(candidate)] = None
+            # Самые старые записи давно заняты файлами на диске — их можно забыть
+            for table in (self._next, self._issued):
+                while len(table) > self.MAX_ENTRIES: del table[next(iter(table))]
+            self.allocated += 1
+        return Path(candidate)
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._next), "allocated": self.allocated, "probes": self.probes}
+
+name_allocator = NameAllocator()
+
+def format_bytes(num):
+    for unit in ["B", "KB", "MB", "GB"]:
+        if abs(num) < 1024: return f"{num:.0f} {unit}" if unit == "B" else f"{num:.1f} {unit}"
+        num /= 1024
+    return f"{num:.1f} TB"
+
+# --- ИНДЕКС ХЭШЕЙ (ДЕДУПЛИКАЦИЯ) ---
+class DedupStats:
+    """Счетчики ступенчатой проверки дубликатов: сколько байт прочитано и сколько сэкономлено."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.checked = 0
+            self.duplicates = 0
+            self.size_skipped_bytes = 0
+            self.partial_skipped_bytes = 0
+            self.partial_read_bytes = 0
+            self.full_read_bytes = 0
+
+    def add(self, **counters):
+        with self._lock:
+            for name, value in counters.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "checked": self.checked,
+                "duplicates": self.duplicates,
+                "size_skipped_bytes": self.size_skipped_bytes,
+                "partial_skipped_bytes": self.partial_skipped_bytes,
+                "partial_read_bytes": self.partial_read_bytes,
+                "full_read_bytes": self.full_read_bytes,
+            }
+
+dedup_stats = DedupStats()
+
+
+class PipelineStats:
+    """Счетчики конвейера сортировки: итоги по файлам и суммарное время стадий (сек.)."""
+    STAGES = ("classify", "dedup", "move", "notify")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.files = 0
+            self.bytes = 0
+            self.sorted = 0
+            self.duplicates = 0
+            self.quarantined = 0
+            self.errors = 0
+            self.stage_time = dict.fromkeys(self.STAGES, 0.0)
+
+    def add(self, **counters):
+        with self._lock:
+            for name, value in counters.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def add_stage(self, stage, started):
+        # started — отметка time.perf_counter() начала стадии
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.stage_time[stage] += elapsed
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "files": self.files,
+                "bytes": self.bytes,
+                "sorted": self.sorted,
+                "duplicates": self.duplicates,
+                "quarantined": self.quarantined,
+                "errors": self.errors,
+                "stage_time": dict(self.stage_time),
+            }
+
+pipeline_stats = PipelineStats()
+
+class HashIndex(SqliteStore):
+    """Постоянный индекс хэшей файлов назначения (SQLite в папке скрипта).
+
+    Запись о файле действительна, пока совпадают размер, mtime и inode.
+    Папка считается проиндексированной, пока не изменился её собственный mtime,
+    поэтому поиск дубликата — это один stat папки и один запрос к базе.
+    Хэши (частичный и полный) вычисляются лениво и кэшируются в записи файла.
+    """
+    def __init__(self, db_path):
+        super().__init__(db_path)
+        self._folder_locks = {}
+
+    def _create_schema(self, conn):
+        conn.execute("""CREATE TABLE IF NOT EXISTS files (
+            path TEXT PRIMARY KEY, folder TEXT NOT NULL,
+            size INTEGER, mtime_ns INTEGER, inode INTEGER, hash TEXT)""")
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(files)")}
+        if "partial" not in columns: conn.execute("ALTER TABLE files ADD COLUMN partial TEXT")
+        if "algo" not in columns:
+            # Записи до появления выбора алгоритма посчитаны SHA256
+            conn.execute("ALTER TABLE files ADD COLUMN algo TEXT")
+            conn.execute("UPDATE files SET algo = 'sha256'")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_files_folder_hash ON files(folder, hash)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_files_folder_size ON files(folder, size)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_files_size ON files(size)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_files_hash ON files(hash)")
+        conn.execute("""CREATE TABLE IF NOT EXISTS folders (
+            folder TEXT PRIMARY KEY, mtime_ns INTEGER)""")
+
+    @staticmethod
+    def _key(path):
+        return os.path.normcase(str(path))
+
+    @staticmethod
+    def _is_valid(row_size, row_mtime, row_inode, st):
+        return row_size == st.st_size and row_mtime == st.st_mtime_ns and row_inode == st.st_ino
+
+    def _folder_lock(self, key):
+        with self._lock:
+            return self._folder_locks.setdefault(key, threading.Lock())
+
+    def _upsert(self, path, st, digest=None, partial=None):
+        self._execute(
+            "INSERT OR REPLACE INTO files (path, folder, size, mtime_ns, inode, hash, partial, algo) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (self._key(path), self._key(Path(path).parent), st.st_size, st.st_mtime_ns, st.st_ino, digest, partial, get_hash_algorithm()))
+
+    def add(self, path, digest=None, st=None, partial=None):
+        """Регистрирует файл, только что перемещенный в папку назначения."""
+        path = Path(path)
+        try:
+            st = st or path.stat()
+        except OSError:
+            return
+        self._upsert(path, st, digest, partial)
+        self.touch_folder(path.parent)
+
+    def remove(self, path):
+        self._execute("DELETE FROM files WHERE path = ?", (self._key(path),))
+
+    def touch_folder(self, folder):
+        # Фиксируем mtime папки после собственных изменений, чтобы не пересканировать её
+        key = self._key(folder)
+        try:
+            mtime_ns = os.stat(folder).st_mtime_ns
+        except OSError:
+            return
+        self._execute("UPDATE folders SET mtime_ns = ? WHERE folder = ?", (mtime_ns, key))
+
+    def sync_folder(self, folder):
+        """Сверяет индекс с содержимым папки (только stat), если папка изменилась с прошлой сверки."""
+        key = self._key(folder)
+        try:
+            folder_mtime = os.stat(folder).st_mtime_ns
+        except OSError:
+            return
+        rows = self._execute("SELECT mtime_ns FROM folders WHERE folder = ?", (key,), fetch=True)
+        if rows and rows[0][0] == folder_mtime: return
+
+        with self._folder_lock(key):
+            known = {row[0]: row[1:] for row in self._execute(
+                "SELECT path, size, mtime_ns, inode FROM files WHERE folder = ?", (key,), fetch=True)}
+            seen, updates = set(), []
+            with os.scandir(folder) as it:
+                for entry in it:
+                    try:
+                        if not entry.is_file(follow_symlinks=False): continue
+                        st = entry.stat(follow_symlinks=False)
+                    except OSError:
+                        continue
+                    entry_key = self._key(entry.path)
+                    seen.add(entry_key)
+                    row = known.get(entry_key)
+                    if row and self._is_valid(*row, st): continue
+                    # Новый или измененный файл: хэши будут посчитаны, только если понадобятся
+                    updates.append((entry_key, key, st.st_size, st.st_mtime_ns, st.st_ino, None, None, None))
+            self._executemany(
+                "INSERT OR REPLACE INTO files (path, folder, size, mtime_ns, inode, hash, partial, algo) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", updates)
+            self._executemany("DELETE FROM files WHERE path = ?", [(stale,) for stale in set(known) - seen])
+            self._execute("INSERT OR REPLACE INTO folders (folder, mtime_ns) VALUES (?, ?)", (key, folder_mtime))
+
+    def _fresh_row(self, path, size, mtime_ns, inode, digest, partial):
+        """Проверяет запись по stat; для измененного файла сбрасывает кэшированные хэши."""
+        try:
+            st = os.stat(path)
+        except OSError:
+            self.remove(path)
+            return None
+        if not self._is_valid(size, mtime_ns, inode, st):
+            self._upsert(path, st)
+            return st, None, None
+        return st, digest, partial
+
+    def _query_scope(self, folder, scope, condition, params):
+        """Выборка записей: scope=None — только папка folder, иначе (root, excluded) — все дерево root.
+
+        Хэши, посчитанные другим алгоритмом, возвращаются как неизвестные (None).
+        """
+        columns = "SELECT path, size, mtime_ns, inode, hash, partial, algo FROM files WHERE "
+        if scope is None:
+            rows = self._execute(columns + "folder = ? AND " + condition, (self._key(folder), *params), fetch=True)
+        else:
+            root, excluded = scope
+            low = self._key(root).rstrip(os.sep) + os.sep
+            rows = self._execute(columns + condition + " AND path >= ? AND path < ?", (*params, low, low + chr(0x10FFFF)), fetch=True)
+            excluded_keys = tuple(self._key(p).rstrip(os.sep) + os.sep for p in excluded)
+            rows = [row for row in rows if not row[0].startswith(excluded_keys)]
+        algorithm = get_hash_algorithm()
+        return [(path, size, mtime_ns, inode, digest if algo == algorithm else None, partial if algo == algorithm else None)
+                for path, size, mtime_ns, inode, digest, partial, algo in rows]
+
+    def _partial_hash(self, path, st, digest, partial):
+        if partial: return digest, partial
+        partial = calculate_partial_hash(path, st.st_size)
+        if partial:
+            small = st.st_size <= 2 * PARTIAL_HASH_BLOCK
+            dedup_stats.add(partial_read_bytes=st.st_size if small else 2 * PARTIAL_HASH_BLOCK)
+            digest = digest or (partial if small else None)
+            self._upsert(path, st, digest, partial)
+        return digest, partial
+
+    def _full_hash(self, path, st, digest, partial):
+        if digest: return digest
+        digest = calculate_hash(path)
+        if digest:
+            dedup_stats.add(full_read_bytes=st.st_size)
+            if st.st_size <= 2 * PARTIAL_HASH_BLOCK: partial = digest
+            self._upsert(path, st, digest, partial)
+        return digest
+
+    def find_duplicate(self, folder, digest, size, scope=None):
+        """Полная проверка: возвращает путь файла с тем же хэшем (в папке folder или во всем scope) или None."""
+        dedup_stats.add(checked=1)
+        self.sync_folder(folder)
+        rows = self._query_scope(folder, scope, "(hash = ? OR ((hash IS NULL OR algo IS NOT ?) AND size = ?))",
+                                 (digest, get_hash_algorithm(), size))
+        for path, *row in rows:
+            fresh = self._fresh_row(path, *row)
+            if not fresh: continue
+            if self._full_hash(path, *fresh) == digest:
+                dedup_stats.add(duplicates=1)
+                return Path(path)
+        return None
+
+    def find_duplicate_tiered(self, folder, src, st, scope=None):
+        """Ступенчатая проверка: размер -> частичный хэш -> полный хэш.
+
+        Возвращает (путь найденного дубликата или None, полный хэш src или None, частичный хэш src или None).
+        """
+        dedup_stats.add(checked=1)
+        self.sync_folder(folder)
+        rows = self._query_scope(folder, scope, "size = ?", (st.st_size,))
+        candidates = []
+        for path, *row in rows:
+            fresh = self._fresh_row(path, *row)
+            if fresh and fresh[0].st_size == st.st_size: candidates.append((path, *fresh))
+
+        # 1. Размер: ни одного файла того же размера — читать ничего не нужно
+        if not candidates:
+            dedup_stats.add(size_skipped_bytes=st.st_size)
+            return None, None, None
+
+        # 2. Частичный хэш (начало и конец файла)
+        small = st.st_size <= 2 * PARTIAL_HASH_BLOCK
+        src_partial = calculate_partial_hash(src, st.st_size)
+        if not src_partial: return None, None, None
+        read = st.st_size if small else 2 * PARTIAL_HASH_BLOCK
+        dedup_stats.add(partial_read_bytes=read)
+        survivors = []
+        for path, c_st, digest, partial in candidates:
+            digest, partial = self._partial_hash(path, c_st, digest, partial)
+            if not partial: continue
+            if partial == src_partial:
+                survivors.append((path, c_st, digest, partial))
+            elif not digest:
+                dedup_stats.add(partial_skipped_bytes=c_st.st_size - read)
+        if not survivors:
+            dedup_stats.add(partial_skipped_bytes=st.st_size - read)
+            return None, (src_partial if small else None), src_partial
+
+        # 3. Полный хэш только для выживших кандидатов
+        if small:
+            src_hash = src_partial
+        else:
+            src_hash = calculate_hash(src)
+            if not src_hash: return None, None, src_partial
+            dedup_stats.add(full_read_bytes=st.st_size)
+        for path, c_st, digest, partial in survivors:
+            if self._full_hash(path, c_st, digest, partial) == src_hash:
+                dedup_stats.add(duplicates=1)
+                return Path(path), src_hash, src_partial
+        return None, src_hash, src_partial
+
+    def peek_duplicate(self, folder, src, st, scope=None):
+        """Поиск дубликата без записи в индекс (план сортировки): путь найденного файла или None.
+
+        Папка не сверяется, кэш хэшей не пополняется. Файлы того же размера без хэша в индексе
+        (или еще не попавшие в него) хэшируются в памяти.
+        """
+        candidates = {}
+        # Базы еще нет — не создаем ее ради плана
+        rows = self._query_scope(folder, scope, "size = ?", (st.st_size,)) if self._conn or self.db_path.exists() else []
+        for path, size, mtime_ns, inode, digest, partial in rows:
+            try:
+                c_st = os.stat(path)
+            except OSError:
+                continue
+            if c_st.st_size == st.st_size:
+                candidates[path] = digest if self._is_valid(size, mtime_ns, inode, c_st) else None
+        if not rows or not self.is_folder_synced(folder):
+            # Папка менялась после сверки (или не сверялась): файлы того же размера находим по stat
+            try:
+                with os.scandir(folder) as it:
+                    for entry in it:
+                        try:
+                            if entry.is_file(follow_symlinks=False) and entry.stat(follow_symlinks=False).st_size == st.st_size:
+                                candidates.setdefault(self._key(entry.path), None)
+                        except OSError:
+                            continue
+            except OSError:
+                pass
+        if not candidates: return None
+        src_hash = calculate_hash(src)
+        if not src_hash: return None
+        for path, digest in candidates.items():
+            if (digest or calculate_hash(path)) == src_hash: return Path(path)
+        return None
+
+    def unhashed_files(self, folder):
+        """Файлы папки без полного хэша текущего алгоритма: [(path, size)]."""
+        return self._execute(
+            "SELECT path, size FROM files WHERE folder = ? AND (hash IS NULL OR algo IS NOT ?)",
+            (self._key(folder), get_hash_algorithm()), fetch=True)
+
+    def is_folder_synced(self, folder):
+        try:
+            folder_mtime = os.stat(folder).st_mtime_ns
+        except OSError:
+            return False
+        rows = self._execute("SELECT mtime_ns FROM folders WHERE folder = ?", (self._key(folder),), fetch=True)
+        return bool(rows) and rows[0][0] == folder_mtime
+
+    def store_hashes(self, results, algorithm):
+        """Сохраняет пачку результатов фонового хэширования (path, size, mtime_ns, inode, hash, partial)."""
+        self._executemany(
+            "INSERT OR REPLACE INTO files (path, folder, size, mtime_ns, inode, hash, partial, algo) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [(self._key(path), self._key(Path(path).parent), size, mtime_ns, inode, digest, partial, algorithm)
+             for path, size, mtime_ns, inode, digest, partial in results])
+
+    def find_all_duplicates(self, root, excluded, workers=None):
+        """Ищет группы одинаковых файлов во всем дереве root (параллельное хэширование)."""
+        for folder in iter_tree_dirs(root, excluded):
+            self.sync_folder(folder)
+        by_size = {}
+        for path, *row in self._query_scope(None, (root, excluded), "size > 0", ()):
+            by_size.setdefault(row[0], []).append((path, *row))
+        candidates = [row for rows in by_size.values() if len(rows) > 1 for row in rows]
+
+        def partial_job(row):
+            path, *rest = row
+            fresh = self._fresh_row(path, *rest)
+            if not fresh: return None
+            digest, partial = self._partial_hash(path, *fresh)
+            return (path, fresh[0], digest, partial) if partial else None
+
+        def full_job(item):
+            path, st, digest, partial = item
+            return path, st.st_size, self._full_hash(path, st, digest, partial)
+
+        groups = {}
+        with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 4) as pool:
+            by_partial = {}
+            for item in pool.map(partial_job, candidates):
+                if item: by_partial.setdefault((item[1].st_size, item[3]), []).append(item)
+            survivors = [item for items in by_partial.values() if len(items) > 1 for item in items]
+            for path, size, digest in pool.map(full_job, survivors):
+                if digest: groups.setdefault((size, digest), []).append(path)
+        return [{"hash": digest, "size": size, "files": sorted(paths)}
+                for (size, digest), paths in groups.items() if len(paths) > 1]
+
+hash_index = HashIndex(Path(__file__).resolve().parent / INDEX_FILE)
+
+def iter_tree_dirs(root, excluded=()):
+    # Ленивый обход дерева папок через os.scandir (без построения полного списка)
+    excluded_keys = {os.path.normcase(str(p)) for p in excluded}
+    stack = [str(root)]
+    while stack:
+        current = stack.pop()
+        yield current
+        try:
+            with os.scandir(current) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False) and os.path.normcase(entry.path) not in excluded_keys:
+                        stack.append(entry.path)
+        except OSError:
+            continue
+
+def build_duplicates_report(root, excluded, workers=None):
+    """Строит отчет о существующих дубликатах в папке назначения и сохраняет его в JSON."""
+    started = time.time()
+    groups = hash_index.find_all_duplicates(root, excluded, workers)
+    groups.sort(key=lambda g: g["size"] * (len(g["files"]) - 1), reverse=True)
+    report = {
+        "created": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "root": str(root),
+        "groups": len(groups),
+        "duplicate_files": sum(len(g["files"]) - 1 for g in groups),
+        "wasted_bytes": sum(g["size"] * (len(g["files"]) - 1) for g in groups),
+        "duration_sec": round(time.time() - started, 2),
+        "items": groups,
+    }
+    report_path = Path(__file__).resolve().parent / DUPLICATES_REPORT_FILE
+    with open(report_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=4, ensure_ascii=False)
+    return report
+
+# --- ФОНОВАЯ ИНДЕКСАЦИЯ ПАПКИ НАЗНАЧЕНИЯ ---
+def _warmup_hash_job(path, algorithm):
+    # Выполняется в отдельном процессе: только чтение файла, без обращения к базе
+    try:
+        before = os.stat(path)
+        digest = calculate_hash(path, algorithm)
+        partial = calculate_partial_hash(path, before.st_size, algorithm)
+        after = os.stat(path)
+    except OSError:
+        return None
+    if not digest or not partial or (before.st_size, before.st_mtime_ns) != (after.st_size, after.st_mtime_ns):
+        return None
+    return path, after.st_size, after.st_mtime_ns, after.st_ino, digest, partial
+
+class IndexWarmup:
+    """Фоновое заполнение индекса хэшей для уже существующего дерева назначения.
+
+    Обход идет через os.scandir, хэширование — в пуле процессов по числу ядер.
+    Прогресс сохраняется в самом индексе, поэтому после перезапуска уже
+    посчитанные файлы и неизменившиеся папки пропускаются.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        self.root = None
+        self.algorithm = None
+        self._reset_progress()
+
+    def _reset_progress(self):
+        self.state = "idle"
+        self.started = None
+        self.finished = None
+        self.folders_done = 0
+        self.files_total = 0
+        self.files_done = 0
+        self.bytes_total = 0
+        self.bytes_done = 0
+        self.error = ""
+
+    def is_running(self):
+        return bool(self._thread and self._thread.is_alive())
+
+    def start(self, root, excluded, workers=None, force=False):
+        with self._lock:
+            if self.is_running(): return False
+            # Повторный проход по уже проиндексированному дереву нужен только по запросу
+            if not force and self.state == "done" and self.root == Path(root) and self.algorithm == get_hash_algorithm():
+                return False
+            self._reset_progress()
+            self.root = Path(root)
+            self.algorithm = get_hash_algorithm()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, args=(Path(root), list(excluded), workers), daemon=True)
+            self._thread.start()
+            return True
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self, root, excluded, workers):
+        self.state = "running"
+        self.started = time.time()
+        algorithm = self.algorithm
+        workers = workers or os.cpu_count() or 2
+        try:
+            # spawn вместо fork: в процессе уже работают потоки watchdog/Flask
+            with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+                pending = set()
+                for folder in iter_tree_dirs(root, excluded):
+                    if self._stop.is_set(): break
+                    if not hash_index.is_folder_synced(folder):
+                        hash_index.sync_folder(folder)
+                    for path, size in hash_index.unhashed_files(folder):
+                        self.files_total += 1
+                        self.bytes_total += size or 0
+                        pending.add(pool.submit(_warmup_hash_job, path, algorithm))
+                        # Ограничиваем число задач в полете, чтобы не держать в памяти все дерево
+                        if len(pending) >= workers * 4:
+                            pending = self._collect(pending, algorithm, FIRST_COMPLETED)
+                    self.folders_done += 1
+                while pending and not self._stop.is_set():
+                    pending = self._collect(pending, algorithm, FIRST_COMPLETED)
+                for future in pending: future.cancel()
+            self.state = "stopped" if self._stop.is_set() else "done"
+        except Exception as e:
+            self.state = "error"
+            self.error = str(e)
+        self.finished = time.time()
+
+    def _collect(self, pending, algorithm, return_when):
+        done, pending = wait(pending, return_when=return_when)
+        results = [r for r in (future.result() for future in done if not future.cancelled()) if r]
+        if results: hash_index.store_hashes(results, algorithm)
+        self.files_done += len(done)
+        self.bytes_done += sum(r[1] for r in results)
+        return pending
+
+    def progress(self):
+        elapsed = ((self.finished or time.time()) - self.started) if self.started else 0
+        rate = self.bytes_done / elapsed if elapsed > 0 else 0
+        remaining = max(self.bytes_total - self.bytes_done, 0)
+        return {
+            "state": self.state,
+            "root": str(self.root) if self.root else "",
+            "folders_done": self.folders_done,
+            "files_done": self.files_done,
+            "files_total": self.files_total,
+            "bytes_done": self.bytes_done,
+            "bytes_total": self.bytes_total,
+            "rate": rate,
+            "eta_sec": int(remaining / rate) if rate > 0 and self.state == "running" else None,
+            "error": self.error,
+        }
+
+index_warmup = IndexWarmup()
+
 def send_telegram_message(message, level="INFO"):
     tg_conf = cfg.data.get('telegram', {}) # Безопасный доступ
     if not tg_conf.get('enabled') or not tg_conf.get('token') or not tg_conf.get('chat_id'): return
@@ -247,6 +1714,7 @@ def send_telegram_message(message, level="INFO"):
         'parse_mode': 'Markdown',
     }
     try:
+        import requests
         requests.post(url, data=payload, timeout=5)
     except:
         pass
@@ -277,9 +1745,10 @@ def send_file_to_telegram(file_path):
     url = f"https://api.telegram.org/bot{token}/{method}"
     
     try:
+        import requests
         with open(file_path, 'rb') as f:
             files = {param_name: f}
-            first_seen_date = cfg.get_file_first_seen(Path(file_path).name)
+            first_seen_date = stats_store.get_file_first_seen(Path(file_path).name)
             
             # Безопасный вывод пути относительно base_destination
             try:
@@ -308,6 +1777,7 @@ def get_metadata_date(file_path):
     # Изображения (EXIF Date/Time Original - 36867)
     if path.suffix.lower() in [".jpg", ".jpeg", ".tiff"]:
         try:
+            from PIL import Image
             img = Image.open(path)
             # Необходимо явно вызвать load(), чтобы гарантировать чтение метаданных
             img.load() 
@@ -318,6 +1788,10 @@ def get_metadata_date(file_path):
     
     # MP3 (ID3v2)
     elif path.suffix.lower() in [".mp3"]:
+        try:
+            from mutagen.mp3 import MP3
+            from mutagen.id3 import ID3NoHeaderError
+        except ImportError: return None
         try:
             audio = MP3(path)
             # TDRC (Recording Date) - более современный тег
@@ -343,6 +1817,7 @@ def get_metadata_folder(file_path):
     
     if path.suffix.lower() in [".mp3"]:
         try:
+            from mutagen.mp3 import MP3
             audio = MP3(path)
             # TPE1 (Artist) и TALB (Album)
             # .get() возвращает список объектов ID3Value, берем первый элемент
@@ -373,29 +1848,702 @@ def get_metadata_folder(file_path):
     
     return None
 
+# --- ОЖИДАНИЕ ЗАВЕРШЕНИЯ ЗАПИСИ ---
+def is_file_free(path):
+    # Windows не дает открыть на запись файл, который еще пишет другой процесс
+    try:
+        mode = 'rb+' if os.access(path, os.W_OK) else 'rb'
+        with open(path, mode):
+            return True
+    except OSError:
+        return False
+
+class WriteStabilizer:
+    """Стадия стабилизации: новые пути ждут, пока размер и mtime не перестанут меняться.
+
+    add() только регистрирует путь и сразу возвращается, поэтому поток watchdog
+    никогда не блокируется. Отдельный поток опрашивает ожидающие файлы и передает
+    в callback те, что не менялись window секунд и открываются на запись.
+    """
+    def __init__(self, callback, window_getter, poll_interval=STABILIZE_POLL_INTERVAL):
+        self.callback = callback
+        self.window_getter = window_getter
+        self.poll_interval = poll_interval
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stopped = False
+
+    def stop(self):
+        with self._lock:
+            self._stopped = True
+            self._pending.clear()
+
+    def add(self, path, priority=PRIORITY_LIVE):
+        path = str(path)
+        with self._lock:
+            # Повторное событие для того же пути просто перезапускает ожидание
+            previous = self._pending.get(path)
+            if previous: priority = min(priority, previous["priority"])
+            self._pending[path] = {"sig": None, "stable_since": time.monotonic(), "priority": priority}
+            if not self._thread or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._worker_poll, daemon=True)
+                self._thread.start()
+
+    def discard(self, path):
+        with self._lock:
+            self._pending.pop(str(path), None)
+
+    def pending_count(self):
+        with self._lock:
+            return len(self._pending)
+
+    def _worker_poll(self):
+        while not self._stopped:
+            time.sleep(self.poll_interval)
+            try: window = float(self.window_getter())
+            except Exception: window = 2.0
+            now = time.monotonic()
+            with self._lock:
+                items = list(self._pending.items())
+            ready = []
+            for path, state in items:
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    self.discard(path)  # Файл удален или переименован до завершения записи
+                    continue
+                sig = (st.st_size, st.st_mtime_ns)
+                if sig != state["sig"]:
+                    state["sig"], state["stable_since"] = sig, now
+                elif now - state["stable_since"] >= window and is_file_free(path):
+                    ready.append((path, state["priority"]))
+            for path, priority in ready:
+                with self._lock:
+                    # Путь мог быть обновлен новым событием, пока мы его проверяли
+                    if self._pending.get(path, {}).get("sig") is None: continue
+                    self._pending.pop(path, None)
+                try: self.callback(path, priority)
+                except Exception as e: print(f"⚠️ Ошибка постановки файла в очередь: {e}")
+
+
+# --- ОЧЕРЕДЬ ОБРАБОТКИ ---
+class WorkQueue:
+    """Ограниченная очередь задач с приоритетами и пулом потоков-обработчиков.
+
+    Порядок выдачи: класс приоритета (живые события раньше сканирования), затем
+    меньший размер файла, затем порядок поступления. У каждого источника своя
+    куча, потоки обходят источники по кругу, чтобы большой скан одной папки не
+    задерживал остальные. При заполнении (maxsize на источник) submit() ждет
+    освобождения места вместо роста памяти.
+    """
+    def __init__(self, handler, workers=5, maxsize=1000):
+        self.handler = handler
+        self.maxsize = max(1, int(maxsize))
+        self._heaps = {}
+        self._order = []
+        self._size = 0
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._target_workers = 0
+        self._alive_workers = 0
+        self._closed = False
+        # Метрики
+        self.active = 0
+        self.processed = 0
+        self.last_wait = 0.0
+        self.avg_wait = 0.0
+        self.max_wait = 0.0
+        self.resize(workers)
+
+    def resize(self, workers):
+        with self._cond:
+            self._target_workers = max(1, int(workers))
+            while self._alive_workers < self._target_workers:
+                self._alive_workers += 1
+                threading.Thread(target=self._worker_loop, daemon=True).start()
+            # Лишние потоки завершатся сами при следующем пробуждении
+            self._cond.notify_all()
+
+    def submit(self, path, priority=PRIORITY_LIVE, size=None, on_done=None, timeout=None, handler=None, source=None):
+        """Ставит файл в очередь; при переполнении ждет (timeout=None — без ограничения). Возвращает True, если задача принята."""
+        if size is None:
+            try: size = os.path.getsize(path)
+            except OSError: size = 0
+        limit = self.maxsize + (QUEUE_LIVE_RESERVE if priority == PRIORITY_LIVE else 0)
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._closed or len(self._heaps.get(source, ())) < limit, timeout): return False
+            if self._closed: return False
+            heap = self._heaps.get(source)
+            if heap is None:
+                heap = self._heaps[source] = []
+                self._order.append(source)
+            heapq.heappush(heap, (priority, size, next(self._seq), time.monotonic(), path, on_done, handler or self.handler))
+            self._size += 1
+            self._cond.notify_all()
+            return True
+
+    def _pop(self):
+        # Круговой обход источников; живые события любого источника — раньше сканирования
+        best = min(heap[0][0] for heap in self._heaps.values())
+        for i, source in enumerate(self._order):
+            heap = self._heaps[source]
+            if heap[0][0] != best: continue
+            item = heapq.heappop(heap)
+            del self._order[i]
+            if heap: self._order.append(source)
+            else: del self._heaps[source]
+            self._size -= 1
+            return item
+
+    def _worker_loop(self):
+        while True:
+            with self._cond:
+                while not self._size and not self._closed and self._alive_workers <= self._target_workers:
+                    self._cond.wait()
+                if self._closed or self._alive_workers > self._target_workers:
+                    self._alive_workers -= 1
+                    return
+                _, _, _, enqueued, path, on_done, handler = self._pop()
+                waited = time.monotonic() - enqueued
+                self.last_wait = waited
+                self.avg_wait = waited if not self.processed else self.avg_wait * 0.9 + waited * 0.1
+                self.max_wait = max(self.max_wait, waited)
+                self.active += 1
+                self._cond.notify_all()
+            try:
+                handler(path)
+            except Exception as e:
+                print(f"⚠️ Ошибка обработки {path}: {e}")
+            finally:
+                with self._cond:
+                    self.active -= 1
+                    self.processed += 1
+                    self._cond.notify_all()
+                if on_done:
+                    try: on_done(path)
+                    except Exception: pass
+
+    def depth(self):
+        with self._cond:
+            return self._size
+
+    def closed(self):
+        with self._cond:
+            return self._closed
+
+    def join(self, timeout=None):
+        """Ждет, пока очередь опустеет и все задачи завершатся."""
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._size and not self.active, timeout)
+
+    def shutdown(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "depth": self._size,
+                "by_source": {source: len(heap) for source, heap in self._heaps.items()},
+                "maxsize": self.maxsize,
+                "workers": self._target_workers,
+                "active": self.active,
+                "processed": self.processed,
+                "last_wait": self.last_wait,
+                "avg_wait": self.avg_wait,
+                "max_wait": self.max_wait,
+            }
+
+
+class ScanProgress:
+    """Прогресс принудительного сканирования: найдено/обработано файлов и байт, скорость."""
+    def __init__(self):
+        self._cond = threading.Condition()
+        self.state = "idle"
+        self.started = None
+        self.finished = None
+        self._reset()
+
+    def _reset(self):
+        self.enumerating = False
+        self.files_found = 0
+        self.files_done = 0
+        self.files_skipped = 0
+        self.bytes_found = 0
+        self.bytes_done = 0
+
+    def start(self):
+        with self._cond:
+            if self.state == "running": return False
+            self._reset()
+            self.state = "running"
+            self.enumerating = True
+            self.started = time.time()
+            self.finished = None
+            return True
+
+    def found(self, size):
+        with self._cond:
+            self.files_found += 1
+            self.bytes_found += size
+
+    def done(self, size, skipped=False):
+        with self._cond:
+            self.files_done += 1
+            self.bytes_done += size
+            if skipped: self.files_skipped += 1
+            self._cond.notify_all()
+
+    def end_enumeration(self):
+        with self._cond:
+            self.enumerating = False
+            self._cond.notify_all()
+
+    def wait(self, timeout=None):
+        """Ждет обработки всех найденных файлов; True — сканирование завершено."""
+        with self._cond:
+            return self._cond.wait_for(lambda: not self.enumerating and self.files_done >= self.files_found, timeout)
+
+    def finish(self, state="done"):
+        with self._cond:
+            self.state = state
+            self.enumerating = False
+            self.finished = time.time()
+
+    def progress(self):
+        with self._cond:
+            elapsed = ((self.finished or time.time()) - self.started) if self.started else 0
+            files_rate = self.files_done / elapsed if elapsed > 0 else 0
+            bytes_rate = self.bytes_done / elapsed if elapsed > 0 else 0
+            remaining = max(self.files_found - self.files_done, 0)
+            return {
+                "state": self.state,
+                "enumerating": self.enumerating,
+                "files_found": self.files_found,
+                "files_done": self.files_done,
+                "files_skipped": self.files_skipped,
+                "files_remaining": remaining,
+                "bytes_found": self.bytes_found,
+                "bytes_done": self.bytes_done,
+                "files_rate": files_rate,
+                "bytes_rate": bytes_rate,
+                "eta_sec": int(remaining / files_rate) if files_rate > 0 and self.state == "running" else None,
+            }
+
+    def summary(self):
+        p = self.progress()
+        more = "+" if p['enumerating'] else ""
+        return f"{p['files_done']}/{p['files_found']}{more} файлов, {p['files_rate']:.1f} ф/с, {format_bytes(p['bytes_rate'])}/s"
+
+
+class ClaimRegistry:
+    """Реестр путей «в работе»: каждый файл обрабатывается ровно одним потоком.
+
+    Общий для всех экземпляров CoreSorter, поэтому повторные постановки одного
+    файла (скан + событие watchdog + второй экземпляр) отбрасываются дешево.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._claimed = set()
+        self.dropped = 0
+
+    @staticmethod
+    def _key(path):
+        return os.path.normcase(os.path.abspath(path))
+
+    def claim(self, path):
+        key = self._key(path)
+        with self._lock:
+            if key in self._claimed:
+                self.dropped += 1
+                return False
+            self._claimed.add(key)
+            return True
+
+    def release(self, path):
+        with self._lock:
+            self._claimed.discard(self._key(path))
+
+    def stats(self):
+        with self._lock:
+            return {"in_flight": len(self._claimed), "dropped": self.dropped}
+
+
+inflight_claims = ClaimRegistry()
+
+
+# --- РАСПАКОВКА АРХИВОВ ---
+class ArchiveLimitError(Exception):
+    """Архив нарушает ограничения распаковки (размер, степень сжатия, число файлов) или небезопасен."""
+
+
+class ExtractBudget:
+    """Общий для всех потоков распаковки одного архива учет записанных байт и файлов.
+
+    Считаются реально записанные байты, а не размеры из заголовков: заголовкам бомбы врут.
+    """
+    def __init__(self, archive_size, max_bytes, max_ratio, max_members):
+        self._lock = threading.Lock()
+        self.archive_size = max(archive_size, 1)
+        self.max_bytes = max_bytes
+        self.max_ratio = max_ratio
+        self.max_members = max_members
+        self.bytes = 0
+        self.members = 0
+        self.error = None
+
+    def _fail(self, message):
+        # Вызывается под self._lock; остальные потоки прекращают работу на следующем блоке
+        self.error = ArchiveLimitError(message)
+        raise self.error
+
+    def member(self):
+        with self._lock:
+            if self.error: raise self.error
+            self.members += 1
+            if self.max_members and self.members > self.max_members:
+                self._fail(f"больше {self.max_members} файлов")
+
+    def add(self, n):
+        with self._lock:
+            if self.error: raise self.error
+            self.bytes += n
+            if self.max_bytes and self.bytes > self.max_bytes:
+                self._fail(f"распаковано больше {format_bytes(self.max_bytes)}")
+            if self.max_ratio and self.bytes > UNPACK_RATIO_MIN_BYTES and self.bytes > self.archive_size * self.max_ratio:
+                self._fail(f"степень сжатия больше {self.max_ratio}:1")
+
+    def abort(self, error):
+        with self._lock:
+            if not self.error: self.error = error
+
+
+class ArchiveProgress:
+    """Прогресс распаковки: активные архивы (файлы, байты, скорость) и итоги с момента запуска."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._active = {}
+        self._ids = itertools.count(1)
+        self.archives = 0
+        self.rejected = 0
+        self.failed = 0
+        self.members = 0
+        self.bytes = 0
+        self.busy_sec = 0.0
+
+    def start(self, name, members_total=None, bytes_total=None):
+        with self._lock:
+            key = next(self._ids)
+            self._active[key] = {"name": name, "members_done": 0, "members_total": members_total,
+                                 "bytes_done": 0, "bytes_total": bytes_total, "started": time.time()}
+            return key
+
+    def set_totals(self, key, members_total, bytes_total):
+        with self._lock:
+            item = self._active.get(key)
+            if item: item.update(members_total=members_total, bytes_total=bytes_total)
+
+    def advance(self, key, nbytes=0, members=0):
+        with self._lock:
+            item = self._active.get(key)
+            if not item: return
+            item["bytes_done"] += nbytes
+            item["members_done"] += members
+
+    def finish(self, key, state="done"):
+        # state: done / rejected (ограничения) / failed (ошибка чтения)
+        with self._lock:
+            item = self._active.pop(key, None)
+            if not item: return
+            self.busy_sec += time.time() - item["started"]
+            self.members += item["members_done"]
+            self.bytes += item["bytes_done"]
+            if state == "done": self.archives += 1
+            elif state == "rejected": self.rejected += 1
+            else: self.failed += 1
+
+    def progress(self):
+        with self._lock:
+            now = time.time()
+            active = []
+            for item in self._active.values():
+                elapsed = now - item["started"]
+                active.append(dict(item, bytes_rate=item["bytes_done"] / elapsed if elapsed > 0 else 0))
+            busy = self.busy_sec + sum(now - item["started"] for item in self._active.values())
+            done_bytes = self.bytes + sum(item["bytes_done"] for item in self._active.values())
+            return {
+                "active": active,
+                "archives": self.archives,
+                "rejected": self.rejected,
+                "failed": self.failed,
+                "members": self.members,
+                "bytes": self.bytes,
+                "bytes_rate": done_bytes / busy if busy > 0 else 0,
+            }
+
+archive_progress = ArchiveProgress()
+
+
+def archive_kind(path):
+    """Формат архива по имени: zip, tar, gz/bz2/xz (один сжатый файл) или None."""
+    name = Path(path).name.lower()
+    if name.endswith(".zip"): return "zip"
+    if name.endswith(TAR_EXTENSIONS): return "tar"
+    for ext in (".gz", ".bz2", ".xz"):
+        if name.endswith(ext): return ext[1:]
+    return None
+
+def archive_stem(path):
+    """Имя архива без расширения, включая двойные (.tar.gz)."""
+    name = Path(path).name
+    for ext in TAR_EXTENSIONS:
+        if name.lower().endswith(ext) and len(name) > len(ext): return name[:-len(ext)]
+    return Path(name).stem
+
+def _member_target(root, name):
+    # Абсолютные пути, диски и «..» не должны выводить за пределы папки распаковки
+    parts = [part for part in name.replace("\\", "/").split("/") if part not in ("", ".")]
+    if not parts or ".." in parts or name.startswith(("/", "\\")) or ":" in parts[0]:
+        raise ArchiveLimitError(f"небезопасный путь в архиве: {name}")
+    return os.path.join(root, *parts)
+
+def _stream_member(fin, target, budget, key, member_limit=None):
+    # Потоковая запись члена архива блоками с проверкой ограничений до записи каждого блока
+    buf = _get_hash_buffer()
+    view = memoryview(buf)
+    written = 0
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    with open(target, 'wb') as fout:
+        while True:
+            n = fin.readinto(buf)
+            if not n: break
+            written += n
+            if member_limit and written > member_limit:
+                budget.abort(ArchiveLimitError(f"степень сжатия файла {os.path.basename(target)} больше допустимой"))
+                raise budget.error
+            budget.add(n)
+            fout.write(view[:n])
+            archive_progress.advance(key, nbytes=n)
+    archive_progress.advance(key, members=1)
+
+def _zip_is_symlink(info):
+    return (info.external_attr >> 16) & 0o170000 == 0o120000
+
+def _extract_zip(src, dest, budget, key_name, workers):
+    files = []
+    key = archive_progress.start(key_name)
+    handles = []
+    local = threading.local()
+    try:
+        with zipfile.ZipFile(src) as zf:
+            # Каталоги и симлинки не распаковываются; пути и заявленные размеры проверяются до записи
+            members = [info for info in zf.infolist() if not info.is_dir() and not _zip_is_symlink(info)]
+            if budget.max_members and len(members) > budget.max_members:
+                raise ArchiveLimitError(f"больше {budget.max_members} файлов")
+            declared = sum(info.file_size for info in members)
+            if budget.max_bytes and declared > budget.max_bytes:
+                raise ArchiveLimitError(f"заявлено {format_bytes(declared)} при пределе {format_bytes(budget.max_bytes)}")
+            targets = [_member_target(dest, info.filename) for info in members]
+            archive_progress.set_totals(key, len(members), declared)
+            parallel = workers > 1 and len(members) > 1 and budget.archive_size >= UNPACK_PARALLEL_MIN_BYTES
+
+            def extract(info, target):
+                # Свой дескриптор архива на поток: распаковка zlib идет без GIL параллельно
+                handle = zf
+                if parallel:
+                    handle = getattr(local, 'zf', None)
+                    if handle is None:
+                        handle = local.zf = zipfile.ZipFile(src)
+                        handles.append(handle)
+                budget.member()
+                limit = max(info.compress_size * budget.max_ratio, UNPACK_RATIO_MIN_BYTES) if budget.max_ratio else None
+                with handle.open(info) as fin:
+                    _stream_member(fin, target, budget, key, limit)
+                try:
+                    mtime = time.mktime(info.date_time + (0, 0, -1))
+                    os.utime(target, (mtime, mtime))
+                except (OverflowError, ValueError):
+                    pass
+                return target
+
+            if parallel:
+                with ThreadPoolExecutor(max_workers=workers) as pool:
+                    futures = [pool.submit(extract, info, target) for info, target in zip(members, targets)]
+                    for future in futures:
+                        try:
+                            files.append(future.result())
+                        except BaseException as e:
+                            # Первая ошибка останавливает остальные потоки на следующем блоке
+                            budget.abort(e)
+                            raise
+            else:
+                files = [extract(info, target) for info, target in zip(members, targets)]
+    except BaseException as e:
+        archive_progress.finish(key, "rejected" if isinstance(e, ArchiveLimitError) else "failed")
+        raise
+    finally:
+        for handle in handles: handle.close()
+    archive_progress.finish(key)
+    return files
+
+def _extract_tar(src, dest, budget, key_name):
+    files = []
+    key = archive_progress.start(key_name)
+    try:
+        # Потоковый режим «r|*»: сжатый поток читается один раз, без перемотки
+        with tarfile.open(src, mode="r|*") as tf:
+            for member in tf:
+                # Симлинки, жесткие ссылки и устройства не распаковываются
+                if not member.isfile(): continue
+                budget.member()
+                if budget.max_bytes and budget.bytes + member.size > budget.max_bytes:
+                    raise ArchiveLimitError(f"распаковано больше {format_bytes(budget.max_bytes)}")
+                target = _member_target(dest, member.name)
+                _stream_member(tf.extractfile(member), target, budget, key)
+                os.utime(target, (member.mtime, member.mtime))
+                files.append(target)
+    except ArchiveLimitError:
+        archive_progress.finish(key, "rejected")
+        raise
+    except BaseException:
+        archive_progress.finish(key, "failed")
+        raise
+    archive_progress.finish(key)
+    return files
+
+def _extract_stream(src, dest, budget, key_name, kind):
+    # Один сжатый файл (.gz/.bz2/.xz): модули сжатия нужны только здесь
+    if kind == "gz": import gzip as module
+    elif kind == "bz2": import bz2 as module
+    else: import lzma as module
+    target = os.path.join(dest, Path(src).stem)
+    key = archive_progress.start(key_name, 1)
+    try:
+        budget.member()
+        with module.open(src, 'rb') as fin:
+            _stream_member(fin, target, budget, key)
+    except ArchiveLimitError:
+        archive_progress.finish(key, "rejected")
+        raise
+    except BaseException:
+        archive_progress.finish(key, "failed")
+        raise
+    archive_progress.finish(key)
+    return [target]
+
+def extract_archive(src, dest, max_bytes=0, max_ratio=0, max_members=0, workers=1):
+    """Потоковая распаковка zip/tar/gz/bz2/xz в папку dest; возвращает список распакованных файлов.
+
+    Ограничения (0 — без ограничения) проверяются по мере записи; при нарушении выбрасывается
+    ArchiveLimitError, уже распакованное удаляет вызывающий. Неподдерживаемый формат — shutil.ReadError.
+    """
+    src = Path(src)
+    kind = archive_kind(src)
+    if kind in ("gz", "bz2", "xz") and tarfile.is_tarfile(src): kind = "tar"
+    budget = ExtractBudget(src.stat().st_size, max_bytes, max_ratio, max_members)
+    if kind == "zip": return _extract_zip(src, dest, budget, src.name, max(1, workers))
+    if kind == "tar": return _extract_tar(src, dest, budget, src.name)
+    if kind: return _extract_stream(src, dest, budget, src.name, kind)
+    raise shutil.ReadError(f"Неподдерживаемый формат архива: {src.name}")
+
+
 # --- ГЛАВНЫЙ ДВИЖОК СОРТИРОВКИ ---
 class CoreSorter(FileSystemEventHandler):
-    def __init__(self, ui_callback=None):
+    def __init__(self, ui_callback=None, source=None, parent=None, quiet=False, dry_run=False):
         self.ui_callback = ui_callback
-        self._is_paused = False
+        # quiet — без уведомлений Telegram/Pop-up (пакетный режим командной строки)
+        self.quiet = parent.quiet if parent else quiet
+        # dry_run — только план сортировки: без создания папок, восстановления журнала и фоновой очистки
+        self.dry_run = parent.dry_run if parent else dry_run
+        # source — запись из extra_sources (None — основной источник source_folder/base_destination).
+        # Дополнительные источники работают на общем пуле и executor основного (parent)
+        self.source = source
+        self.parent = parent
+        self.extra_sorters = []
+        self._is_paused = parent._is_paused if parent else False
         self._lock = threading.Lock() # Добавлен лок для безопасной работы с переменными состояния
         
         # ИСПРАВЛЕНИЕ 1: Инициализация ThreadPoolExecutor перед вызовом reload_settings
-        self.executor = ThreadPoolExecutor(max_workers=5) 
+        # Executor — для служебных задач (очистка, сканирование, отчеты); файлы идут через WorkQueue
+        self.executor = parent.executor if parent else ThreadPoolExecutor(max_workers=3) 
         self._retention_thread = None 
         
         self.reload_settings() 
+        features = self.config['features']
+        self.scan_progress = ScanProgress()
+        self.work_queue = parent.work_queue if parent else WorkQueue(self._process_claimed, features.get('worker_threads', 5), features.get('queue_max', 1000))
+        # Снимок настроек обновляется по подписке, воркеры не читают файл настроек
+        cfg.subscribe(self._on_config_changed)
+        # Новые файлы ждут завершения записи в отдельном потоке, а не в потоке watchdog
+        self.stabilizer = WriteStabilizer(self.submit_task, lambda: self.config['features'].get('stable_window_sec', 2.0))
+        if parent or dry_run: return
 
+        self._recover_journal()
+        self._build_extra_sorters()
         # ИСПРАВЛЕНИЕ 2: Запуск потока очистки и хранения в отдельном демон-потоке
         # Гарантируем, что поток запускается только один раз
         if not self._retention_thread or not self._retention_thread.is_alive():
              self._retention_thread = threading.Thread(target=self._worker_retention_policy, daemon=True)
              self._retention_thread.start()
 
+    def _build_extra_sorters(self):
+        # Дополнительные источники из настроек: общий наблюдатель, пул потоков и очередь
+        for sorter in self.extra_sorters: sorter.close()
+        self.extra_sorters = []
+        # Сортировщик с явно заданным источником (командная строка) работает сам по себе
+        if self.source: return
+        for source in self.config.get('extra_sources', ()):
+            folder = source.get('source_folder')
+            if not folder or not Path(folder).is_dir():
+                print(f"⚠️ Дополнительный источник '{folder}' не найден и пропущен.")
+                continue
+            if Path(folder).resolve() in [sorter.src for sorter in self.all_sorters()]: continue
+            try: self.extra_sorters.append(CoreSorter(self.ui_callback, source=source, parent=self))
+            except Exception as e: print(f"⚠️ Ошибка подключения источника '{folder}': {e}")
+
+    def all_sorters(self):
+        return [self] + self.extra_sorters
+
+    def _recover_journal(self):
+        # Переносы, прерванные сбоем прошлого запуска: довести или откатить до приема новых файлов
+        for src, dst, outcome in operation_journal.recover():
+            details = JOURNAL_OUTCOMES.get(outcome, outcome)
+            self.log_action(Path(src).name, "ЖУРНАЛ", f"Восстановление после сбоя ({dst}): {details}")
+
+    def close(self):
+        # Отключение дополнительного источника: общие пул и executor остаются работать
+        self.stabilizer.stop()
+
+    def _effective_config(self, snapshot):
+        # Для дополнительного источника: свои папки и переопределения features поверх общих настроек
+        if not self.source: return snapshot
+        data = dict(snapshot)
+        data['source_folder'] = self.source.get('source_folder', '')
+        data['base_destination'] = self.source.get('base_destination') or snapshot['base_destination']
+        data['features'] = MappingProxyType({**snapshot['features'], **self.source.get('features', {})})
+        return MappingProxyType(data)
+
+    def _on_config_changed(self, snapshot):
+        snapshot = self._effective_config(snapshot)
+        recursive_changed = bool(self.config['features'].get('recursive_watch')) != bool(snapshot['features'].get('recursive_watch'))
+        sources_changed = snapshot.get('extra_sources') != self.config.get('extra_sources')
+        self.config = snapshot
+        if not getattr(self, 'work_queue', None): return
+        if self.parent: 
+            if recursive_changed and observer_instance: schedule_observer(observer_instance, self.parent)
+            return
+        if sources_changed: self._build_extra_sorters()
+        if (recursive_changed or sources_changed) and observer_instance:
+            schedule_observer(observer_instance, self)
+        self.work_queue.maxsize = max(1, int(snapshot['features'].get('queue_max', 1000)))
+        self.work_queue.resize(snapshot['features'].get('worker_threads', 5))
 
     def reload_settings(self):
         # Перезагрузка настроек
-        self.config = cfg.load()
+        cfg.load()
+        self.config = self._effective_config(cfg.snapshot())
         self.ext_map = {ext.lower(): folder for folder, exts in EXTENSIONS_DB.items() for ext in exts}
         
         s_path = self.config['source_folder']
@@ -403,29 +2551,114 @@ class CoreSorter(FileSystemEventHandler):
         try:
             # ИСПРАВЛЕНИЕ 7: Убеждаемся, что пути корректно разрешаются
             self.src = Path(s_path).resolve() 
-            if not self.src.exists():
+            if not self.src.exists() and not self.source:
                 # Fallback: Если папка не найдена, ставим Downloads, но предупреждаем
                 default_src = Path.home() / "Downloads"
                 self.src = default_src.resolve() if default_src.exists() else Path(__file__).resolve().parent
                 if not self.src.exists():
                      print(f"⚠️ Папка источника '{s_path}' не найдена. Проверьте настройки.")
-                self.config['source_folder'] = str(self.src)
-                cfg.save(self.config)
+                cfg.update_val(None, 'source_folder', str(self.src))
                 
         except Exception as e:
             print(f"Критическая ошибка пути источника: {e}. Проверьте путь в settings_rus.json.")
             # Не завершаем программу, а используем рабочий путь
             self.src = Path(__file__).resolve().parent
-            self.config['source_folder'] = str(self.src)
-            cfg.save(self.config)
+            cfg.update_val(None, 'source_folder', str(self.src))
 
         self.dest = Path(self.config['base_destination']).resolve()
-        self.dest.mkdir(parents=True, exist_ok=True)
         self.duplicate_dir = self.dest / DUPLICATE_FOLDER
         self.quarantine_dir = self.dest / QUARANTINE_FOLDER
-        self.duplicate_dir.mkdir(parents=True, exist_ok=True)
-        self.quarantine_dir.mkdir(parents=True, exist_ok=True)
+        if not self.dry_run:
+            known_dirs.ensure(self.dest)
+            known_dirs.ensure(self.duplicate_dir)
+            known_dirs.ensure(self.quarantine_dir)
+        self._own_roots = self._own_roots_in_source()
         
+        # Прогрев индекса не мешает сортировке: до его завершения дубликаты
+        # ищутся сверкой целевой папки, как и раньше
+        if not self.parent and self.config['features'].get('deduplication') and self.config['features'].get('index_warmup'):
+            self.start_index_warmup()
+
+    def _own_roots_in_source(self):
+        # Папки назначения, лежащие внутри источника, рекурсивный режим не обходит,
+        # иначе уже отсортированные файлы снова попадут в обработку
+        roots = [self.duplicate_dir, self.quarantine_dir]
+        if self.dest != self.src: roots.append(self.dest)
+        else: roots += [self.dest / name for name in EXTENSIONS_DB] + [self.dest / "99_Прочее"]
+        src_key = os.path.normcase(str(self.src)) + os.sep
+        keys = [os.path.normcase(str(r)) for r in roots]
+        return tuple(k for k in keys if k.startswith(src_key))
+
+    def _source_relative(self, path):
+        try: return Path(os.path.abspath(path)).relative_to(self.src)
+        except ValueError: return None
+
+    def _in_watch_scope(self, path, is_dir=False):
+        """Путь внутри источника и не отсеян глубиной/шаблонами рекурсивного режима."""
+        rel = self._source_relative(path)
+        if rel is None or not rel.parts: return False
+        dir_parts = rel.parts if is_dir else rel.parts[:-1]
+        if not dir_parts: return True
+        features = self.config['features']
+        if not features.get('recursive_watch'): return False
+        if len(dir_parts) > int(features.get('recursive_max_depth', 5)): return False
+        patterns = [p.lower() for p in self.config.get('recursive_ignore', ())]
+        if any(fnmatch.fnmatch(part.lower(), pat) for part in dir_parts for pat in patterns): return False
+        key = os.path.normcase(os.path.abspath(path))
+        return not any(key == r or key.startswith(r + os.sep) for r in self._own_roots)
+
+    def _iter_source_files(self, root):
+        # Ленивый обход через os.scandir: в подпапки спускаемся, только если они в зоне наблюдения
+        stack = [str(root)]
+        while stack:
+            current = stack.pop()
+            try:
+                with os.scandir(current) as it:
+                    for entry in it:
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                if self._in_watch_scope(entry.path, is_dir=True): stack.append(entry.path)
+                            elif entry.is_file():
+                                yield entry.path, entry.stat().st_size
+                        except OSError: continue
+            except OSError: continue
+
+    def _queue_ingest(self, folder, files=None, delay=0.0):
+        # Обход папки — задача общей очереди; постановка не ждет места, чтобы не занимать
+        # поток наблюдателя или обработчик: при заполненной очереди повтор по таймеру
+        if delay:
+            timer = threading.Timer(delay, self._queue_ingest, (folder, files))
+            timer.daemon = True
+            timer.start()
+            return
+        if self.work_queue.closed(): return
+        handler = lambda path: self._ingest_subtree(path, files)
+        if not self.work_queue.submit(folder, PRIORITY_BULK, 0, timeout=0, handler=handler, source=str(self.src)):
+            self._queue_ingest(folder, files, STABILIZE_POLL_INTERVAL)
+
+    def _ingest_subtree(self, folder, files=None):
+        # Брошенное в источник дерево папок: одна задача — одна папка, подпапки ставятся
+        # отдельными задачами. Файлы идут через стабилизатор (их еще могут дописывать)
+        # порциями, не больше queue_max ожидающих, остаток — следующей задачей
+        if files is None:
+            files = []
+            try:
+                with os.scandir(folder) as it:
+                    for entry in it:
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                if self._in_watch_scope(entry.path, is_dir=True): self._queue_ingest(entry.path)
+                            elif entry.is_file():
+                                files.append(entry.path)
+                        except OSError: continue
+            except OSError: return
+            if files: self.log_action(f"Папка {os.path.basename(folder)}", "ИСТОЧНИК", f"Поставлено в обработку файлов: {len(files)}")
+        room = max(0, int(self.config['features'].get('queue_max', 1000)) - self.stabilizer.pending_count())
+        for file_path in files[:room]: self._track(file_path, PRIORITY_BULK)
+        if len(files) > room: self._queue_ingest(folder, files[room:], STABILIZE_POLL_INTERVAL)
+
+    def start_index_warmup(self, force=False):
+        return index_warmup.start(self.dest, [self.quarantine_dir, self.duplicate_dir], force=force)
 
     # --- ИСПРАВЛЕННЫЙ ПОТОК ХРАНЕНИЯ/ОЧИСТКИ ---
     def _worker_retention_policy(self):
@@ -434,58 +2667,106 @@ class CoreSorter(FileSystemEventHandler):
             # Ждем 24 часа для следующей проверки
             time.sleep(timedelta(hours=24).total_seconds()) 
             
-            self.config = cfg.load()
-            
             with self._lock:
                 if self._is_paused: continue
             
-            # 1. Политика хранения (Retention)
-            days = self.config['features'].get('retention_days', 30)
-            if days > 0:
-                cutoff_date = datetime.now() - timedelta(days=days)
-                for folder in [self.duplicate_dir, self.quarantine_dir]:
-                    self.log_action(f"Начата проверка хранения: {folder.name}", "СИСТЕМА")
-                    for item in folder.iterdir():
-                        if item.is_file():
-                            try:
-                                # Проверка даты модификации файла
-                                if datetime.fromtimestamp(item.stat().st_mtime) < cutoff_date:
-                                    item.unlink()
-                                    self.log_action(item.name, folder.name, "УДАЛЕНО (Срок)")
-                            except Exception as e:
-                                self.log_action(item.name, folder.name, f"Ошибка удаления: {e}")
+            # 1. Политика хранения (Retention) — для карантина и дубликатов каждого источника
+            for sorter in self.all_sorters():
+                sorter._apply_retention()
+
+            # 1.1 Вытеснение старых записей истории первого обнаружения
+            try:
+                removed = first_seen_store.evict(self.config['features'].get('first_seen_retention_days', 365), FIRST_SEEN_MAX_ENTRIES)
+                if removed: self.log_action("История обнаружения", "СИСТЕМА", f"Удалено устаревших записей: {removed}")
+            except Exception as e:
+                self.log_action("История обнаружения", "ОШИБКА", str(e))
 
             # 2. Периодическая очистка пустых папок (Cleanup)
-            if self.config['features'].get('deep_clean'):
-                 # Запускаем Cleanup через executor, чтобы не блокировать поток
-                 self.executor.submit(self._worker_cleanup) 
+            for sorter in self.all_sorters():
+                if sorter.config['features'].get('deep_clean'):
+                    # Запускаем Cleanup через executor, чтобы не блокировать поток
+                    self.executor.submit(sorter._worker_cleanup) 
+
+    def _apply_retention(self):
+        days = self.config['features'].get('retention_days', 30)
+        if days <= 0: return
+        cutoff_date = datetime.now() - timedelta(days=days)
+        for folder in [self.duplicate_dir, self.quarantine_dir]:
+            self.log_action(f"Начата проверка хранения: {folder.name}", "СИСТЕМА")
+            for item in folder.iterdir():
+                if item.is_file():
+                    try:
+                        # Проверка даты модификации файла
+                        if datetime.fromtimestamp(item.stat().st_mtime) < cutoff_date:
+                            item.unlink()
+                            self.log_action(item.name, folder.name, "УДАЛЕНО (Срок)")
+                    except Exception as e:
+                        self.log_action(item.name, folder.name, f"Ошибка удаления: {e}")
 
 
     # --- Worker Process ---
-    def _worker_process(self, file_path_str):
+    def _process_claimed(self, file_path_str, unpack=True):
+        try: self._worker_process(file_path_str, unpack)
+        finally: inflight_claims.release(file_path_str)
+
+    def _process_claimed_no_unpack(self, file_path_str):
+        self._process_claimed(file_path_str, unpack=False)
+
+    def _worker_process(self, file_path_str, unpack=True):
         path = Path(file_path_str).resolve()
         
-        # Обновляем конфиг на случай, если он был изменен в вебе/консоли
-        self.config = cfg.load() 
-        
         if not path.exists() or path.is_dir(): return
         
         # Проверка игнорируемых файлов
         if path.suffix.lower() in self.config['ignore_list'] or path.name in self.config['ignore_list']: 
             return
+        if is_internal_file(path): return
         
-        cfg.increment_stats(filename=path.name)
+        stats_store.record_file(path.name)
+        try: pipeline_stats.add(files=1, bytes=path.stat().st_size)
+        except OSError: pipeline_stats.add(files=1)
         
         # Режим карантина (Черный список)
         if self.config['features'].get('quarantine_mode') and path.suffix.lower() in self.config['quarantine_blacklist']:
             self.move_to_quarantine(path, "Подозрительное расширение (ЧС)")
             return
 
+        started = time.perf_counter()
+        ext = path.suffix.lower()
+        category_name, target_dir = self._classify(path)
+        known_dirs.ensure(target_dir)
+        pipeline_stats.add_stage("classify", started)
+        
+        try:
+            # Обработка архивов
+            if unpack and self.config['features'].get('auto_unpack') and ext in ARCHIVE_EXTENSIONS:
+                self.handle_archive(path, target_dir, category_name)
+            else:
+                dest_path = self.move_safe(path, target_dir, category_name)
+                if dest_path:
+                    started = time.perf_counter()
+                    self.attempt_telegram_upload(dest_path)
+                    pipeline_stats.add_stage("notify", started)
+                    
+        except Exception as e:
+            pipeline_stats.add(errors=1)
+            self.move_to_quarantine(path, f"Ошибка обработки: {e}")
+        
+        # Запуск очистки пустых папок после перемещения
+        if self.config['features'].get('deep_clean'): self.executor.submit(self._worker_cleanup)
+
+    def _classify(self, path):
+        """Категория и папка назначения файла (папки не создаются)."""
         ext = path.suffix.lower()
         # Использование get() для безопасного доступа к категориям
         category_name = self.ext_map.get(ext, f"99_Прочее\\{ext.replace('.', '').upper()}")
         target_dir = self.dest / category_name
         
+        # Рекурсивный режим: повторяем структуру подпапок источника внутри категории
+        if self.config['features'].get('preserve_subfolders'):
+            rel = self._source_relative(path)
+            if rel is not None and len(rel.parts) > 1: target_dir = target_dir.joinpath(*rel.parts[:-1])
+        
         # Сортировка по метаданным
         meta_subfolder = get_metadata_folder(path)
         if meta_subfolder: target_dir = target_dir / meta_subfolder
@@ -503,131 +2784,362 @@ class CoreSorter(FileSystemEventHandler):
                     sort_date = datetime.now().date()
             
             target_dir = target_dir / str(sort_date.year) / sort_date.strftime("%m_%B")
+        return category_name, target_dir
 
-        target_dir.mkdir(parents=True, exist_ok=True)
-        
+    # --- План сортировки (dry-run) ---
+    def plan_file(self, file_path_str):
+        """Решение конвейера для файла без перемещения: move / duplicate / quarantine / unpack (None — файл пропускается)."""
+        path = Path(file_path_str).resolve()
+        if path.suffix.lower() in self.config['ignore_list'] or path.name in self.config['ignore_list']: return None
+        if is_internal_file(path): return None
+        try: st = path.stat()
+        except OSError: return None
+        entry = {"action": "move", "source": str(path), "target": "", "category": "", "original": "", "reason": "",
+                 "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+        features = self.config['features']
+        if features.get('quarantine_mode') and path.suffix.lower() in self.config['quarantine_blacklist']:
+            entry.update(action="quarantine", target=str(self.quarantine_dir / path.name), reason="Подозрительное расширение (ЧС)")
+            return entry
+        category_name, target_dir = self._classify(path)
+        entry["category"] = category_name
+        if features.get('auto_unpack') and path.suffix.lower() in ARCHIVE_EXTENSIONS:
+            entry.update(action="unpack", target=str(target_dir / archive_stem(path)))
+            return entry
+        if features.get('deduplication'):
+            # Поиск без записи: ни индекс, ни папки назначения не меняются
+            scope = (self.dest, [self.quarantine_dir, self.duplicate_dir]) if features.get('dedup_scope') == 'global' else None
+            existing_file = hash_index.peek_duplicate(target_dir, path, st, scope)
+            if existing_file:
+                original = existing_file.name if existing_file.parent == target_dir else self._relative_to_dest(existing_file)
+                entry.update(action="duplicate", target=str(self.duplicate_dir / path.name), original=original)
+                return entry
+        entry["target"] = str(target_dir / path.name)
+        return entry
+
+    def build_plan(self, jobs=None):
+        """План для всех файлов источника; классификация и поиск дубликатов идут параллельно."""
+        ignore_list = self.config['ignore_list']
+        paths = (file_path for file_path, _ in self._iter_source_files(self.src)
+                 if os.path.splitext(os.path.basename(file_path))[1].lower() not in ignore_list
+                 and os.path.basename(file_path) not in ignore_list)
+        with ThreadPoolExecutor(max_workers=jobs or self.config['features'].get('worker_threads', 5)) as pool:
+            entries = [entry for entry in pool.map(self.plan_file, paths) if entry]
+        if self.config['features'].get('deduplication'): self._mark_planned_duplicates(entries)
+        return entries
+
+    def _mark_planned_duplicates(self, entries):
+        # Одинаковые файлы внутри самого плана: после переноса первого остальные станут дубликатами
+        global_scope = self.config['features'].get('dedup_scope') == 'global'
+        groups = {}
+        for entry in entries:
+            if entry["action"] != "move": continue
+            folder = "" if global_scope else os.path.dirname(entry["target"])
+            groups.setdefault((folder, entry["size"]), []).append(entry)
+        for group in groups.values():
+            if len(group) < 2: continue
+            first_by_hash = {}
+            for entry in group:
+                digest = calculate_hash(entry["source"])
+                if not digest: continue
+                first = first_by_hash.setdefault(digest, entry)
+                if first is not entry:
+                    entry.update(action="duplicate", target=str(self.duplicate_dir / Path(entry["source"]).name),
+                                 original=self._relative_to_dest(first["target"]))
+
+    def apply_plan(self, entries, jobs=None):
+        """Выполняет (просмотренный) план; записи с одинаковой целью идут последовательно, остальные — параллельно."""
+        groups = {}
+        for entry in entries:
+            groups.setdefault(os.path.normcase(entry.get("target") or entry["source"]), []).append(entry)
+        results = {}
+        lock = threading.Lock()
+        def run_group(group):
+            for entry in group:
+                status = self._apply_plan_entry(entry)
+                with lock: results[status] = results.get(status, 0) + 1
+        with ThreadPoolExecutor(max_workers=jobs or self.config['features'].get('worker_threads', 5)) as pool:
+            for future in [pool.submit(run_group, group) for group in groups.values()]: future.result()
+        return results
+
+    def _apply_plan_entry(self, entry):
+        src = Path(entry["source"])
+        try: st = src.stat()
+        except OSError: return "missing"
+        # Файл изменился после планирования — решение могло устареть
+        if st.st_size != int(entry.get("size") or st.st_size) or st.st_mtime_ns != int(entry.get("mtime_ns") or st.st_mtime_ns):
+            self.log_action(src.name, "ПЛАН", "Пропущен: файл изменился после планирования")
+            return "changed"
+        action = entry.get("action")
+        if action == "skip": return "skipped"
+        if action not in ("quarantine", "duplicate", "unpack", "move"): return "unknown"
+        stats_store.record_file(src.name)
+        pipeline_stats.add(files=1, bytes=st.st_size)
+        if action == "quarantine":
+            return action if self.move_to_quarantine(src, entry.get("reason") or "По плану") else "error"
+        if action == "duplicate":
+            return action if self._log_and_move_duplicate(src, entry.get("original") or "") else "error"
+        if action == "unpack":
+            target = Path(entry["target"])
+            known_dirs.ensure(target.parent)
+            self.handle_archive(src, target.parent, entry.get("category") or target.parent.name)
+            return action
+        # action == "move"
+        dest_file = Path(entry["target"])
+        known_dirs.ensure(dest_file.parent)
+        dest_file = name_allocator.allocate(dest_file.parent, dest_file.name)
         try:
-            # Обработка архивов
-            if self.config['features'].get('auto_unpack') and ext in [".zip", ".rar", ".7z"]:
-                self.handle_archive(path, target_dir, category_name)
-            else:
-                dest_path = self.move_safe(path, target_dir, category_name)
-                if dest_path:
-                    self.attempt_telegram_upload(dest_path)
-                    
+            dedup = self.config['features'].get('deduplication')
+            copied_hash = self._move(src, dest_file, need_hash=dedup)
+            if dedup: hash_index.add(dest_file, copied_hash)
+            pipeline_stats.add(sorted=1)
+            self.log_success(dest_file.name, entry.get("category") or dest_file.parent.name, local_move=True)
+            return action
         except Exception as e:
-            self.move_to_quarantine(path, f"Ошибка обработки: {e}")
-        
-        # Запуск очистки пустых папок после перемещения
-        if self.config['features'].get('deep_clean'): self.executor.submit(self._worker_cleanup)
+            pipeline_stats.add(errors=1)
+            self.move_to_quarantine(src, f"Критическая ошибка перемещения: {e}")
+            return "error"
 
     # --- move_safe ---
     def move_safe(self, src, folder, category_name):
         
         # 1. Детекция дубликатов
+        src_hash = src_partial = None
+        started = time.perf_counter()
         if self.config['features'].get('deduplication'):
-            src_hash = calculate_hash(src)
-            if src_hash:
-                # Итерация по существующим файлам в целевой папке
-                for existing_file in folder.iterdir():
-                    if existing_file.is_file() and calculate_hash(existing_file) == src_hash:
-                        self._log_and_move_duplicate(src, existing_file.name)
-                        return None 
+            scope = None
+            if self.config['features'].get('dedup_scope') == 'global':
+                scope = (self.dest, [self.quarantine_dir, self.duplicate_dir])
+            st = src.stat()
+            if self.config['features'].get('dedup_mode', 'tiered') == 'tiered':
+                # Ступенчатая проверка: большинство файлов отсеивается по размеру без чтения
+                existing_file, src_hash, src_partial = hash_index.find_duplicate_tiered(folder, src, st, scope)
+            else:
+                src_hash = calculate_hash(src)
+                if src_hash: dedup_stats.add(full_read_bytes=st.st_size)
+                # Поиск по индексу хэшей вместо пересчета всех файлов целевой папки
+                existing_file = hash_index.find_duplicate(folder, src_hash, st.st_size, scope) if src_hash else None
+            if existing_file:
+                original = existing_file.name if existing_file.parent == folder else self._relative_to_dest(existing_file)
+                pipeline_stats.add_stage("dedup", started)
+                self._log_and_move_duplicate(src, original)
+                return None 
+            pipeline_stats.add_stage("dedup", started)
         
         # 2. Обработка конфликтов имен
-        dest_file = folder / src.name
-        if dest_file.exists():
-            ts = datetime.now().strftime("_%Y%m%d_%H%M%S")
-            dest_file = folder / f"{src.stem}{ts}{src.suffix}"
+        dest_file = name_allocator.allocate(folder, src.name)
             
         # 3. Перемещение файла
         try:
-            # Используем shutil.move для лучшей кросс-платформенной совместимости
-            # и возможности перемещения между различными дисками
-            shutil.move(str(src.resolve()), str(dest_file.resolve())) 
+            started = time.perf_counter()
+            # Между разными дисками файл копируется с одновременным подсчетом хэша,
+            # чтобы не читать его второй раз для индекса дубликатов
+            # Хэш при копировании между дисками нужен, только если его не посчитала дедупликация
+            dedup = self.config['features'].get('deduplication')
+            copied_hash = self._move(src, dest_file, need_hash=dedup and not src_hash)
+            if dedup:
+                hash_index.add(dest_file, src_hash or copied_hash, partial=src_partial)
+            pipeline_stats.add_stage("move", started)
+            pipeline_stats.add(sorted=1)
+            started = time.perf_counter()
             self.log_success(dest_file.name, category_name, local_move=True)
+            pipeline_stats.add_stage("notify", started)
             return dest_file 
         except Exception as e:
+            pipeline_stats.add(errors=1)
             self.move_to_quarantine(src, f"Критическая ошибка перемещения: {e}")
             return None
 
+    def _move(self, src, dst, need_hash=False):
+        if not self.config['features'].get('operation_journal', True): return self._move_file(src, dst, need_hash)
+        # В журнал попадают только копии между дисками: переименование атомарно, восстанавливать нечего.
+        # Намерение фиксируется до создания копии, хэш копии — до удаления источника, итог — без ожидания
+        ops = []
+        def before_copy(): ops.append(operation_journal.begin(src, dst))
+        def after_copy(digest):
+            if digest: operation_journal.copied(ops[-1], digest, get_hash_algorithm())
+        try:
+            result = self._move_file(src, dst, need_hash, before_copy, after_copy)
+        except BaseException:
+            for op in ops: operation_journal.finish(op, ok=False)
+            raise
+        for op in ops: operation_journal.finish(op)
+        return result
+
+    def _move_file(self, src, dst, need_hash, before_copy=None, after_copy=None):
+        features = self.config['features']
+        options = dict(verify=features.get('verify_copy'), need_hash=need_hash, fsync_policy=features.get('fsync_policy', 'file'),
+                       before_copy=before_copy, after_copy=after_copy)
+        try:
+            return move_file(src, dst, **options)
+        except FileNotFoundError:
+            # Папку назначения удалили в обход кэша — создаем заново и повторяем один раз
+            parent = os.path.dirname(os.fspath(dst))
+            if not os.path.exists(src) or os.path.isdir(parent): raise
+            known_dirs.invalidate(parent)
+            known_dirs.ensure(parent)
+            return move_file(src, dst, **options)
+
+    def _relative_to_dest(self, path):
+        try:
+            return str(Path(path).relative_to(self.dest))
+        except ValueError:
+            return Path(path).name
+
+    # --- Отчет о дубликатах в папке назначения ---
+    def duplicates_report(self):
+        self.executor.submit(self._worker_duplicates_report)
+
+    def _worker_duplicates_report(self):
+        self.log_action("Отчет о дубликатах", "СИСТЕМА", "Начат поиск дубликатов в папке назначения")
+        try:
+            report = build_duplicates_report(self.dest, [self.quarantine_dir, self.duplicate_dir])
+        except Exception as e:
+            self.log_action("Отчет о дубликатах", "ОШИБКА", str(e))
+            return
+        message = (f"Найдено групп дубликатов: {report['groups']}, лишних файлов: {report['duplicate_files']}, "
+                   f"занято: {format_bytes(report['wasted_bytes'])} ({report['duration_sec']} сек.)")
+        self.log_action("Отчет о дубликатах", "СИСТЕМА", message)
+        self._notify_event(f"🔍 {message}")
+
     # --- log_success ---
     def log_success(self, filename, category_name, local_move=False):
-        cfg.increment_stats(category_name=category_name) 
+        stats_store.record_category(category_name)
         self.log_action(filename, category_name)
         if local_move: 
             if self.config['features'].get('sound_enabled'): 
-                try: winsound.PlaySound("SystemExclamation", winsound.SND_ASYNC)
+                try:
+                    if winsound: winsound.PlaySound("SystemExclamation", winsound.SND_ASYNC)
                 except: pass
-            first_seen_date = cfg.get_file_first_seen(filename)
+            first_seen_date = stats_store.get_file_first_seen(filename)
             self._notify_event(f"Файл: `{filename}` отсортирован в категорию: *{category_name}*.\n_Обнаружен:_ {first_seen_date}", level="SUCCESS")
 
 
     # --- move_to_quarantine ---
     def move_to_quarantine(self, src, reason):
-        quarantine_file = self.quarantine_dir / src.name
-        counter = 1
-        while quarantine_file.exists():
-            quarantine_file = self.quarantine_dir / f"{src.stem}_({counter}){src.suffix}"
-            counter += 1
+        quarantine_file = name_allocator.allocate(self.quarantine_dir, src.name)
         
         try:
-            # Используем shutil.move для безопасности
-            shutil.move(str(src.resolve()), str(quarantine_file.resolve()))
-            first_seen_date = cfg.get_file_first_seen(src.name)
-            send_telegram_message(f"Файл: `{src.name}` перемещен в карантин.\n*Причина:* {reason}\n_Обнаружен:_ {first_seen_date}", level="QUARANTINE")
+            self._move(src, quarantine_file)
+            first_seen_date = stats_store.get_file_first_seen(src.name)
+            pipeline_stats.add(quarantined=1)
+            self._notify_event(f"Файл: `{src.name}` перемещен в карантин.\n*Причина:* {reason}\n_Обнаружен:_ {first_seen_date}", level="QUARANTINE")
             self.log_action(src.name, QUARANTINE_FOLDER, reason)
+            return True
         except Exception as e:
+            pipeline_stats.add(errors=1)
             self.log_action(src.name, "ОШИБКА", f"Не удалось переместить в карантин: {e}")
+            return False
 
     # --- _log_and_move_duplicate ---
     def _log_and_move_duplicate(self, src_path, original_name):
-        dup_file = self.duplicate_dir / src_path.name
-        counter = 1
-        while dup_file.exists():
-            dup_file = self.duplicate_dir / f"{src_path.stem}_({counter}){src_path.suffix}"
-            counter += 1
+        dup_file = name_allocator.allocate(self.duplicate_dir, src_path.name)
         
         try:
-            # Используем shutil.move для безопасности
-            shutil.move(str(src_path.resolve()), str(dup_file.resolve()))
-            first_seen_date = cfg.get_file_first_seen(src_path.name)
-            send_telegram_message(f"Файл: `{src_path.name}` является дубликатом. Оригинал: `{original_name}`.\n_Обнаружен:_ {first_seen_date}", level="DUPLICATE")
+            self._move(src_path, dup_file)
+            first_seen_date = stats_store.get_file_first_seen(src_path.name)
+            pipeline_stats.add(duplicates=1)
+            self._notify_event(f"Файл: `{src_path.name}` является дубликатом. Оригинал: `{original_name}`.\n_Обнаружен:_ {first_seen_date}", level="DUPLICATE")
             self.log_action(src_path.name, DUPLICATE_FOLDER, f"Оригинал: {original_name}")
+            return True
         except Exception as e:
+            pipeline_stats.add(errors=1)
             self.log_action(src_path.name, "ОШИБКА", f"Не удалось переместить дубликат: {e}")
+            return False
 
 
     def pause(self): 
         with self._lock: 
             self._is_paused = True
+        for sorter in self.extra_sorters: sorter.pause()
     
     def resume(self): 
         with self._lock: 
             self._is_paused = False
+        for sorter in self.extra_sorters: sorter.resume()
+
+    def _track(self, path, priority=PRIORITY_LIVE):
+        # Временные файлы загрузок (.crdownload, .part) не отслеживаем — ждем их переименования
+        name = os.path.basename(path)
+        ignore_list = self.config['ignore_list']
+        if os.path.splitext(name)[1].lower() in ignore_list or name in ignore_list: return
+        if is_internal_file(path) or not self._in_watch_scope(path): return
+        # Повторные события для пути сливаются в одну задачу в WriteStabilizer
+        self.stabilizer.add(path, priority)
 
     def on_created(self, event):
+        if event.is_directory:
+            # Папку могли перенести целиком — событий для вложенных файлов тогда не будет
+            if self._in_watch_scope(event.src_path, is_dir=True): self._queue_ingest(event.src_path)
+        else:
+            # Файл будет передан в обработку, когда его запись завершится
+            self._track(event.src_path)
+
+    def on_modified(self, event):
         if not event.is_directory:
-            # Даем системе время завершить запись файла
-            time.sleep(1.0) 
-            self.submit_task(event.src_path)
+            self._track(event.src_path)
 
-    def submit_task(self, path):
+    def on_moved(self, event):
+        # Браузеры дописывают file.crdownload/.part и затем переименовывают его
+        if event.is_directory:
+            if self._in_watch_scope(event.dest_path, is_dir=True): self._queue_ingest(event.dest_path)
+            return
+        self.stabilizer.discard(event.src_path)
+        self._track(event.dest_path)
+
+    def submit_task(self, path, priority=PRIORITY_LIVE, size=None, on_done=None, unpack=True):
         with self._lock:
-            if not self._is_paused: self.executor.submit(self._worker_process, path)
+            if self._is_paused: return False
+        # Файл уже в очереди или обрабатывается (в т.ч. другим экземпляром) — повтор отбрасываем
+        if not inflight_claims.claim(path): return False
+        handler = self._process_claimed if unpack else self._process_claimed_no_unpack
+        # Вне лока: при переполненной очереди постановка ждет, а пауза не должна блокироваться
+        if self.work_queue.submit(path, priority, size, on_done, handler=handler, source=str(self.src)): return True
+        inflight_claims.release(path)
+        return False
 
     def force_scan(self):
+        if self.scan_progress.state == "running":
+            self.log_action("Сканирование", "СИСТЕМА", "Уже выполняется")
+            return False
         self.executor.submit(self._worker_force_scan)
+        return True
 
     def _worker_force_scan(self):
-        self.config = cfg.load() 
+        progress = self.scan_progress
+        if not progress.start(): return
         self._notify_event("Начато принудительное сканирование.")
-        for item in self.src.iterdir():
-            if item.is_file(): self._worker_process(str(item.resolve()))
-        self._notify_event("Принудительное сканирование завершено.")
+        last_refresh = 0.0
+        try:
+            # Потоковый обход: файлы уходят в очередь по мере чтения каталога,
+            # при заполнении очереди обход ждет, пока обработчики ее разгрузят
+            # Источники обходятся по очереди, а очередь раздает их файлы потокам по кругу
+            for sorter in self.all_sorters():
+                ignore_list = sorter.config['ignore_list']
+                for file_path, size in sorter._iter_source_files(sorter.src):
+                    name = os.path.basename(file_path)
+                    if os.path.splitext(name)[1].lower() in ignore_list or name in ignore_list: continue
+                    progress.found(size)
+                    if not sorter.submit_task(file_path, PRIORITY_BULK, size, lambda _p, n=size: progress.done(n)):
+                        # Пауза или файл уже в работе — считаем пропущенным
+                        progress.done(size, skipped=True)
+                    if time.monotonic() - last_refresh >= 1.0:
+                        last_refresh = time.monotonic()
+                        refresh_tray_status()
+            progress.end_enumeration()
+            while not progress.wait(1.0): refresh_tray_status()
+            progress.finish()
+            self._notify_event(f"Принудительное сканирование завершено: {progress.summary()}.")
+        except Exception as e:
+            progress.finish("error")
+            self._notify_event(f"Ошибка сканирования: {e}", level="ERROR")
+        refresh_tray_status()
+
+    def shutdown(self):
+        self.work_queue.shutdown()
+        self.executor.shutdown(wait=False)
 
     def attempt_telegram_upload(self, file_path):
-        if cfg.data.get('telegram', {}).get('upload_enabled'):
+        if not self.quiet and cfg.data.get('telegram', {}).get('upload_enabled'):
             success, message = send_file_to_telegram(file_path)
             
             if success:
@@ -636,26 +3148,32 @@ class CoreSorter(FileSystemEventHandler):
                 self.log_action(Path(file_path).name, "TELEGRAM ОШИБКА", message)
                 
     def _notify_event(self, message, level="INFO"):
+        if self.quiet: return
         send_telegram_message(message, level=level) 
         
         if level == "ERROR":
-            notification.notify(title="КРИТИЧЕСКАЯ ОШИБКА", message=message, app_name=APP_NAME, timeout=5)
+            notify_popup("КРИТИЧЕСКАЯ ОШИБКА", message, timeout=5)
         # Отправляем системное уведомление только при успехе и если включено в настройках
-        elif level == "SUCCESS" and cfg.data['features'].get('notifications'):
+        elif level == "SUCCESS" and self.config['features'].get('notifications'):
             # Ограничиваем сообщение для Pop-up
             try:
                 short_message = message.split('\n')[0].replace("`", "")
-                notification.notify(title="Файл отсортирован", message=short_message, app_name=APP_NAME, timeout=2)
+                notify_popup("Файл отсортирован", short_message, timeout=2)
             except:
                  pass
 
 
     def log_action(self, filename, where, details=""):
         ts = datetime.now().strftime("%H:%M:%S")
+        line = f"[{ts}] {filename} -> {where}. {details}\n"
+        if self.config['features'].get('operation_journal', True):
+            # Строки пишутся в history.log пачкой потоком фиксации журнала, UI обновляется после записи
+            operation_journal.log(line, self.ui_callback)
+            return
         log_path = Path(__file__).resolve().parent / LOG_FILE
         try:
             with open(log_path, "a", encoding="utf-8") as f:
-                f.write(f"[{ts}] {filename} -> {where}. {details}\n")
+                f.write(line)
             if self.ui_callback: 
                  # Безопасный вызов колбэка
                  try: self.ui_callback()
@@ -664,28 +3182,51 @@ class CoreSorter(FileSystemEventHandler):
             print(f"[{ts}] ОШИБКА ЛОГА: {filename}. {e}")
 
     def handle_archive(self, src, folder, category_name):
-        unpack_path = folder / src.stem
-        unpack_path.mkdir(parents=True, exist_ok=True)
+        features = self.config['features']
+        # Своя папка на каждый архив: повторная распаковка одноименного архива не смешивается с прошлой
+        unpack_path = name_allocator.allocate(folder, archive_stem(src))
+        known_dirs.ensure(unpack_path)
         try:
-            # Использование shutil.unpack_archive для zip, tar.gz, tar.bz2.
-            # Для 7z и rar требуется внешняя утилита, но для стандартного функционала достаточно.
-            # Если файл не является стандартным, shutil.unpack_archive выкинет ошибку.
-            shutil.unpack_archive(str(src.resolve()), str(unpack_path.resolve()))
-            # Перемещаем сам архив в папку с содержимым
-            shutil.move(str(src.resolve()), str(unpack_path / src.name).resolve())
-            self._notify_event(f"📦 Архив: `{src.name}` успешно распакован в папку: `{unpack_path.name}`", level="SUCCESS")
-            self.log_success(f"📦 {src.name}", category_name, local_move=True)
-        except (shutil.ReadError, zipfile.BadZipFile, EOFError) as e:
-            # Если архив нечитаем, перемещаем в карантин
-            self.move_to_quarantine(src, f"Не удалось распаковать архив: {e}")
+            files = extract_archive(src, unpack_path,
+                                    max_bytes=int(features.get('unpack_max_total_mb', 4096)) * 1024 * 1024,
+                                    max_ratio=int(features.get('unpack_max_ratio', 200)),
+                                    max_members=int(features.get('unpack_max_members', 20000)),
+                                    workers=int(features.get('unpack_workers', 4)))
+        except Exception as e:
+            # Частично распакованное удаляется целиком: папка создана только для этого архива.
+            # Только при ошибке распаковки — после переноса в папке лежит и сам архив
+            shutil.rmtree(unpack_path, ignore_errors=True)
+            known_dirs.invalidate(unpack_path)
+            if isinstance(e, ArchiveLimitError):
+                self.move_to_quarantine(src, f"Архив отклонен: {e}")
+            elif isinstance(e, (shutil.ReadError, zipfile.BadZipFile, tarfile.TarError, EOFError)):
+                # Если архив нечитаем, перемещаем в карантин
+                self.move_to_quarantine(src, f"Не удалось распаковать архив: {e}")
+            else:
+                self.move_to_quarantine(src, f"Ошибка распаковки: {e}")
+            return
+        try:
+            # Перемещаем сам архив в папку с содержимым; в архиве может лежать одноименный файл
+            self._move(src, name_allocator.allocate(unpack_path, src.name))
         except Exception as e:
-            self.move_to_quarantine(src, f"Ошибка распаковки: {e}")
+            # Распакованное остается на месте, архив — в карантин
+            self.move_to_quarantine(src, f"Архив распакован, но не перемещен: {e}")
+        else:
+            self._notify_event(f"📦 Архив: `{src.name}` успешно распакован в папку: `{unpack_path.name}` (файлов: {len(files)})", level="SUCCESS")
+            self.log_success(f"📦 {src.name}", category_name, local_move=True)
+        if features.get('unpack_resort') and files:
+            # Постановка из служебного потока: воркер не должен ждать места в собственной очереди
+            self.executor.submit(self._resubmit_extracted, files)
+
+    def _resubmit_extracted(self, files):
+        # Распакованные файлы сортируются как новые; вложенные архивы повторно не распаковываются
+        for path in files:
+            self.submit_task(path, PRIORITY_BULK, unpack=False)
 
 
     # --- _worker_cleanup ---
-    def _worker_cleanup(self):
-        self.config = cfg.load()
-        if self._is_paused or not self.config['features'].get('deep_clean'): return
+    def _worker_cleanup(self, force=False):
+        if self._is_paused or not (force or self.config['features'].get('deep_clean')): return
         
         # Включаем для очистки только папку назначения, избегая мусора в папке источника
         all_root_dirs = set([self.dest.resolve()])
@@ -706,6 +3247,7 @@ class CoreSorter(FileSystemEventHandler):
                         # Проверяем, пуста ли папка
                         if not any(current_dir.iterdir()):
                             current_dir.rmdir()
+                            known_dirs.invalidate(current_dir)
                             self.log_action(f"Папка {current_dir.name}", "ОЧИСТКА", "Удалена пустая директория")
                     except OSError as e:
                         # OSError 39 (Directory not empty) - стандартная ошибка, игнорируем
@@ -715,6 +3257,94 @@ class CoreSorter(FileSystemEventHandler):
                         self.log_action(current_dir.name, "ОЧИСТКА ОШИБКА", f"Критическая ошибка: {e}")
 
 
+# --- БЕНЧМАРК ХЭШИРОВАНИЯ ---
+def _legacy_hash(path, algorithm='sha256'):
+    # Прежняя реализация (блоки по 8 KB) — для сравнения в бенчмарке
+    hasher = hashlib.new(algorithm)
+    with open(path, 'rb') as file:
+        while True:
+            chunk = file.read(8192)
+            if not chunk: break
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+def benchmark_hashing(directory, size_mb=256, algorithms=None, repeat=2):
+    """Замеряет скорость хэширования (MB/s) каждым алгоритмом на временном файле в directory."""
+    results = []
+    fd, tmp_path = tempfile.mkstemp(prefix="x4_bench_", dir=str(directory))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for _ in range(size_mb):
+                f.write(os.urandom(1024 * 1024))
+        _legacy_hash(tmp_path)  # прогрев кэша ОС, чтобы все алгоритмы были в равных условиях
+        cases = [("sha256 (8 KB, старый)", lambda: _legacy_hash(tmp_path))]
+        cases += [(name, lambda name=name: calculate_hash(tmp_path, name)) for name in (algorithms or HASH_ALGORITHMS)]
+        for name, func in cases:
+            best = None
+            for _ in range(repeat):
+                started = time.perf_counter()
+                func()
+                elapsed = time.perf_counter() - started
+                best = elapsed if best is None else min(best, elapsed)
+            results.append((name, size_mb / best if best else 0.0))
+    finally:
+        try: os.remove(tmp_path)
+        except OSError: pass
+    return results
+
+# --- БЕНЧМАРК ПЕРЕНОСА ФАЙЛОВ ---
+def _bench_copy_move(strategy, hashed=False):
+    # Перенос между дисками: копия выбранным способом + удаление источника
+    def move(src, dst):
+        if hashed: copy_with_hash(src, dst)
+        else: copy_file_fast(src, dst, strategy=strategy)
+        os.remove(src)
+    return move
+
+def benchmark_moves(directory, target=None, small_count=500, small_kb=16, large_mb=256):
+    """Сравнивает способы переноса: [(способ, файлов/s на мелких, MB/s на крупном)]; None — способ недоступен.
+
+    target на другом диске показывает реальный перенос между дисками; без него копирование
+    замеряется внутри одного диска, а rename — быстрый путь для одного диска.
+    """
+    source_root = Path(tempfile.mkdtemp(prefix="x4_bench_src_", dir=str(directory)))
+    target_root = Path(tempfile.mkdtemp(prefix="x4_bench_dst_", dir=str(target or directory)))
+    same_device = os.stat(source_root).st_dev == os.stat(target_root).st_dev
+    cases = [("shutil.move (старый)", lambda src, dst: shutil.move(src, dst))]
+    if same_device: cases.append(("rename", os.rename))
+    cases += [(name, _bench_copy_move(name)) for name in COPY_STRATEGIES]
+    cases.append(("копия с хэшем", _bench_copy_move(None, hashed=True)))
+    small_payload = os.urandom(small_kb * 1024)
+    results = []
+    try:
+        for index, (name, move) in enumerate(cases):
+            case_src = source_root / str(index)
+            case_dst = target_root / str(index)
+            case_src.mkdir(); case_dst.mkdir()
+            small = [case_src / f"s{i}.bin" for i in range(small_count)]
+            for path in small: path.write_bytes(small_payload)
+            large = case_src / "large.bin"
+            with open(large, "wb") as f:
+                for _ in range(large_mb): f.write(os.urandom(1024 * 1024))
+            try:
+                started = time.perf_counter()
+                for path in small: move(str(path), str(case_dst / path.name))
+                small_rate = small_count / (time.perf_counter() - started)
+                started = time.perf_counter()
+                move(str(large), str(case_dst / large.name))
+                elapsed = time.perf_counter() - started
+                large_rate = large_mb / elapsed if elapsed else 0.0
+            except (OSError, AttributeError):
+                small_rate = large_rate = None
+            results.append((name, small_rate, large_rate))
+            shutil.rmtree(case_src, ignore_errors=True)
+            shutil.rmtree(case_dst, ignore_errors=True)
+    finally:
+        shutil.rmtree(source_root, ignore_errors=True)
+        shutil.rmtree(target_root, ignore_errors=True)
+    return results, same_device
+
+
 # --- СИСТЕМНЫЙ ТРЕЙ И ВЕБ-ДАШБОРД (Глобальные инстансы) ---
 core_sorter_instance = None
 observer_instance = None
@@ -730,17 +3360,37 @@ def setup_background_tasks():
     # Инициализация Watchdog Observer
     if not observer_instance:
         observer_instance = Observer()
-        observer_instance.schedule(core_sorter_instance, str(core_sorter_instance.src.resolve()), recursive=False)
+        schedule_observer(observer_instance, core_sorter_instance)
         
     # Запуск Observer, если он не запущен
     if not observer_instance.is_alive():
         observer_instance.start()
         send_telegram_message("Система X4 Sorter запущена в фоновом режиме.")
 
+tray_icon = None
+
+def schedule_observer(observer, sorter):
+    # Один наблюдатель на все источники; перепланирование нужно при смене
+    # рекурсивного режима или списка источников без перезапуска
+    observer.unschedule_all()
+    for item in sorter.all_sorters():
+        observer.schedule(item, str(item.src), recursive=bool(item.config['features'].get('recursive_watch')))
+
 def start_tray(icon):
     setup_background_tasks()
     icon.visible = True
 
+def refresh_tray_status():
+    """Обновляет подсказку и меню трея (прогресс сканирования)."""
+    if not tray_icon or not core_sorter_instance: return
+    try:
+        if core_sorter_instance.scan_progress.state == "running":
+            tray_icon.title = f"X4 Sorter — скан: {core_sorter_instance.scan_progress.summary()}"
+        else:
+            tray_icon.title = 'X4 Sorter'
+        tray_icon.update_menu()
+    except Exception: pass
+
 def on_pause_resume(icon, item):
     global core_sorter_instance
     if core_sorter_instance:
@@ -760,7 +3410,9 @@ def on_open_dashboard(icon, item):
 def on_exit(icon, item):
     global observer_instance, core_sorter_instance
     if observer_instance and observer_instance.is_alive(): observer_instance.stop()
-    if core_sorter_instance and core_sorter_instance.executor: core_sorter_instance.executor.shutdown()
+    if core_sorter_instance: core_sorter_instance.shutdown()
+    index_warmup.stop()
+    stats_store.flush()
     try: send_telegram_message("Система X4 Sorter остановлена.")
     except: pass
     icon.stop()
@@ -775,27 +3427,60 @@ def create_tray_menu():
     
     # Используем lambda для защиты от ошибок, если core_sorter_instance еще не инициализирован
     force_scan_action = lambda icon, item: core_sorter_instance.force_scan() if core_sorter_instance else None
+    scanning = lambda item: bool(core_sorter_instance) and core_sorter_instance.scan_progress.state == "running"
 
     return TrayMenu(
         TrayMenuItem(status_text, on_pause_resume),
         TrayMenuItem('🖥️ Веб-Дашборд', on_open_dashboard),
-        TrayMenuItem('🚀 Принудительное сканирование', force_scan_action),
+        TrayMenuItem('🚀 Принудительное сканирование', force_scan_action, enabled=lambda item: not scanning(item)),
+        TrayMenuItem(lambda item: f"⏳ {core_sorter_instance.scan_progress.summary()}" if scanning(item) else "", None, enabled=False, visible=scanning),
         TrayMenu.SEPARATOR,
         TrayMenuItem('❌ Выход', on_exit)
     )
 
 def run_tray():
+    load_tray_modules()
     # Создаем простую серую иконку
     image = Image.new('RGB', (64, 64), color = '#202020')
     # Добавляем в инстанс icon ссылку на функцию создания меню (для динамического обновления)
+    global tray_icon
     icon = TrayIcon('X4 Sorter', image, 'X4 Sorter', create_tray_menu())
+    tray_icon = icon
     # Запускаем трей в цикле
     icon.run(setup=start_tray)
 
 # --- FLASK WEB DASHBOARD ---
-app = Flask(__name__)
-# ВАЖНО: Устанавливаем секретный ключ для flash сообщений
-app.config['SECRET_KEY'] = 'super_secret_key_for_X4_sorter' 
+class LazyWebApp:
+    """Маршруты дашборда регистрируются сразу, а Flask импортируется и приложение
+    строится только при первом обращении (запуск сервера, тестовый клиент)."""
+    def __init__(self):
+        self._routes = []
+        self._app = None
+        self._lock = threading.Lock()
+
+    def route(self, rule, **options):
+        def decorator(func):
+            self._routes.append((rule, func, options))
+            return func
+        return decorator
+
+    def build(self):
+        with self._lock:
+            if self._app is None:
+                load_web_modules()
+                flask_app = Flask(__name__)
+                # ВАЖНО: Устанавливаем секретный ключ для flash сообщений
+                flask_app.config['SECRET_KEY'] = 'super_secret_key_for_X4_sorter' 
+                for rule, func, options in self._routes:
+                    flask_app.add_url_rule(rule, func.__name__, func, **options)
+                self._app = flask_app
+            return self._app
+
+    def __getattr__(self, name):
+        # run(), response_class, test_client() и т.п. — у настоящего приложения Flask
+        return getattr(self.build(), name)
+
+app = LazyWebApp()
 
 # HTML_TEMPLATE - Полностью переписан для динамического дизайна
 def generate_dynamic_css(theme_name):
@@ -1030,6 +3715,8 @@ HTML_TEMPLATE = """
         <a href="{{ url_for('pause') }}" class="action-button secondary">⏸️ Пауза</a>
     {% endif %}
     <a href="{{ url_for('settings') }}" class="action-button secondary">⚙️ Настройки</a>
+    <a href="{{ url_for('duplicates_report') }}" class="action-button secondary">🔍 Отчет о дубликатах</a>
+    <a href="{{ url_for('start_index_warmup') }}" class="action-button secondary">🗂️ Индексировать назначение</a>
     <a href="{{ url_for('clear_log') }}" class="action-button delete" onclick="return confirm('Вы уверены? Журнал будет очищен.');">🗑️ Очистить журнал</a>
 
     <h2>Телеметрия Системы</h2>
@@ -1060,6 +3747,105 @@ HTML_TEMPLATE = """
         </div>
     </div>
 
+    <h2>Очередь обработки</h2>
+    <div class="stats-grid">
+        <div class="stats-card">
+            <p>В очереди / Лимит</p>
+            <strong>{{ queue['depth'] }} / {{ queue['maxsize'] }}</strong>
+        </div>
+        <div class="stats-card">
+            <p>Потоки: заняты / всего</p>
+            <strong>{{ queue['active'] }} / {{ queue['workers'] }}</strong>
+        </div>
+        <div class="stats-card">
+            <p>Ожидание в очереди: среднее / максимум</p>
+            <strong>{{ '%.2f'|format(queue['avg_wait']) }} / {{ '%.2f'|format(queue['max_wait']) }} сек.</strong>
+        </div>
+        <div class="stats-card">
+            <p>Обработано задач</p>
+            <strong>{{ queue['processed'] }}</strong>
+        </div>
+        <div class="stats-card">
+            <p>Отброшено повторных постановок</p>
+            <strong>{{ claims['dropped'] }}</strong>
+        </div>
+        <div class="stats-card">
+            <p>Кэш папок: сэкономлено вызовов / mkdir</p>
+            <strong>{{ dirs['saved_syscalls'] }} / {{ dirs['mkdir_calls'] }}</strong>
+        </div>
+    </div>
+
+    {% if sources|length > 1 %}
+    <table>
+        <thead>
+            <tr><th>Источник</th><th>Назначение</th><th>В очереди</th></tr>
+        </thead>
+        <tbody>
+        {% for src, dest in sources %}
+            <tr><td>{{ src }}</td><td>{{ dest }}</td><td>{{ queue['by_source'].get(src, 0) }}</td></tr>
+        {% endfor %}
+        </tbody>
+    </table>
+    {% endif %}
+
+    {% if scan['state'] != 'idle' %}
+    <div class="stats-grid">
+        <div class="stats-card">
+            <p>Принудительное сканирование ({{ scan['state'] }})</p>
+            <strong>{{ scan['files_done'] }} / {{ scan['files_found'] }}{% if scan['enumerating'] %}+{% endif %} файлов</strong>
+            <p>{{ '%.1f'|format(scan['files_rate']) }} файлов/s, {{ format_bytes(scan['bytes_rate']) }}/s, осталось {{ scan['files_remaining'] }}{% if scan['eta_sec'] is not none %} (~{{ scan['eta_sec'] }} сек.){% endif %}{% if scan['files_skipped'] %}, пропущено {{ scan['files_skipped'] }}{% endif %}</p>
+        </div>
+    </div>
+    {% endif %}
+
+    {% if archives['active'] or archives['archives'] or archives['rejected'] or archives['failed'] %}
+    <div class="stats-grid">
+        {% for item in archives['active'] %}
+        <div class="stats-card">
+            <p>Распаковка: {{ item['name'] }}</p>
+            <strong>{{ item['members_done'] }}{% if item['members_total'] is not none %} / {{ item['members_total'] }}{% endif %} файлов</strong>
+            <p>{{ format_bytes(item['bytes_done']) }}{% if item['bytes_total'] %} из {{ format_bytes(item['bytes_total']) }}{% endif %}, {{ format_bytes(item['bytes_rate']) }}/s</p>
+        </div>
+        {% endfor %}
+        <div class="stats-card">
+            <p>Распаковано архивов / отклонено / ошибок</p>
+            <strong>{{ archives['archives'] }} / {{ archives['rejected'] }} / {{ archives['failed'] }}</strong>
+            <p>{{ archives['members'] }} файлов, {{ format_bytes(archives['bytes']) }}, {{ format_bytes(archives['bytes_rate']) }}/s</p>
+        </div>
+    </div>
+    {% endif %}
+
+    <h2>Дедупликация</h2>
+    <div class="stats-grid">
+        <div class="stats-card">
+            <p>Проверено / Найдено дубликатов</p>
+            <strong>{{ dedup['checked'] }} / {{ dedup['duplicates'] }}</strong>
+        </div>
+        <div class="stats-card">
+            <p>Не прочитано: фильтр по размеру</p>
+            <strong>{{ format_bytes(dedup['size_skipped_bytes']) }}</strong>
+        </div>
+        <div class="stats-card">
+            <p>Не прочитано: частичный хэш</p>
+            <strong>{{ format_bytes(dedup['partial_skipped_bytes']) }}</strong>
+        </div>
+        <div class="stats-card">
+            <p>Прочитано: частичный / полный хэш</p>
+            <strong>{{ format_bytes(dedup['partial_read_bytes']) }} / {{ format_bytes(dedup['full_read_bytes']) }}</strong>
+        </div>
+        <div class="stats-card">
+            <p>Индексация назначения ({{ warmup['state'] }})</p>
+            <strong>{{ warmup['files_done'] }} / {{ warmup['files_total'] }} файлов</strong>
+            <p>{{ format_bytes(warmup['bytes_done']) }} из {{ format_bytes(warmup['bytes_total']) }}, {{ format_bytes(warmup['rate']) }}/s{% if warmup['eta_sec'] is not none %}, осталось ~{{ warmup['eta_sec'] }} сек.{% endif %}</p>
+        </div>
+        {% if dup_report %}
+        <div class="stats-card">
+            <p>Последний отчет ({{ dup_report['created'] }})</p>
+            <strong><a href="{{ url_for('duplicates_report_view') }}" style="color: inherit;">{{ dup_report['duplicate_files'] }} файлов / {{ format_bytes(dup_report['wasted_bytes']) }}</a></strong>
+        </div>
+        {% endif %}
+    </div>
+
     <h2>Телеметрия по типам файлов</h2>
     {% if sorted_counts %}
         <table>
@@ -1130,6 +3916,50 @@ HTML_SETTINGS_TEMPLATE = """
             <label for="retention_days">Дни хранения (Карантин/Дубликаты, 0 = не удалять)</label>
             <input type="number" id="retention_days" name="retention_days" value="{{ config['features'].get('retention_days', 30) }}" min="0" required>
         </div>
+        <div class="form-group">
+            <label for="recursive_max_depth">Глубина рекурсивного наблюдения (уровней подпапок)</label>
+            <input type="number" id="recursive_max_depth" name="recursive_max_depth" value="{{ config['features'].get('recursive_max_depth', 5) }}" min="1" max="64" required>
+        </div>
+        <div class="form-group">
+            <label for="worker_threads">Потоков обработки файлов</label>
+            <input type="number" id="worker_threads" name="worker_threads" value="{{ config['features'].get('worker_threads', 5) }}" min="1" max="64" required>
+            <label for="queue_max" style="margin-top: 15px;">Предел очереди задач (при заполнении сканирование ждет)</label>
+            <input type="number" id="queue_max" name="queue_max" value="{{ config['features'].get('queue_max', 1000) }}" min="10" required>
+        </div>
+        <div class="form-group">
+            <label for="unpack_max_total_mb">Распаковка: не больше MB на архив (0 = без ограничения)</label>
+            <input type="number" id="unpack_max_total_mb" name="unpack_max_total_mb" value="{{ config['features'].get('unpack_max_total_mb', 4096) }}" min="0" required>
+            <label for="unpack_max_ratio" style="margin-top: 15px;">Предельная степень сжатия (N:1, 0 = без проверки)</label>
+            <input type="number" id="unpack_max_ratio" name="unpack_max_ratio" value="{{ config['features'].get('unpack_max_ratio', 200) }}" min="0" required>
+            <label for="unpack_max_members" style="margin-top: 15px;">Предельное число файлов в архиве (0 = без ограничения)</label>
+            <input type="number" id="unpack_max_members" name="unpack_max_members" value="{{ config['features'].get('unpack_max_members', 20000) }}" min="0" required>
+            <label for="unpack_workers" style="margin-top: 15px;">Потоков распаковки большого ZIP</label>
+            <input type="number" id="unpack_workers" name="unpack_workers" value="{{ config['features'].get('unpack_workers', 4) }}" min="1" max="64" required>
+        </div>
+        <div class="form-group">
+            <label for="dedup_mode">Режим детекции дубликатов</label>
+            <select id="dedup_mode" name="dedup_mode">
+                <option value="tiered" {% if config['features'].get('dedup_mode', 'tiered') == 'tiered' %}selected{% endif %}>Ступенчатый (размер → частичный хэш → SHA256)</option>
+                <option value="full" {% if config['features'].get('dedup_mode') == 'full' %}selected{% endif %}>Полный SHA256</option>
+            </select>
+            <label for="dedup_scope" style="margin-top: 15px;">Область поиска дубликатов</label>
+            <select id="dedup_scope" name="dedup_scope">
+                <option value="folder" {% if config['features'].get('dedup_scope', 'folder') == 'folder' %}selected{% endif %}>Целевая папка (категория/дата)</option>
+                <option value="global" {% if config['features'].get('dedup_scope') == 'global' %}selected{% endif %}>Вся папка назначения (кроме Карантина)</option>
+            </select>
+            <label for="hash_algorithm" style="margin-top: 15px;">Алгоритм хэширования</label>
+            <select id="hash_algorithm" name="hash_algorithm">
+                {% for name in hash_algorithms %}
+                    <option value="{{ name }}" {% if config['features'].get('hash_algorithm', 'sha256') == name %}selected{% endif %}>{{ name }}</option>
+                {% endfor %}
+            </select>
+            <label for="fsync_policy" style="margin-top: 15px;">Сброс на диск (fsync) при переносе</label>
+            <select id="fsync_policy" name="fsync_policy">
+                <option value="none" {% if config['features'].get('fsync_policy', 'file') == 'none' %}selected{% endif %}>Не выполнять (быстрее)</option>
+                <option value="file" {% if config['features'].get('fsync_policy', 'file') == 'file' %}selected{% endif %}>Для копий между дисками</option>
+                <option value="full" {% if config['features'].get('fsync_policy', 'file') == 'full' %}selected{% endif %}>Копии и записи папок (надежнее)</option>
+            </select>
+        </div>
 
         <h2>Настройки Telegram</h2>
         <div class="form-group">
@@ -1207,7 +4037,15 @@ def index():
     # Обновляем конфиг перед отображением
     cfg.load()
     
-    file_counts = cfg.data['stats']['file_type_counts']
+    dup_report = None
+    report_path = Path(__file__).resolve().parent / DUPLICATES_REPORT_FILE
+    if report_path.exists():
+        try:
+            with open(report_path, 'r', encoding='utf-8') as f: dup_report = json.load(f)
+        except Exception: pass
+    
+    stats = stats_store.snapshot()
+    file_counts = stats['file_type_counts']
     sorted_counts = sorted(file_counts.items(), key=lambda item: item[1], reverse=True)
     
     return render_template_string(HTML_TEMPLATE,
@@ -1218,11 +4056,21 @@ def index():
         is_paused=core_sorter_instance._is_paused if core_sorter_instance else True,
         WEB_PORT=WEB_PORT,
         first_run_date=cfg.data.get('first_run_date', 'N/A'),
-        stats=cfg.data['stats'],
+        stats=stats,
         source_folder=cfg.data['source_folder'],
         dest_folder=cfg.data['base_destination'],
         retention_days=cfg.data.get('features', {}).get('retention_days', 30),
         sorted_counts=sorted_counts,
+        dedup=dedup_stats.snapshot(),
+        dup_report=dup_report,
+        warmup=index_warmup.progress(),
+        queue=core_sorter_instance.work_queue.stats(),
+        claims=inflight_claims.stats(),
+        dirs=known_dirs.stats(),
+        scan=core_sorter_instance.scan_progress.progress(),
+        archives=archive_progress.progress(),
+        sources=[(str(sorter.src), str(sorter.dest)) for sorter in core_sorter_instance.all_sorters()],
+        format_bytes=format_bytes,
         logs="".join(logs)
     )
 
@@ -1237,8 +4085,12 @@ def settings():
     features_map = {
         "sort_by_date": "Сортировка по дате (EXIF/Создание)",
         "sort_by_metadata": "Сортировка по метаданным (ID3/MP3)",
-        "auto_unpack": "Авто-распаковка ZIP/7z/RAR",
+        "auto_unpack": "Авто-распаковка ZIP/TAR/GZ/BZ2/XZ",
         "deduplication": "Детекция дубликатов (SHA256)",
+        "verify_copy": "Проверять копию при переносе между дисками",
+        "recursive_watch": "Следить за подпапками источника (рекурсивно)",
+        "preserve_subfolders": "Сохранять подпапки источника внутри категории",
+        "unpack_resort": "Сортировать распакованные файлы",
         "quarantine_mode": "Режим Карантина (Проверка на ЧС)",
         "deep_clean": "Удалять пустые папки (Cleanup)",
         "sound_enabled": "Звуковые уведомления (Windows)",
@@ -1247,29 +4099,48 @@ def settings():
     
     if request.method == 'POST':
         try:
+            # Все поля формы собираются и сохраняются одной записью: подписчики
+            # получают один снимок, а не по событию на каждое поле
+            changes = []
             # 1. Общие настройки
-            cfg.update_val(None, 'source_folder', request.form['source_folder'])
-            cfg.update_val(None, 'base_destination', request.form['base_destination'])
-            cfg.update_val(None, 'theme', request.form['theme'])
+            changes.append((None, 'source_folder', request.form['source_folder']))
+            changes.append((None, 'base_destination', request.form['base_destination']))
+            changes.append((None, 'theme', request.form['theme']))
 
             # 2. Настройки функций (Чекбоксы)
             for key in features_map.keys():
                 is_checked = key in request.form
-                cfg.update_val('features', key, is_checked)
+                changes.append(('features', key, is_checked))
                 
             # 3. Дни хранения
             retention = int(request.form['retention_days'])
-            cfg.update_val('features', 'retention_days', retention)
+            changes.append(('features', 'retention_days', retention))
+            changes.append(('features', 'recursive_max_depth', max(1, int(request.form.get('recursive_max_depth', 5)))))
+            changes.append(('features', 'worker_threads', max(1, int(request.form.get('worker_threads', 5)))))
+            changes.append(('features', 'queue_max', max(10, int(request.form.get('queue_max', 1000)))))
+            changes.append(('features', 'unpack_max_total_mb', max(0, int(request.form.get('unpack_max_total_mb', 4096)))))
+            changes.append(('features', 'unpack_max_ratio', max(0, int(request.form.get('unpack_max_ratio', 200)))))
+            changes.append(('features', 'unpack_max_members', max(0, int(request.form.get('unpack_max_members', 20000)))))
+            changes.append(('features', 'unpack_workers', max(1, int(request.form.get('unpack_workers', 4)))))
+            if request.form.get('dedup_mode') in ('tiered', 'full'):
+                changes.append(('features', 'dedup_mode', request.form['dedup_mode']))
+            if request.form.get('dedup_scope') in ('folder', 'global'):
+                changes.append(('features', 'dedup_scope', request.form['dedup_scope']))
+            if request.form.get('hash_algorithm') in HASH_ALGORITHMS:
+                changes.append(('features', 'hash_algorithm', request.form['hash_algorithm']))
+            if request.form.get('fsync_policy') in FSYNC_POLICIES:
+                changes.append(('features', 'fsync_policy', request.form['fsync_policy']))
 
             # 4. Настройки Telegram (Безопасный доступ)
-            cfg.update_val('telegram', 'enabled', 'telegram_enabled' in request.form)
-            cfg.update_val('telegram', 'token', request.form.get('telegram_token', ''))
-            cfg.update_val('telegram', 'chat_id', request.form.get('telegram_chat_id', ''))
-            cfg.update_val('telegram', 'upload_enabled', 'upload_enabled' in request.form)
-            cfg.update_val('telegram', 'upload_max_size_mb', int(request.form.get('upload_max_size_mb', 45)))
-            cfg.update_val('telegram', 'notify_success', 'notify_success' in request.form)
-            cfg.update_val('telegram', 'notify_duplicate', 'notify_duplicate' in request.form)
-            cfg.update_val('telegram', 'notify_quarantine', 'notify_quarantine' in request.form)
+            changes.append(('telegram', 'enabled', 'telegram_enabled' in request.form))
+            changes.append(('telegram', 'token', request.form.get('telegram_token', '')))
+            changes.append(('telegram', 'chat_id', request.form.get('telegram_chat_id', '')))
+            changes.append(('telegram', 'upload_enabled', 'upload_enabled' in request.form))
+            changes.append(('telegram', 'upload_max_size_mb', int(request.form.get('upload_max_size_mb', 45))))
+            changes.append(('telegram', 'notify_success', 'notify_success' in request.form))
+            changes.append(('telegram', 'notify_duplicate', 'notify_duplicate' in request.form))
+            changes.append(('telegram', 'notify_quarantine', 'notify_quarantine' in request.form))
+            cfg.update_vals(changes)
 
             # Перезагружаем настройки в активный инстанс
             core_sorter_instance.reload_settings()
@@ -1286,6 +4157,7 @@ def settings():
         dynamic_css=generate_dynamic_css(cfg.data.get('theme', 'Cyberpunk')),
         config=cfg.data,
         themes=THEMES.keys(),
+        hash_algorithms=HASH_ALGORITHMS,
         features_map=features_map
     )
 
@@ -1310,6 +4182,31 @@ def clear_log():
     return redirect(url_for('index'))
 
 
+@app.route('/duplicates_report')
+def duplicates_report():
+    if core_sorter_instance:
+        core_sorter_instance.duplicates_report()
+        flash('🔍 Поиск дубликатов в папке назначения запущен. Результат появится в журнале.')
+    return redirect(url_for('index'))
+
+@app.route('/index_warmup')
+def start_index_warmup():
+    if core_sorter_instance:
+        if core_sorter_instance.start_index_warmup(force=True):
+            flash('🗂️ Фоновая индексация папки назначения запущена.')
+        else:
+            flash('⚠️ Индексация уже выполняется.')
+    return redirect(url_for('index'))
+
+@app.route('/duplicates_report/view')
+def duplicates_report_view():
+    report_path = Path(__file__).resolve().parent / DUPLICATES_REPORT_FILE
+    if not report_path.exists():
+        flash('⚠️ Отчет о дубликатах еще не создан.')
+        return redirect(url_for('index'))
+    with open(report_path, 'r', encoding='utf-8') as f:
+        return app.response_class(f.read(), mimetype='application/json')
+
 @app.route('/pause')
 def pause():
     if core_sorter_instance: core_sorter_instance.pause()
@@ -1350,6 +4247,7 @@ def run_web_dashboard():
 class Interface:
     
     def __init__(self):
+        load_tui_modules()
         self.console = Console()
         self.clear()
         
@@ -1375,7 +4273,7 @@ class Interface:
             
             # Обновляем конфиг для актуальной статистики
             cfg.load()
-            stats = cfg.data['stats']
+            stats = stats_store.snapshot()
             
             self.console.print(f"\n[cyan]📊 СТАТИСТИКА:[/]")
             self.console.print(f"   Дата первой регистрации: [bold]{cfg.data.get('first_run_date', 'N/A')}[/]")
@@ -1405,7 +4303,7 @@ class Interface:
                     if Prompt.ask("", choices=['y', 'n'], default='n') == 'y':
                         # Останавливаем все потоки перед выходом
                         if observer_instance: observer_instance.stop()
-                        if core_sorter_instance and core_sorter_instance.executor: core_sorter_instance.executor.shutdown()
+                        if core_sorter_instance: core_sorter_instance.shutdown()
                         sys.exit()
                 else:
                     sys.exit()
@@ -1489,7 +4387,7 @@ class Interface:
 
             table.add_row("1", "Сортировка по дате (EXIF/Создание)", status('sort_by_date'))
             table.add_row("2", "Сортировка по метаданным (ID3/MP3)", status('sort_by_metadata'))
-            table.add_row("3", "Авто-распаковка ZIP/7z/RAR", status('auto_unpack'))
+            table.add_row("3", "Авто-распаковка ZIP/TAR/GZ/BZ2/XZ", status('auto_unpack'))
             table.add_row("4", "Детекция дубликатов (SHA256)", status('deduplication'))
             table.add_row("5", "Режим Карантина (Проверка на ЧС)", status('quarantine_mode'))
             table.add_row("6", "Удалять пустые папки (Cleanup)", status('deep_clean'))
@@ -1559,7 +4457,7 @@ class Interface:
             live_updater = lambda: live.refresh() if 'live' in locals() else None
             core_sorter_instance = CoreSorter(ui_callback=live_updater)
             observer_instance = Observer()
-            observer_instance.schedule(core_sorter_instance, str(core_sorter_instance.src.resolve()), recursive=False)
+            schedule_observer(observer_instance, core_sorter_instance)
             observer_instance.start()
         else:
              # Если уже запущены, обновляем колбэк для Live объекта
@@ -1600,7 +4498,7 @@ class Interface:
                         log_text.append(clean_line + "\n")
 
                     telemetry_table = Table(box=None, show_header=False)
-                    telemetry_data = cfg.data['stats']['file_type_counts']
+                    telemetry_data = stats_store.snapshot()['file_type_counts']
                     for name, count in sorted(telemetry_data.items(), key=lambda item: item[1], reverse=True)[:5]:
                          # Безопасное отображение имени категории
                          clean_name = name.split('_', 1)[1] if '_' in name else name 
@@ -1629,7 +4527,7 @@ class Interface:
             try:
                 # Временно отключаем Live для ввода
                 live.stop() 
-                command = console.input("\nНажмите 'F' для сканирования или Enter для выхода в меню: ").upper()
+                command = self.console.input("\nНажмите 'F' для сканирования или Enter для выхода в меню: ").upper()
                 if command == 'F':
                     core_sorter_instance.force_scan()
                     # Возвращаемся в дашборд после сканирования
@@ -1671,9 +4569,251 @@ class Interface:
         Prompt.ask("\nНажмите Enter для возврата...")
 
 
+# --- КОМАНДНАЯ СТРОКА ---
+def cmd_bench_hash(args):
+    directory = Path(args.dir or cfg.data['base_destination']).resolve()
+    print(f"{APP_NAME}: бенчмарк хэширования, файл {args.size_mb} MB в {directory}")
+    current = get_hash_algorithm()
+    for name, speed in benchmark_hashing(directory, args.size_mb, args.algorithms):
+        mark = " (текущий)" if name == current else ""
+        print(f"  {name:<24} {speed:10.1f} MB/s{mark}")
+    return 0
+
+def write_plan(entries, path, header=None):
+    """Сохраняет план: .csv — таблица записей, иначе JSON с заголовком (папки, время создания)."""
+    path = Path(path)
+    if path.suffix.lower() == ".csv":
+        with open(path, "w", encoding="utf-8-sig", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=PLAN_FIELDS, extrasaction="ignore")
+            writer.writeheader()
+            writer.writerows(entries)
+    else:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({**(header or {}), "entries": entries}, f, ensure_ascii=False, indent=1)
+
+def read_plan(path):
+    """Возвращает (заголовок, записи) плана из JSON или CSV."""
+    path = Path(path)
+    if path.suffix.lower() == ".csv":
+        with open(path, "r", encoding="utf-8-sig", newline="") as f:
+            return {}, list(csv.DictReader(f))
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    return {k: v for k, v in data.items() if k != "entries"}, data.get("entries", [])
+
+def _cli_sorter(src, dest, jobs=None, recursive=False, notify=False, dry_run=False):
+    # Отдельный сортировщик для командной строки. deep_clean выключен: вместо обхода
+    # всей папки назначения после каждого файла — один проход в конце (_cli_cleanup)
+    features = {"index_warmup": False, "sound_enabled": False, "notifications": False, "deep_clean": False}
+    if jobs: features["worker_threads"] = jobs
+    if recursive: features["recursive_watch"] = True
+    return CoreSorter(source={"source_folder": str(src), "base_destination": str(dest), "features": features},
+                      quiet=not notify, dry_run=dry_run)
+
+def _cli_cleanup(sorter):
+    # Один проход очистки пустых папок после сортировки, если он включен в настройках
+    if cfg.data['features'].get('deep_clean'): sorter._worker_cleanup(force=True)
+
+def cmd_plan(args):
+    src = Path(args.src).resolve()
+    if not src.is_dir():
+        print(f"Папка источника не найдена: {src}")
+        return 2
+    dest = Path(args.dest or cfg.data['base_destination']).resolve()
+    sorter = _cli_sorter(src, dest, args.jobs, args.recursive, dry_run=True)
+    started = time.perf_counter()
+    try:
+        entries = sorter.build_plan(args.jobs)
+    finally:
+        sorter.shutdown()
+    elapsed = time.perf_counter() - started
+    header = {"created": datetime.now().strftime("%Y-%m-%d %H:%M:%S"), "source_folder": str(src), "base_destination": str(dest)}
+    write_plan(entries, args.out, header)
+    counts = {}
+    for entry in entries: counts[entry["action"]] = counts.get(entry["action"], 0) + 1
+    print(f"{APP_NAME}: план для {len(entries)} файлов за {elapsed:.2f} сек. ({len(entries) / elapsed if elapsed else 0:.1f} файлов/s) -> {args.out}")
+    for action, count in sorted(counts.items()): print(f"  {action:<12} {count}")
+    return 0
+
+def cmd_apply_plan(args):
+    try:
+        header, entries = read_plan(args.plan)
+    except (OSError, ValueError) as e:
+        print(f"Не удалось прочитать план: {e}")
+        return 2
+    src = Path(args.src or header.get("source_folder") or cfg.data['source_folder']).resolve()
+    dest = Path(args.dest or header.get("base_destination") or cfg.data['base_destination']).resolve()
+    sorter = _cli_sorter(src, dest, args.jobs, notify=args.notify)
+    pipeline_stats.reset()
+    started = time.perf_counter()
+    try:
+        results = sorter.apply_plan(entries, args.jobs)
+        _cli_cleanup(sorter)
+    finally:
+        sorter.shutdown()
+        stats_store.flush()
+    elapsed = time.perf_counter() - started
+    summary = pipeline_stats.snapshot()
+    print(f"{APP_NAME}: выполнено {len(entries)} записей плана за {elapsed:.2f} сек., "
+          f"{summary['files'] / elapsed if elapsed else 0:.1f} файлов/s, {summary['bytes'] / elapsed / (1024 * 1024) if elapsed else 0:.1f} MB/s")
+    for status, count in sorted(results.items()): print(f"  {status:<12} {count}")
+    return 1 if results.get("error") else 0
+
+def cmd_bench_move(args):
+    # Не source_folder: временные файлы в наблюдаемой папке подхватил бы работающий сортировщик
+    directory = Path(args.dir or tempfile.gettempdir()).resolve()
+    target = Path(args.target).resolve() if args.target else None
+    print(f"{APP_NAME}: бенчмарк переноса, {args.small_count} x {args.small_kb} KB и {args.large_mb} MB: {directory} -> {target or directory}")
+    results, same_device = benchmark_moves(directory, target, args.small_count, args.small_kb, args.large_mb)
+    print(f"  ({'один диск' if same_device else 'разные диски'})")
+    for name, small_rate, large_rate in results:
+        if small_rate is None:
+            print(f"  {name:<22} недоступно")
+        else:
+            print(f"  {name:<22} {small_rate:10.1f} файлов/s {large_rate:10.1f} MB/s")
+    return 0
+
+def benchmark_startup(runs=5):
+    """Время холодного старта в отдельных процессах: интерпретатор, импорт main и загрузка подсистем (сек., медиана)."""
+    script_dir = str(Path(__file__).resolve().parent)
+    probe = (
+        "import sys, time, json; t = time.perf_counter(); sys.path.insert(0, {dir!r}); import main; "
+        "r = {{'import main': time.perf_counter() - t}}\n"
+        "for name in ('load_web_modules', 'load_tui_modules', 'load_tray_modules'):\n"
+        "    t = time.perf_counter()\n"
+        "    try: getattr(main, name)()\n"
+        "    except BaseException: r[name] = None; continue\n"
+        "    r[name] = time.perf_counter() - t\n"
+        "print(json.dumps(r))"
+    ).format(dir=script_dir)
+    samples = {}
+    for _ in range(runs):
+        started = time.perf_counter()
+        subprocess.run([sys.executable, "-c", "pass"], check=True)
+        samples.setdefault("python", []).append(time.perf_counter() - started)
+        started = time.perf_counter()
+        subprocess.run([sys.executable, str(Path(__file__).resolve()), "sort", "--help"], check=True, stdout=subprocess.DEVNULL)
+        samples.setdefault("main.py sort --help", []).append(time.perf_counter() - started)
+        out = subprocess.run([sys.executable, "-c", probe], check=True, capture_output=True, text=True, cwd=script_dir).stdout
+        for name, value in json.loads(out.strip().splitlines()[-1]).items():
+            samples.setdefault(name, []).append(value)
+    return [(name, None if None in values else sorted(values)[len(values) // 2]) for name, values in samples.items()]
+
+def cmd_bench_startup(args):
+    print(f"{APP_NAME}: время старта (медиана из {args.runs} запусков)")
+    for name, seconds in benchmark_startup(args.runs):
+        value = "нет модуля" if seconds is None else f"{seconds * 1000:8.1f} мс"
+        print(f"  {name:<22} {value}")
+    return 0
+
+def cmd_sort(args):
+    src = Path(args.src).resolve()
+    if not src.is_dir():
+        print(f"Папка источника не найдена: {src}")
+        return 2
+    dest = Path(args.dest or cfg.data['base_destination']).resolve()
+    sorter = _cli_sorter(src, dest, args.jobs, args.recursive, args.notify)
+    pipeline_stats.reset()
+    print(f"{APP_NAME}: сортировка {src} -> {dest}, потоков: {sorter.config['features'].get('worker_threads', 5)}")
+    started = time.perf_counter()
+    try:
+        sorter._worker_force_scan()
+        if not args.once:
+            # Режим наблюдения без интерфейса: до Ctrl+C
+            observer = Observer()
+            observer.schedule(sorter, str(sorter.src), recursive=bool(sorter.config['features'].get('recursive_watch')))
+            observer.start()
+            print("Наблюдение за папкой, Ctrl+C для завершения...")
+            try:
+                while observer.is_alive(): time.sleep(1)
+            except KeyboardInterrupt: pass
+            observer.stop()
+            sorter.work_queue.join()
+        _cli_cleanup(sorter)
+    finally:
+        sorter.shutdown()
+        stats_store.flush()
+    elapsed = time.perf_counter() - started
+    summary = pipeline_stats.snapshot()
+    print(f"  Файлов: {summary['files']}, отсортировано: {summary['sorted']}, дубликатов: {summary['duplicates']}, "
+          f"в карантин: {summary['quarantined']}, ошибок: {summary['errors']}")
+    print(f"  Время: {elapsed:.2f} сек., {summary['files'] / elapsed if elapsed else 0:.1f} файлов/s, "
+          f"{summary['bytes'] / elapsed / (1024 * 1024) if elapsed else 0:.1f} MB/s")
+    files = summary['files'] or 1
+    for stage, seconds in summary['stage_time'].items():
+        print(f"  {stage:<10} {seconds:8.2f} сек. суммарно, {seconds / files * 1000:8.2f} мс/файл")
+    dirs = known_dirs.stats()
+    print(f"  Кэш папок: mkdir {dirs['mkdir_calls']}, сэкономлено системных вызовов: {dirs['saved_syscalls']}")
+    names = name_allocator.stats()
+    print(f"  Имена файлов: выдано {names['allocated']}, проверок на диске: {names['probes']}")
+    operation_journal.flush()
+    journal = operation_journal.stats()
+    if journal['batches']:
+        print(f"  Журнал: {journal['records']} записей за {journal['batches']} фиксаций, "
+              f"в среднем {journal['records'] / journal['batches']:.1f}, максимум {journal['max_batch']}")
+    return 1 if summary['errors'] else 0
+
+def run_cli(argv):
+    parser = argparse.ArgumentParser(prog="main.py", description=f"{APP_NAME} {VERSION}")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    bench_hash = commands.add_parser("bench-hash", help="Скорость хэширования (MB/s) по алгоритмам на локальном диске")
+    bench_hash.add_argument("--dir", help="Папка для временного файла (по умолчанию папка назначения)")
+    bench_hash.add_argument("--size-mb", type=int, default=256, help="Размер тестового файла в MB")
+    bench_hash.add_argument("--algorithms", nargs="+", choices=HASH_ALGORITHMS, help="Список алгоритмов")
+    bench_hash.set_defaults(func=cmd_bench_hash)
+
+    bench_move = commands.add_parser("bench-move", help="Скорость переноса файлов разными способами (rename, copy_file_range, sendfile, ...)")
+    bench_move.add_argument("--dir", help="Папка для временных файлов (по умолчанию системная папка временных файлов)")
+    bench_move.add_argument("--target", help="Папка назначения, лучше на другом диске (по умолчанию та же)")
+    bench_move.add_argument("--small-count", type=int, default=500, help="Число мелких файлов")
+    bench_move.add_argument("--small-kb", type=int, default=16, help="Размер мелкого файла в KB")
+    bench_move.add_argument("--large-mb", type=int, default=256, help="Размер крупного файла в MB")
+    bench_move.set_defaults(func=cmd_bench_move)
+
+    bench_startup = commands.add_parser("bench-startup", help="Время старта программы и загрузки подсистем")
+    bench_startup.add_argument("--runs", type=int, default=5, help="Число запусков")
+    bench_startup.set_defaults(func=cmd_bench_startup)
+
+    sort = commands.add_parser("sort", help="Сортировка папки без интерфейса (для планировщика и замеров)")
+    sort.add_argument("--src", required=True, help="Папка источника")
+    sort.add_argument("--dest", help="Папка назначения (по умолчанию base_destination из настроек)")
+    sort.add_argument("--jobs", type=int, help="Число потоков обработки (по умолчанию worker_threads)")
+    sort.add_argument("--once", action="store_true", help="Обработать текущее содержимое и выйти (иначе — наблюдать до Ctrl+C)")
+    sort.add_argument("--recursive", action="store_true", help="Обходить подпапки источника")
+    sort.add_argument("--notify", action="store_true", help="Отправлять уведомления Telegram/Pop-up")
+    sort.set_defaults(func=cmd_sort)
+
+    plan = commands.add_parser("plan", help="План сортировки без перемещения файлов (JSON/CSV)")
+    plan.add_argument("--src", required=True, help="Папка источника")
+    plan.add_argument("--dest", help="Папка назначения (по умолчанию base_destination из настроек)")
+    plan.add_argument("--out", default="x4_plan.json", help="Файл плана: .json или .csv")
+    plan.add_argument("--jobs", type=int, help="Число потоков планирования")
+    plan.add_argument("--recursive", action="store_true", help="Обходить подпапки источника")
+    plan.set_defaults(func=cmd_plan)
+
+    apply_plan = commands.add_parser("apply-plan", help="Выполнить просмотренный план сортировки")
+    apply_plan.add_argument("plan", help="Файл плана (.json или .csv)")
+    apply_plan.add_argument("--src", help="Папка источника (по умолчанию из плана)")
+    apply_plan.add_argument("--dest", help="Папка назначения (по умолчанию из плана)")
+    apply_plan.add_argument("--jobs", type=int, help="Число параллельных перемещений")
+    apply_plan.add_argument("--notify", action="store_true", help="Отправлять уведомления Telegram/Pop-up")
+    apply_plan.set_defaults(func=cmd_apply_plan)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
 # --- ТОЧКА ВХОДА ---
 if __name__ == "__main__":
     
+    # 0. Команды без интерфейса (бенчмарки и т.п.)
+    if len(sys.argv) > 1:
+        sys.exit(run_cli(sys.argv[1:]))
+    
+    # Интерфейсный режим: настройки сохраняются в settings_rus.json
+    cfg.enable_persistence()
+
     # 1. Инициализация CoreSorter для доступа к настройкам темы до запуска Flask
     if not core_sorter_instance:
          # Инициализация с базовым UI callback
@@ -1691,10 +4831,11 @@ if __name__ == "__main__":
     else:
         # Режим консоли
         try:
-            app = Interface()
-            app.main_menu()
+            # Не перекрываем глобальный app (дашборд) — он уже используется потоком Flask
+            ui = Interface()
+            ui.main_menu()
         except KeyboardInterrupt:
             # Остановка всех потоков при выходе из консоли
             if observer_instance: observer_instance.stop()
-            if core_sorter_instance and core_sorter_instance.executor: core_sorter_instance.executor.shutdown()
+            if core_sorter_instance: core_sorter_instance.shutdown()
             sys.exit()
\ No newline at end of file
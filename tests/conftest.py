@@ -0,0 +1,23 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+# main.py лежит в корне репозитория, пакета нет
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import main  # noqa: E402
+
+
+@pytest.fixture
+def isolated(tmp_path, monkeypatch):
+    # Индекс, статистика и журнал — во временной папке, а не рядом с main.py
+    state = tmp_path / "state"
+    state.mkdir()
+    monkeypatch.setattr(main, "hash_index", main.HashIndex(state / main.INDEX_FILE))
+    monkeypatch.setattr(main, "first_seen_store", main.FirstSeenStore(state / main.INDEX_FILE))
+    monkeypatch.setattr(main, "stats_store", main.StatsStore(state / main.STATS_FILE))
+    monkeypatch.setattr(main, "operation_journal", main.OperationJournal(state))
+    src, dest = tmp_path / "src", tmp_path / "dest"
+    src.mkdir()
+    return src, dest
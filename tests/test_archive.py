@@ -0,0 +1,128 @@
+import gzip
+import io
+import os
+import tarfile
+import zipfile
+
+import pytest
+
+import main
+from main import ArchiveLimitError, ExtractBudget, extract_archive
+
+MB = 1024 * 1024
+
+
+def make_zip(path, members):
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zf:
+        for name, data in members.items(): zf.writestr(name, data)
+    return path
+
+
+def make_tar(path, members):
+    with tarfile.open(path, "w:gz") as tf:
+        for name, data in members.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tf.addfile(info, io.BytesIO(data))
+    return path
+
+
+def listing(root):
+    return sorted(p.relative_to(root).as_posix() for p in root.rglob("*") if p.is_file())
+
+
+def test_budget_counts_members():
+    budget = ExtractBudget(100, 0, 0, max_members=2)
+    budget.member(); budget.member()
+    with pytest.raises(ArchiveLimitError): budget.member()
+
+
+def test_budget_counts_written_bytes():
+    budget = ExtractBudget(100, max_bytes=1000, max_ratio=0, max_members=0)
+    budget.add(600)
+    with pytest.raises(ArchiveLimitError): budget.add(600)
+    # Ошибка общая для всех потоков: следующий блок тоже отклоняется
+    with pytest.raises(ArchiveLimitError): budget.add(1)
+
+
+def test_budget_ratio_applies_above_minimum_only():
+    budget = ExtractBudget(1024, max_bytes=0, max_ratio=10, max_members=0)
+    budget.add(main.UNPACK_RATIO_MIN_BYTES)
+    with pytest.raises(ArchiveLimitError): budget.add(1)
+
+
+@pytest.mark.parametrize("name", ["../evil.txt", "a/../../evil.txt", "/etc/evil", "\\evil.txt", "C:/evil.txt", "..\\evil.txt", "./"])
+def test_member_target_rejects_unsafe_paths(tmp_path, name):
+    with pytest.raises(ArchiveLimitError): main._member_target(str(tmp_path), name)
+
+
+def test_member_target_keeps_subfolders(tmp_path):
+    assert main._member_target(str(tmp_path), "a/./b\\c.txt") == os.path.join(str(tmp_path), "a", "b", "c.txt")
+
+
+def test_zip_extracts_with_subfolders(tmp_path):
+    archive = make_zip(tmp_path / "ok.zip", {"a.txt": "a", "docs/b.txt": "b"})
+    out = tmp_path / "out"
+    files = extract_archive(archive, out, max_bytes=MB, max_ratio=100, max_members=10)
+    assert sorted(files) == sorted([str(out / "a.txt"), str(out / "docs" / "b.txt")])
+    assert listing(out) == ["a.txt", "docs/b.txt"]
+
+
+@pytest.mark.parametrize("maker,suffix", [(make_zip, ".zip"), (make_tar, ".tar.gz")])
+def test_path_traversal_is_rejected(tmp_path, maker, suffix):
+    archive = maker(tmp_path / f"evil{suffix}", {"../evil.txt": b"x"})
+    with pytest.raises(ArchiveLimitError): extract_archive(archive, tmp_path / "out")
+    assert not (tmp_path / "evil.txt").exists()
+
+
+def test_zip_member_limit(tmp_path):
+    archive = make_zip(tmp_path / "many.zip", {f"{i}.txt": "x" for i in range(3)})
+    with pytest.raises(ArchiveLimitError): extract_archive(archive, tmp_path / "out", max_members=2)
+
+
+def test_zip_declared_size_limit_checked_before_writing(tmp_path):
+    archive = make_zip(tmp_path / "big.zip", {"a.bin": b"\0" * 4096})
+    with pytest.raises(ArchiveLimitError): extract_archive(archive, tmp_path / "out", max_bytes=1024)
+    assert not (tmp_path / "out").exists() or listing(tmp_path / "out") == []
+
+
+def test_tar_size_limit(tmp_path):
+    archive = make_tar(tmp_path / "big.tar.gz", {"a.bin": b"\0" * 1024, "b.bin": b"\0" * 1024})
+    with pytest.raises(ArchiveLimitError): extract_archive(archive, tmp_path / "out", max_bytes=1500)
+
+
+@pytest.mark.parametrize("kind", ["zip", "gz"])
+def test_compression_bomb_is_rejected(tmp_path, kind):
+    data = b"x" * (main.UNPACK_RATIO_MIN_BYTES + MB)
+    if kind == "zip":
+        archive = make_zip(tmp_path / "bomb.zip", {"bomb.bin": data})
+    else:
+        archive = tmp_path / "bomb.bin.gz"
+        archive.write_bytes(gzip.compress(data))
+    with pytest.raises(ArchiveLimitError): extract_archive(archive, tmp_path / "out", max_ratio=10)
+
+
+def unpack(src, dest, archive, monkeypatch=None, fail_notify=False):
+    sorter = main._cli_sorter(src, dest)
+    try:
+        if fail_notify:
+            def log_success(*args, **kwargs): raise RuntimeError("database is locked")
+            monkeypatch.setattr(sorter, "log_success", log_success)
+        sorter.handle_archive(archive, dest, "archives")
+    finally:
+        sorter.shutdown()
+
+
+def test_error_after_unpacking_keeps_archive_and_files(isolated, monkeypatch):
+    src, dest = isolated
+    archive = make_zip(src / "photos.zip", {"a.txt": "a"})
+    with pytest.raises(RuntimeError): unpack(src, dest, archive, monkeypatch, fail_notify=True)
+    assert listing(dest) == ["photos/a.txt", "photos/photos.zip"]
+
+
+def test_archive_does_not_overwrite_member_with_same_name(isolated):
+    src, dest = isolated
+    archive = make_zip(src / "photos.zip", {"photos.zip": "inner"})
+    unpack(src, dest, archive)
+    assert listing(dest) == ["photos/photos.zip", "photos/photos_(1).zip"]
+    assert (dest / "photos" / "photos.zip").read_text() == "inner"
@@ -0,0 +1,138 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+import pytest
+
+import main
+from main import OperationJournal, calculate_hash
+
+
+def write_journal(directory, records, name="x4_journal.1-1.journal", tail=""):
+    path = directory / name
+    path.write_text("".join(json.dumps(record) + "\n" for record in records) + tail, encoding="utf-8")
+    return path
+
+
+@pytest.fixture
+def files(tmp_path):
+    src, dst = tmp_path / "src.bin", tmp_path / "dst.bin"
+    src.write_bytes(b"payload" * 1000)
+    return src, dst
+
+
+def intent(src, dst, op=1):
+    return {"op": op, "state": "intent", "src": str(src), "dst": str(dst)}
+
+
+def copied(path, op=1, algorithm="sha256"):
+    return {"op": op, "state": "copied", "hash": calculate_hash(path, algorithm), "algorithm": algorithm}
+
+
+def recover(directory):
+    return OperationJournal(directory).recover()
+
+
+def test_copy_not_started_keeps_source(tmp_path, files):
+    src, dst = files
+    journal = write_journal(tmp_path, [intent(src, dst)])
+    assert recover(tmp_path) == [(str(src), str(dst), "not_started")]
+    assert src.exists() and not dst.exists()
+    assert not journal.exists()
+
+
+def test_finished_copy_with_source_removed_is_completed(tmp_path, files):
+    src, dst = files
+    src.rename(dst)
+    write_journal(tmp_path, [intent(src, dst), copied(dst)])
+    assert recover(tmp_path) == [(str(src), str(dst), "completed")]
+    assert dst.exists()
+
+
+def test_verified_copy_is_replayed(tmp_path, files):
+    src, dst = files
+    dst.write_bytes(src.read_bytes())
+    write_journal(tmp_path, [intent(src, dst), copied(dst)])
+    assert recover(tmp_path) == [(str(src), str(dst), "replayed")]
+    assert not src.exists() and dst.exists()
+
+
+def test_copy_with_wrong_hash_is_rolled_back(tmp_path, files):
+    src, dst = files
+    dst.write_bytes(src.read_bytes())
+    record = copied(dst)
+    # Размер и время совпадают, а содержимое нет — как у копии, не дошедшей до диска
+    dst.write_bytes(b"\0" * src.stat().st_size)
+    write_journal(tmp_path, [intent(src, dst), record])
+    assert recover(tmp_path) == [(str(src), str(dst), "rolled_back")]
+    assert src.exists() and not dst.exists()
+
+
+def test_copy_without_hash_record_is_rolled_back(tmp_path, files):
+    src, dst = files
+    dst.write_bytes(src.read_bytes()[:100])
+    write_journal(tmp_path, [intent(src, dst)])
+    assert recover(tmp_path) == [(str(src), str(dst), "rolled_back")]
+    assert src.exists() and not dst.exists()
+
+
+def test_both_missing_is_lost(tmp_path):
+    write_journal(tmp_path, [intent(tmp_path / "gone", tmp_path / "never")])
+    assert recover(tmp_path) == [(str(tmp_path / "gone"), str(tmp_path / "never"), "lost")]
+
+
+def test_closed_operations_and_torn_tail_are_ignored(tmp_path, files):
+    src, dst = files
+    other = tmp_path / "other.bin"
+    records = [intent(src, dst, op=1), {"op": 1, "state": "done"},
+               intent(other, tmp_path / "x", op=2), {"op": 2, "state": "abort"}]
+    write_journal(tmp_path, records, tail='{"op": 3, "state": "inte')
+    assert recover(tmp_path) == []
+    assert src.exists()
+
+
+def test_journal_of_running_process_is_skipped(tmp_path, files):
+    src, dst = files
+    running = OperationJournal(tmp_path)
+    op = running.begin(src, dst)
+    time.sleep(0.01)  # Имя журнала включает миллисекунды запуска
+    assert recover(tmp_path) == []
+    assert running.path.exists()
+    running.finish(op)
+    running.close()
+    assert not running.path.exists()
+
+
+def journaled_move(journal, src, dst):
+    ops = []
+    main.move_file(src, dst, before_copy=lambda: ops.append(journal.begin(src, dst)),
+                   after_copy=lambda digest: journal.copied(ops[0], digest, main.get_hash_algorithm()))
+    for op in ops: journal.finish(op)
+    journal.flush()
+    if not journal.path.exists(): return []
+    return [json.loads(line)["state"] for line in journal.path.read_text(encoding="utf-8").splitlines()]
+
+
+def test_rename_on_same_device_is_not_journaled(tmp_path, files):
+    src, dst = files
+    assert journaled_move(OperationJournal(tmp_path), src, dst) == []
+    assert dst.exists()
+
+
+def test_copy_between_devices_is_journaled(tmp_path, files):
+    src, _ = files
+    other = Path("/dev/shm")
+    if not other.is_dir() or os.stat(other).st_dev == os.stat(tmp_path).st_dev:
+        pytest.skip("нет второго диска")
+    target = Path(tempfile.mkdtemp(dir=other))
+    try:
+        journal = OperationJournal(tmp_path)
+        assert journaled_move(journal, src, target / "dst.bin") == ["intent", "copied", "done"]
+        journal.close()
+        assert not src.exists() and (target / "dst.bin").exists()
+        assert not journal.path.exists()
+    finally:
+        shutil.rmtree(target)
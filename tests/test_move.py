@@ -0,0 +1,61 @@
+import pytest
+
+import main
+
+
+@pytest.fixture
+def src(tmp_path):
+    path = tmp_path / "src.bin"
+    path.write_bytes(b"payload" * 10000)
+    return path
+
+
+def test_copy_with_hash_keeps_existing_destination(tmp_path, src):
+    dst = tmp_path / "dst.bin"
+    dst.write_bytes(b"someone else's file")
+    with pytest.raises(FileExistsError): main.copy_with_hash(src, dst)
+    assert dst.read_bytes() == b"someone else's file"
+
+
+def test_copy_with_hash_returns_source_hash(tmp_path, src):
+    dst = tmp_path / "dst.bin"
+    assert main.copy_with_hash(src, dst, verify=True) == main.calculate_hash(src)
+    assert dst.read_bytes() == src.read_bytes()
+
+
+def test_copy_file_fast_keeps_existing_destination(tmp_path, src):
+    dst = tmp_path / "dst.bin"
+    dst.write_bytes(b"someone else's file")
+    with pytest.raises(FileExistsError): main.copy_file_fast(src, dst)
+    assert dst.read_bytes() == b"someone else's file"
+
+
+def test_short_kernel_copy_falls_back_to_next_strategy(tmp_path, src, monkeypatch):
+    # Как copy_file_range на ФС, которая сразу отвечает 0 без ошибки
+    monkeypatch.setattr(main, "COPY_STRATEGIES", {**main.COPY_STRATEGIES, "copy_file_range": lambda fin, fout: None})
+    dst = tmp_path / "dst.bin"
+    main.copy_file_fast(src, dst)
+    assert dst.read_bytes() == src.read_bytes()
+
+
+def test_short_copy_with_explicit_strategy_fails_and_keeps_source(tmp_path, src, monkeypatch):
+    monkeypatch.setattr(main, "COPY_STRATEGIES", {**main.COPY_STRATEGIES, "copy_file_range": lambda fin, fout: None})
+    dst = tmp_path / "dst.bin"
+    with pytest.raises(OSError): main.copy_file_fast(src, dst, strategy="copy_file_range")
+    assert not dst.exists() and src.exists()
+
+
+class ShortWriter:
+    # Небуферизованный файл, записывающий не больше 1000 байт за вызов
+    def __init__(self, raw):
+        self.raw = raw
+
+    def write(self, data):
+        return self.raw.write(data[:1000])
+
+
+def test_short_writes_are_completed(tmp_path, src):
+    dst = tmp_path / "dst.bin"
+    with open(src, "rb", buffering=0) as fin, open(dst, "wb", buffering=0) as raw:
+        main._copy_readinto(fin, ShortWriter(raw))
+    assert dst.read_bytes() == src.read_bytes()
@@ -0,0 +1,62 @@
+import threading
+
+from main import NameAllocator
+
+
+def test_free_name_is_returned_as_is(tmp_path):
+    assert NameAllocator().allocate(tmp_path, "a.txt") == tmp_path / "a.txt"
+
+
+def test_numbering_continues_after_existing_copies(tmp_path):
+    for name in ["a.txt", "a_(1).txt", "a_(2).txt", "a_(3).txt"]: (tmp_path / name).write_text("x")
+    allocator = NameAllocator()
+    assert allocator.allocate(tmp_path, "a.txt").name == "a_(4).txt"
+    # Следующий номер берется из памяти — одна проверка на диске
+    probes = allocator.probes
+    assert allocator.allocate(tmp_path, "a.txt").name == "a_(5).txt"
+    assert allocator.probes == probes + 1
+
+
+def test_first_number_found_in_logarithmic_probes(tmp_path):
+    for i in range(200): (tmp_path / (f"a_({i}).txt" if i else "a.txt")).write_text("x")
+    allocator = NameAllocator()
+    assert allocator.allocate(tmp_path, "a.txt").name == "a_(200).txt"
+    assert allocator.probes < 25
+
+
+def test_name_taken_behind_allocators_back_is_skipped(tmp_path):
+    allocator = NameAllocator()
+    assert allocator.allocate(tmp_path, "a.txt").name == "a.txt"
+    (tmp_path / "a_(1).txt").write_text("x")
+    assert allocator.allocate(tmp_path, "a.txt").name == "a_(2).txt"
+
+
+def test_issued_names_are_reserved_until_written(tmp_path):
+    allocator = NameAllocator()
+    names = [allocator.allocate(tmp_path, "a.txt").name for _ in range(3)]
+    assert names == ["a.txt", "a_(1).txt", "a_(2).txt"]
+    # Другой аллокатор о резервах не знает — файлов на диске еще нет
+    assert NameAllocator().allocate(tmp_path, "a.txt").name == "a.txt"
+
+
+def test_concurrent_allocations_are_unique(tmp_path):
+    allocator = NameAllocator()
+    names = []
+    lock = threading.Lock()
+    def worker():
+        for _ in range(50):
+            name = allocator.allocate(tmp_path, "a.txt").name
+            with lock: names.append(name)
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for thread in threads: thread.start()
+    for thread in threads: thread.join()
+    assert len(names) == len(set(names)) == 400
+
+
+def test_folders_and_names_are_counted_separately(tmp_path):
+    other = tmp_path / "other"
+    other.mkdir()
+    allocator = NameAllocator()
+    allocator.allocate(tmp_path, "a.txt")
+    assert allocator.allocate(other, "a.txt").name == "a.txt"
+    assert allocator.allocate(tmp_path, "b.txt").name == "b.txt"
@@ -0,0 +1,73 @@
+import os
+
+import pytest
+
+import main
+
+
+def tree(root):
+    return sorted(p.relative_to(root).as_posix() for p in root.rglob("*")) if root.exists() else []
+
+
+def plan(src, dest):
+    sorter = main._cli_sorter(src, dest, dry_run=True)
+    try: return sorter.build_plan()
+    finally: sorter.shutdown()
+
+
+def apply(src, dest, entries):
+    sorter = main._cli_sorter(src, dest)
+    try: return sorter.apply_plan(entries)
+    finally: sorter.shutdown()
+
+
+@pytest.mark.parametrize("suffix", [".json", ".csv"])
+def test_plan_then_apply_round_trip(isolated, tmp_path, suffix):
+    src, dest = isolated
+    (src / "report.txt").write_text("report")
+    (src / "report copy.txt").write_text("report")
+    (src / "photo.jpg").write_bytes(b"\xff\xd8jpeg")
+
+    entries = plan(src, dest)
+    # План ничего не трогает: ни назначение, ни источник
+    assert tree(dest) == []
+    assert tree(src) == ["photo.jpg", "report copy.txt", "report.txt"]
+    actions = sorted(entry["action"] for entry in entries)
+    assert actions == ["duplicate", "move", "move"]
+
+    plan_path = tmp_path / f"plan{suffix}"
+    main.write_plan(entries, plan_path, {"source_folder": str(src), "base_destination": str(dest)})
+    header, loaded = main.read_plan(plan_path)
+    assert [entry["source"] for entry in loaded] == [entry["source"] for entry in entries]
+    if suffix == ".json": assert header["base_destination"] == str(dest)
+
+    results = apply(src, dest, loaded)
+    assert results == {"move": 2, "duplicate": 1}
+    assert tree(src) == []
+    for entry in entries:
+        if entry["action"] == "move": assert os.path.exists(entry["target"])
+    assert len(list((dest / main.DUPLICATE_FOLDER).iterdir())) == 1
+
+
+def test_plan_finds_duplicates_already_in_destination(isolated):
+    src, dest = isolated
+    (src / "a.txt").write_text("same")
+    apply(src, dest, plan(src, dest))
+    (src / "b.txt").write_text("same")
+    before = tree(dest)
+
+    entries = plan(src, dest)
+    assert [entry["action"] for entry in entries] == ["duplicate"]
+    assert entries[0]["original"] == "a.txt"
+    assert tree(dest) == before
+
+
+def test_apply_skips_files_changed_after_planning(isolated):
+    src, dest = isolated
+    (src / "notes.txt").write_text("v1")
+    entries = plan(src, dest)
+    (src / "notes.txt").write_text("version 2")
+
+    assert apply(src, dest, entries) == {"changed": 1}
+    assert (src / "notes.txt").read_text() == "version 2"
+    assert not os.path.exists(entries[0]["target"])
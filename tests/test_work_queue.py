@@ -0,0 +1,78 @@
+import threading
+import time
+
+import main
+from main import PRIORITY_BULK, PRIORITY_LIVE, WorkQueue
+
+
+def make_queue(maxsize=1000):
+    # Один поток, занятый первой задачей, пока тест не откроет gate
+    gate = threading.Event()
+    done = []
+    def handler(path):
+        if path == "blocker": gate.wait(5)
+        done.append(path)
+    queue = WorkQueue(handler, workers=1, maxsize=maxsize)
+    queue.submit("blocker", PRIORITY_BULK, 0)
+    while not queue.stats()["active"]: time.sleep(0.001)
+    return queue, gate, done
+
+
+def test_live_first_then_smaller_then_fifo():
+    queue, gate, done = make_queue()
+    queue.submit("bulk-big", PRIORITY_BULK, 500)
+    queue.submit("bulk-small-1", PRIORITY_BULK, 10)
+    queue.submit("bulk-small-2", PRIORITY_BULK, 10)
+    queue.submit("live-big", PRIORITY_LIVE, 10 ** 9)
+    gate.set()
+    assert queue.join(5)
+    assert done == ["blocker", "live-big", "bulk-small-1", "bulk-small-2", "bulk-big"]
+    queue.shutdown()
+
+
+def test_sources_are_served_round_robin():
+    queue, gate, done = make_queue()
+    for i in range(3): queue.submit(f"a{i}", PRIORITY_BULK, 1, source="a")
+    for i in range(3): queue.submit(f"b{i}", PRIORITY_BULK, 1, source="b")
+    gate.set()
+    assert queue.join(5)
+    assert done[1:] == ["a0", "b0", "a1", "b1", "a2", "b2"]
+    queue.shutdown()
+
+
+def test_full_queue_blocks_bulk_but_keeps_live_reserve():
+    queue, gate, done = make_queue(maxsize=2)
+    assert queue.submit("bulk-1", PRIORITY_BULK, 1)
+    assert queue.submit("bulk-2", PRIORITY_BULK, 1)
+    # Места нет — постановка ждет и по таймауту отказывает
+    assert not queue.submit("bulk-3", PRIORITY_BULK, 1, timeout=0.05)
+    for i in range(main.QUEUE_LIVE_RESERVE):
+        assert queue.submit(f"live-{i}", PRIORITY_LIVE, 1, timeout=0.05)
+    assert not queue.submit("live-extra", PRIORITY_LIVE, 1, timeout=0.05)
+    gate.set()
+    assert queue.join(5)
+    assert "bulk-3" not in done and len(done) == 3 + main.QUEUE_LIVE_RESERVE
+    queue.shutdown()
+
+
+def test_waiting_submit_resumes_when_space_frees():
+    queue, gate, done = make_queue(maxsize=1)
+    assert queue.submit("bulk-1", PRIORITY_BULK, 1)
+    accepted = []
+    waiter = threading.Thread(target=lambda: accepted.append(queue.submit("bulk-2", PRIORITY_BULK, 1, timeout=5)))
+    waiter.start()
+    waiter.join(0.1)
+    assert waiter.is_alive()
+    gate.set()
+    waiter.join(5)
+    assert accepted == [True]
+    assert queue.join(5)
+    assert done == ["blocker", "bulk-1", "bulk-2"]
+    queue.shutdown()
+
+
+def test_submit_after_shutdown_is_rejected():
+    queue = WorkQueue(lambda path: None, workers=1)
+    queue.shutdown()
+    assert queue.closed()
+    assert not queue.submit("late", PRIORITY_LIVE, 1)